@@ -0,0 +1,193 @@
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+
+from .ags_utils import create_session
+from .logging_io import setup_logger
+
+log = setup_logger(__name__)
+
+# Maximum number of keep-alive connections kept open to each ArcGIS Server instance
+default_pool_maxsize = int(os.getenv('AGS_SERVICE_PUBLISHER_POOL_MAXSIZE', 10))
+
+
+class AdminClient:
+    """Connection details and a pooled session for the ArcGIS Server REST API of a single instance.
+    The session keeps its connections alive between requests, so the TLS handshake is only paid once per connection
+    rather than once per operation.
+    If a token_provider is given, it is called to get the current token each time the token is used, so that tokens
+    refreshed by a TokenManager are picked up mid-job."""
+
+    def __init__(
+        self,
+        server_url,
+        token=None,
+        proxies=None,
+        ciphers=None,
+        pool_maxsize=default_pool_maxsize,
+        ags_instance=None,
+        token_provider=None
+    ):
+        self.url = server_url
+        self._token = token
+        self.token_provider = token_provider
+        self.proxies = proxies
+        self.ciphers = ciphers
+        self.ags_instance = ags_instance
+        self.session = create_session(server_url, proxies, ciphers, pool_maxsize)
+
+    @property
+    def token(self):
+        if self.token_provider:
+            return self.token_provider()
+        return self._token
+
+    @token.setter
+    def token(self, token):
+        self._token = token
+
+    @classmethod
+    def from_user_config(
+        cls,
+        user_config,
+        env_name,
+        ags_instance,
+        pool_maxsize=default_pool_maxsize,
+        token_manager=None
+    ):
+        ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
+        return cls(
+            ags_instance_props['url'],
+            ags_instance_props.get('token'),
+            ags_instance_props.get('proxies') or user_config.get('proxies'),
+            ags_instance_props.get('ciphers') or user_config.get('ciphers'),
+            pool_maxsize,
+            ags_instance,
+            get_token_provider(user_config, env_name, ags_instance, token_manager)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+
+class AdminClientPool:
+    """Keeps one AdminClient per ArcGIS Server instance for the duration of a job.
+    If a TokenManager is given, the clients get their tokens from it."""
+
+    def __init__(self, pool_maxsize=default_pool_maxsize, token_manager=None):
+        self.pool_maxsize = pool_maxsize
+        self.token_manager = token_manager
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._users = 0
+
+    def get(self, user_config, env_name, ags_instance):
+        ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
+        key = (env_name, ags_instance, ags_instance_props['url'])
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                log.debug(f'Creating admin client for ArcGIS Server instance {ags_instance} ({ags_instance_props["url"]})')
+                client = self._clients[key] = AdminClient.from_user_config(
+                    user_config,
+                    env_name,
+                    ags_instance,
+                    self.pool_maxsize,
+                    self.token_manager
+                )
+            else:
+                # Pick up tokens that were refreshed since the client was created
+                client.token = ags_instance_props.get('token')
+        return client
+
+    def acquire(self):
+        with self._lock:
+            self._users += 1
+
+    def release(self):
+        """Closes the clients once the last user of the pool has released it."""
+        with self._lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+
+# The pool of the job running in the current context. It is propagated to the threads started by the job through
+# with_log_context, so that concurrent jobs in other threads each keep their own pool and token manager.
+_active_pool = contextvars.ContextVar('admin_client_pool', default=None)
+
+
+def get_token_provider(user_config, env_name, ags_instance, token_manager=None):
+    """Returns a function that gets the current token for an ArcGIS Server instance from the given TokenManager, or
+    from that of the active admin_client_pool, or None if there is no TokenManager."""
+    pool = _active_pool.get()
+    if token_manager is None and pool is not None:
+        token_manager = pool.token_manager
+    if token_manager is None:
+        return None
+    return functools.partial(token_manager.get_token, user_config, env_name, ags_instance)
+
+
+@contextlib.contextmanager
+def admin_client_pool(pool_maxsize=default_pool_maxsize, token_manager=None):
+    """Shares one admin client per ArcGIS Server instance among all admin_client calls made while the context is
+    active, including from threads started through with_log_context, and closes them once its last user exits.
+    Nested contexts reuse the outer pool, unless they use a different token_manager."""
+    pool = _active_pool.get()
+    if pool is not None and token_manager in (None, pool.token_manager):
+        pool.acquire()
+        try:
+            yield pool
+        finally:
+            pool.release()
+        return
+    pool = AdminClientPool(pool_maxsize, token_manager)
+    pool.acquire()
+    token = _active_pool.set(pool)
+    try:
+        yield pool
+    finally:
+        try:
+            _active_pool.reset(token)
+        except ValueError:
+            # The context was exited in a different context than it was entered in (e.g. a generator closed by
+            # another thread), which still has its own value
+            pass
+        pool.release()
+
+
+@contextlib.contextmanager
+def admin_client(user_config, env_name, ags_instance):
+    """Yields the admin client for an ArcGIS Server instance from the active admin_client_pool, or a new client that
+    is closed on exit if no pool is active."""
+    pool = _active_pool.get()
+    if pool is not None:
+        yield pool.get(user_config, env_name, ags_instance)
+    else:
+        with AdminClient.from_user_config(user_config, env_name, ags_instance) as client:
+            yield client
+
+
+def with_admin_client_pool(func):
+    """Runs func inside an admin_client_pool, e.g. for the duration of a Runner job.
+    If func is a method of an object with a token_manager attribute (such as a Runner), the pool uses it."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token_manager = getattr(args[0], 'token_manager', None) if args else None
+        with admin_client_pool(token_manager=token_manager):
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -1,8 +1,11 @@
 import os
+import functools
 import getpass
+import io
 import json
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from distutils.util import strtobool
 from ssl import create_default_context
 from urllib3.poolmanager import PoolManager
@@ -12,22 +15,46 @@ import requests
 from requests.compat import urljoin
 from requests.adapters import HTTPAdapter
 
+from .hedging import hedged_post
 from .helpers import split_quoted_string, unquote_string, deep_get
-from .logging_io import setup_logger
+from .logging_io import setup_logger, with_log_context
+from .manifest_cache import add_manifest_to_cache, default_use_manifest_cache, get_cached_manifest, get_manifest_stamp
+from .response_cache import cached_post, invalidate_cached_service
+from .retry import (
+    RetryPolicy,
+    default_timeout,
+    get_backoff_intervals,
+    get_circuit_breaker,
+    get_rate_limiter,
+    idempotent_requests,
+    is_idempotent_request,
+    long_operation_timeout
+)
 
 log = setup_logger(__name__)
 
 
-def create_session(server_url, proxies=None, ciphers=None):
+def create_session(server_url, proxies=None, ciphers=None, pool_maxsize=None, retry_policy=None):
     session = requests.Session()
     if proxies:
         session.proxies = proxies
-    adapter = SSLContextAdapter(ciphers=ciphers)
+    adapter = SSLContextAdapter(
+        ciphers=ciphers,
+        retry_policy=retry_policy or RetryPolicy(),
+        rate_limiter=get_rate_limiter(server_url),
+        circuit_breaker=get_circuit_breaker(server_url),
+        **({'pool_maxsize': pool_maxsize} if pool_maxsize else {})
+    )
     session.mount(server_url, adapter)
     return session
 
 
 def generate_token(server_url, username=None, password=None, expiration=15, ags_instance=None, session=None):
+    return generate_token_info(server_url, username, password, expiration, ags_instance, session)['token']
+
+
+def generate_token_info(server_url, username=None, password=None, expiration=15, ags_instance=None, session=None):
+    """Generates a token, returning a dictionary with the token and its expiry time (in milliseconds since the epoch)."""
     username, password = prompt_for_credentials(username, password, ags_instance)
     log.info('Generating token (URL: {}, user: {})'.format(server_url, username))
     url = urljoin(server_url, '/arcgis/admin/generateToken')
@@ -51,7 +78,10 @@ def generate_token(server_url, username=None, password=None, expiration=15, ags_
             'Successfully generated token (URL: {}, user: {}, expires: {}'
             .format(server_url, username, data['expires'])
         )
-        return data['token']
+        return {
+            'token': data['token'],
+            'expires': int(data['expires'])
+        }
     except Exception:
         log.exception('An error occurred while generating token (URL: {}, user: {})'.format(server_url, username))
         raise
@@ -61,7 +91,7 @@ def get_site_mode(server_url, token, session=None):
     log.debug('Getting site mode (URL: {})'.format(server_url))
     url = urljoin(server_url, 'arcgis/admin/mode')
     try:
-        r = session.post(url, params={'f': 'json'}, data={'token': token})
+        r = hedged_post(session, url, params={'f': 'json'}, data={'token': token})
         log.debug('Request URL: {}'.format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -82,7 +112,7 @@ def set_site_mode(server_url, token, site_mode, session=None):
     log.debug('Setting site mode to {} (URL: {})'.format(site_mode, server_url))
     url = urljoin(server_url, 'arcgis/admin/mode/update')
     try:
-        r = session.post(url, params={'f': 'json', 'siteMode': site_mode, 'runAsync': False}, data={'token': token})
+        r = session.post(url, params={'f': 'json', 'siteMode': site_mode, 'runAsync': False}, data={'token': token}, timeout=long_operation_timeout)
         log.debug('Request URL: {}'.format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -101,11 +131,14 @@ def set_site_mode(server_url, token, site_mode, session=None):
         raise
 
 
-def list_data_stores(server_url, token, session=None):
+def list_data_stores(server_url, token, session=None, max_concurrent_requests=8):
+    """Yields the data store items registered with an ArcGIS Server instance. The items under each root item are found
+    with up to max_concurrent_requests concurrent requests, and yielded as soon as each request completes."""
     log.debug('Listing data stores (URL: {})'.format(server_url))
     url = urljoin(server_url, '/arcgis/admin/data/items')
     try:
-        r = session.post(
+        r = cached_post(
+            session,
             url,
             params={
                 'f': 'json',
@@ -120,54 +153,71 @@ def list_data_stores(server_url, token, session=None):
         if data.get('status') == 'error':
             raise RuntimeError(data.get('messages'))
         root_items = data.get('rootItems', tuple())
-        data_stores = []
-        for root_item in root_items:
-            url = urljoin(server_url, '/arcgis/admin/data/findItems')
-            r = session.post(
-                url,
-                params={
-                    'f': 'json',
-                    'ancestorPath': root_item,
-                },
-                data={
-                    'token': token,
-                }
-            )
-            assert (r.status_code == 200)
-            data = r.json()
-            if data.get('status') == 'error':
-                raise RuntimeError(data.get('messages'))
-            for item in data.get('items', tuple()):
-                item_path = item.get('path', 'n/a')
-                item_type = item.get('type', 'n/a')
-                file_path = deep_get(item, 'info.path', 'n/a')
-                conn_props = parse_connection_string(deep_get(item, 'info.connectionString', dict()))
-                user = conn_props.get('USER', 'n/a')
-                version = conn_props.get('VERSION', 'n/a')
-                database = get_database_from_connection_properties(conn_props)
-                data_stores.append(dict(
-                    item_path=item_path,
-                    item_type=item_type,
-                    file_path=file_path,
-                    user=user,
-                    version=version,
-                    database=database,
-                ))
-        log.debug(
-            'Data stores (URL {}): {}'
-            .format(r.url, json.dumps(data_stores, indent=4))
-        )
-        return data_stores
+        if not root_items:
+            return
+        with ThreadPoolExecutor(
+            min(max_concurrent_requests, len(root_items)),
+            thread_name_prefix='ListDataStores'
+        ) as executor:
+            futures = [
+                executor.submit(with_log_context(find_data_store_items), server_url, token, root_item, session)
+                for root_item in root_items
+            ]
+            for future in as_completed(futures):
+                data_stores = future.result()
+                log.debug(
+                    'Data stores (URL {}): {}'
+                    .format(server_url, json.dumps(data_stores, indent=4))
+                )
+                yield from data_stores
     except Exception:
         log.exception('An error occurred while listing data stores (URL: {})'.format(server_url))
         raise
 
 
+def find_data_store_items(server_url, token, ancestor_path, session=None):
+    url = urljoin(server_url, '/arcgis/admin/data/findItems')
+    r = cached_post(
+        session,
+        url,
+        params={
+            'f': 'json',
+            'ancestorPath': ancestor_path,
+        },
+        data={
+            'token': token,
+        }
+    )
+    log.debug('Request URL: {}'.format(r.url))
+    assert (r.status_code == 200)
+    data = r.json()
+    if data.get('status') == 'error':
+        raise RuntimeError(data.get('messages'))
+    data_stores = []
+    for item in data.get('items', tuple()):
+        item_path = item.get('path', 'n/a')
+        item_type = item.get('type', 'n/a')
+        file_path = deep_get(item, 'info.path', 'n/a')
+        conn_props = parse_connection_string(deep_get(item, 'info.connectionString', dict()))
+        user = conn_props.get('USER', 'n/a')
+        version = conn_props.get('VERSION', 'n/a')
+        database = get_database_from_connection_properties(conn_props)
+        data_stores.append(dict(
+            item_path=item_path,
+            item_type=item_type,
+            file_path=file_path,
+            user=user,
+            version=version,
+            database=database,
+        ))
+    return data_stores
+
+
 def list_service_folders(server_url, token, session=None):
     log.debug('Listing service folders (URL: {})'.format(server_url))
     url = urljoin(server_url, '/arcgis/admin/services')
     try:
-        r = session.post(url, params={'f': 'json'}, data={'token': token})
+        r = cached_post(session, url, params={'f': 'json'}, data={'token': token})
         log.debug('Request URL: {}'.format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -198,7 +248,7 @@ def list_services(server_url, token, service_folder=None, session=None):
         )
     )
     try:
-        r = session.post(url, params={'f': 'json'}, data={'token': token})
+        r = cached_post(session, url, params={'f': 'json'}, data={'token': token})
         log.debug('Request URL: {}'.format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -218,7 +268,56 @@ def list_services(server_url, token, service_folder=None, session=None):
         raise
 
 
-def list_service_workspaces(server_url, token, service_name, service_folder=None, service_type='MapServer', session=None):
+def get_service_folder_report(server_url, token, service_folder=None, parameters=('STATUS',), session=None):
+    """Gets a report of every service in a service folder in a single request, including the sections specified in
+    parameters (e.g. STATUS, PROPERTIES, INSTANCES, SDS, ITEMINFO)."""
+    log.debug('Getting report for services (URL: {}, Folder: {})'.format(server_url, service_folder))
+    url = urljoin(
+        server_url,
+        '/'.join(
+            (
+                part for part in (
+                    '/arcgis/admin/services',
+                    service_folder,
+                    'report'
+                ) if part
+            )
+        )
+    )
+    try:
+        r = hedged_post(session, url, params={'f': 'json'}, data={'token': token, 'parameters': json.dumps(list(parameters))})
+        log.debug('Request URL: {}'.format(r.url))
+        assert (r.status_code == 200)
+        data = r.json()
+        if data.get('status') == 'error':
+            raise RuntimeError(data.get('messages'))
+        log.debug(
+            '{} services report (URL {}): {}'
+            .format(service_folder, r.url, json.dumps(data, indent=4))
+        )
+        return data['reports']
+    except Exception:
+        log.exception(
+            'An error occurred while getting report for services (URL: {}, Folder: {})'
+            .format(server_url, service_folder)
+        )
+        raise
+
+
+def index_service_folder_report(reports):
+    """Indexes the service reports returned by get_service_folder_report by (service name, service type)."""
+    return {(report['serviceName'], report['type']): report for report in reports}
+
+
+def list_service_workspaces(
+    server_url,
+    token,
+    service_name,
+    service_folder=None,
+    service_type='MapServer',
+    session=None,
+    use_manifest_cache=default_use_manifest_cache
+):
     if service_type == 'GeometryServer':
         log.warn(
             'Unsupported service type {} for service {} in folder {}'
@@ -229,6 +328,53 @@ def list_service_workspaces(server_url, token, service_name, service_folder=None
         'Listing workspaces for service {} (URL: {}, Folder: {})'
         .format(service_name, server_url, service_folder)
     )
+    try:
+        stamp = None
+        databases = None
+        if use_manifest_cache:
+            try:
+                stamp = get_manifest_stamp(
+                    get_service_item_info(server_url, token, service_name, service_folder, service_type, session=session)
+                )
+            except Exception:
+                log.warning('Not using cached manifest for service {}/{}'.format(service_folder, service_name))
+            if stamp:
+                databases = get_cached_manifest(server_url, stamp, service_name, service_folder, service_type)
+        if databases is None:
+            databases = []
+            for database in list_service_manifest_databases(
+                server_url,
+                token,
+                service_name,
+                service_folder,
+                service_type,
+                session
+            ):
+                databases.append(database)
+                yield from get_database_workspaces(database)
+            if stamp:
+                add_manifest_to_cache(server_url, stamp, databases, service_name, service_folder, service_type)
+        else:
+            for database in databases:
+                yield from get_database_workspaces(database)
+    except Exception:
+        log.exception(
+            'An error occurred while listing workspaces for service {}/{}'
+            .format(service_folder, service_name)
+        )
+        raise
+
+
+def list_service_manifest_databases(
+    server_url,
+    token,
+    service_name,
+    service_folder=None,
+    service_type='MapServer',
+    session=None
+):
+    """Downloads the manifest (manifest.xml) of a service, bypassing the response cache, and yields its databases as
+    they are parsed (see parse_databases_from_service_manifest)."""
     url = urljoin(
         server_url,
         '/'.join(
@@ -242,34 +388,30 @@ def list_service_workspaces(server_url, token, service_name, service_folder=None
             )
         )
     )
-    try:
-        r = session.post(url, data={'token': token})
-        log.debug('Request URL: {}'.format(r.url))
-        assert (r.status_code == 200)
-        data = r.text
-        datasets = parse_datasets_from_service_manifest(data)
-
-        for dataset in datasets:
-            dataset_name = dataset['dataset_name']
-            dataset_type = dataset['dataset_type']
-            dataset_path = dataset['dataset_path']
-            by_reference = dataset['by_reference']
-            conn_props = dataset['conn_props']
-            yield dict(
-                user=conn_props.get('USER', 'n/a'),
-                database=get_database_from_connection_properties(conn_props),
-                version=conn_props.get('VERSION', 'n/a'),
-                dataset_name=dataset_name,
-                dataset_type=dataset_type,
-                dataset_path=dataset_path,
-                by_reference=by_reference,
-            )
-    except Exception:
-        log.exception(
-            'An error occurred while listing workspaces for service {}/{}'
-            .format(service_folder, service_name)
+    # Stream the manifest so that its datasets can be parsed as they are downloaded
+    r = hedged_post(session, url, data={'token': token}, stream=True)
+    log.debug('Request URL: {}'.format(r.url))
+    assert (r.status_code == 200)
+    r.raw.decode_content = True
+    with r:
+        yield from parse_databases_from_service_manifest(r.raw)
+
+
+def get_database_workspaces(database):
+    conn_props = database['conn_props']
+    user = conn_props.get('USER', 'n/a')
+    database_name = get_database_from_connection_properties(conn_props)
+    version = conn_props.get('VERSION', 'n/a')
+    for dataset in database['datasets']:
+        yield dict(
+            user=user,
+            database=database_name,
+            version=version,
+            dataset_name=dataset['dataset_name'],
+            dataset_type=dataset['dataset_type'],
+            dataset_path=dataset['dataset_path'],
+            by_reference=database['by_reference'],
         )
-        raise
 
 
 def delete_service(server_url, token, service_name, service_folder=None, service_type='MapServer', session=None):
@@ -288,7 +430,8 @@ def delete_service(server_url, token, service_name, service_folder=None, service
         )
     )
     try:
-        r = session.post(url, params={'f': 'json'}, data={'token': token})
+        r = session.post(url, params={'f': 'json'}, data={'token': token}, timeout=long_operation_timeout)
+        invalidate_cached_service(server_url, service_name, service_folder, service_type)
         log.debug('Request URL: {}'.format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -321,7 +464,7 @@ def get_service_info(server_url, token, service_name, service_folder=None, servi
         )
     )
     try:
-        r = session.post(url, params={'f': 'json'}, data={'token': token})
+        r = cached_post(session, url, params={'f': 'json'}, data={'token': token})
         log.debug('Request URL: {}'. format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -358,7 +501,7 @@ def get_service_item_info(server_url, token, service_name, service_folder=None,
         )
     )
     try:
-        r = session.post(url, params={'f': 'json'}, data={'token': token})
+        r = cached_post(session, url, params={'f': 'json'}, data={'token': token})
         log.debug('Request URL: {}'. format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -419,6 +562,7 @@ def set_service_item_info(server_url, token, item_info, service_name, service_fo
                 )
             ]
         )
+        invalidate_cached_service(server_url, service_name, service_folder, service_type)
         log.debug('Request URL: {}'.format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -455,7 +599,7 @@ def get_service_manifest(server_url, token, service_name, service_folder=None, s
         )
     )
     try:
-        r = session.post(url, params={'f': 'json'}, data={'token': token})
+        r = cached_post(session, url, params={'f': 'json'}, data={'token': token})
         log.debug('Request URL: {}'. format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -492,7 +636,7 @@ def get_service_status(server_url, token, service_name, service_folder=None, ser
         )
     )
     try:
-        r = session.post(url, params={'f': 'json'}, data={'token': token})
+        r = hedged_post(session, url, params={'f': 'json'}, data={'token': token})
         log.debug('Request URL: {}'.format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -511,7 +655,19 @@ def get_service_status(server_url, token, service_name, service_folder=None, ser
         raise
 
 
-def test_service(server_url, token, service_name, service_folder=None, service_type='MapServer', warn_on_errors=False, session=None):
+def test_service(
+    server_url,
+    token,
+    service_name,
+    service_folder=None,
+    service_type='MapServer',
+    warn_on_errors=False,
+    service_status=None,
+    session=None
+):
+    """Tests a service by performing a query appropriate to its type.
+    If service_status is specified (e.g. from get_service_folder_report), it is used instead of requesting the status
+    of the service."""
     log.info('Testing {} service {} (URL {}, Folder: {})'.format(service_type, service_name, server_url, service_folder))
 
     def perform_service_health_check(operation, params, service_status):
@@ -529,7 +685,8 @@ def test_service(server_url, token, service_name, service_folder=None, service_t
             )
         )
         start_time = time.time()
-        r = session.post(url, params=params, data={'token': token})
+        with idempotent_requests():
+            r = session.post(url, params=params, data={'token': token})
         end_time = time.time()
         response_time = end_time - start_time
         log.debug(
@@ -567,7 +724,8 @@ def test_service(server_url, token, service_name, service_folder=None, service_t
         }
 
     try:
-        service_status = get_service_status(server_url, token, service_name, service_folder, service_type, session=session)
+        if service_status is None:
+            service_status = get_service_status(server_url, token, service_name, service_folder, service_type, session=session)
         configured_state = service_status.get('configuredState')
         realtime_state = service_status.get('realTimeState')
         if realtime_state != 'STARTED':
@@ -661,7 +819,7 @@ def stop_service(server_url, token, service_name, service_folder=None, service_t
         )
     )
     try:
-        r = session.post(url, params={'f': 'json'}, data={'token': token})
+        r = session.post(url, params={'f': 'json'}, data={'token': token}, timeout=long_operation_timeout)
         log.debug('Request URL: {}'.format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -695,7 +853,7 @@ def start_service(server_url, token, service_name, service_folder=None, service_
         )
     )
     try:
-        r = session.post(url, params={'f': 'json'}, data={'token': token})
+        r = session.post(url, params={'f': 'json'}, data={'token': token}, timeout=long_operation_timeout)
         log.debug('Request URL: {}'.format(r.url))
         assert (r.status_code == 200)
         data = r.json()
@@ -713,6 +871,254 @@ def start_service(server_url, token, service_name, service_folder=None, service_
         raise
 
 
+def get_batch_service_list(services):
+    """Formats (service_name, service_folder, service_type) tuples as the JSON service list expected by the
+    stopServices and startServices operations."""
+    return json.dumps({
+        'services': [
+            {
+                'folderName': '' if service_folder in (None, '/') else service_folder,
+                'serviceName': service_name,
+                'type': service_type
+            }
+            for service_name, service_folder, service_type in services
+        ]
+    })
+
+
+def stop_services(server_url, token, services, session=None):
+    """Stops a batch of services, given as (service_name, service_folder, service_type) tuples, in a single request."""
+    return batch_service_operation(server_url, token, 'stopServices', services, session)
+
+
+def start_services(server_url, token, services, session=None):
+    """Starts a batch of services, given as (service_name, service_folder, service_type) tuples, in a single request."""
+    return batch_service_operation(server_url, token, 'startServices', services, session)
+
+
+def batch_service_operation(server_url, token, operation, services, session=None):
+    log.info('Performing {} operation on {} services (URL {})'.format(operation, len(services), server_url))
+    url = urljoin(server_url, '/arcgis/admin/services/{}'.format(operation))
+    try:
+        r = session.post(url, params={'f': 'json'}, data={'token': token, 'services': get_batch_service_list(services)}, timeout=long_operation_timeout)
+        log.debug('Request URL: {}'.format(r.url))
+        assert (r.status_code == 200)
+        data = r.json()
+        if data.get('status') == 'error':
+            raise RuntimeError(data.get('messages'))
+        log.info(
+            '{} operation successfully performed on {} services (URL {})'
+            .format(operation, len(services), server_url)
+        )
+    except Exception:
+        log.exception(
+            'An error occurred while performing {} operation on services: {}'
+            .format(operation, ', '.join('{}/{}'.format(service_folder, service_name) for service_name, service_folder, _ in services))
+        )
+        raise
+
+
+def get_service_statuses(server_url, token, services, session=None):
+    """Gets the status of a batch of services, given as (service_name, service_folder, service_type) tuples, using one
+    folder report request per service folder. Returns a dictionary of status dictionaries keyed by service tuple."""
+    service_folders = []
+    for _, service_folder, _ in services:
+        if service_folder not in service_folders:
+            service_folders.append(service_folder)
+    statuses = {}
+    for service_folder in service_folders:
+        report_index = index_service_folder_report(
+            get_service_folder_report(server_url, token, service_folder, session=session)
+        )
+        for service_name, _service_folder, service_type in services:
+            if _service_folder == service_folder:
+                report = report_index.get((service_name, service_type))
+                statuses[(service_name, service_folder, service_type)] = report.get('status', {}) if report else {}
+    return statuses
+
+
+def wait_for_service_state(
+    server_url,
+    token,
+    service_name,
+    service_folder=None,
+    service_type='MapServer',
+    state='STARTED',
+    timeout=300,
+    probe=False,
+    initial_interval=1,
+    max_interval=30,
+    session=None
+):
+    """Polls the status of a service with exponential backoff until its realtime state is the given state and, if probe
+    is True, it also passes test_service, or until timeout seconds have elapsed.
+    Returns a dictionary indicating whether the service became ready, how long it took, how many times it was polled
+    and its last known state."""
+    log.debug(
+        'Waiting for service {} to reach the {} state (URL {}, Folder: {}, timeout: {} seconds)'
+        .format(service_name, state, server_url, service_folder, timeout)
+    )
+    start_time = time.monotonic()
+    deadline = start_time + timeout
+    intervals = get_backoff_intervals(initial_interval, max_interval)
+    polls = 0
+    while True:
+        polls += 1
+        service_status = get_service_status(server_url, token, service_name, service_folder, service_type, session=session)
+        configured_state = service_status.get('configuredState')
+        realtime_state = service_status.get('realTimeState')
+        error_message = None
+        ready = realtime_state == state
+        if ready and probe:
+            test_data = test_service(
+                server_url, token, service_name, service_folder, service_type,
+                warn_on_errors=True, service_status=service_status, session=session
+            )
+            error_message = test_data.get('error_message')
+            ready = test_data.get('realtime_state') == state and not error_message
+        now = time.monotonic()
+        if ready or now >= deadline:
+            break
+        time.sleep(min(next(intervals), deadline - now))
+    elapsed = now - start_time
+    if ready:
+        log.debug(
+            'Service {}/{} reached the {} state after {:.2f} seconds ({} polls)'
+            .format(service_folder, service_name, state, elapsed, polls)
+        )
+    else:
+        log.warn(
+            'Service {}/{} did not reach the {} state within {} seconds (configured state: {}, realtime state: {}, '
+            'error message: {})'
+            .format(service_folder, service_name, state, timeout, configured_state, realtime_state, error_message)
+        )
+    return {
+        'ready': ready,
+        'elapsed': elapsed,
+        'polls': polls,
+        'configured_state': configured_state,
+        'realtime_state': realtime_state,
+        'error_message': error_message
+    }
+
+
+def wait_for_services_state(
+    server_url,
+    token,
+    services,
+    state,
+    timeout=300,
+    initial_interval=1,
+    max_interval=30,
+    session=None
+):
+    """Polls the status of a batch of services with exponential backoff until all of them have reached the given
+    realtime state, or until timeout seconds have elapsed.
+    Returns a dictionary of the number of seconds each service took to reach the state, keyed by service tuple;
+    services that did not reach the state are omitted."""
+    start_time = time.monotonic()
+    deadline = start_time + timeout
+    intervals = get_backoff_intervals(initial_interval, max_interval)
+    pending = list(services)
+    ready_times = {}
+    while pending:
+        statuses = get_service_statuses(server_url, token, pending, session=session)
+        now = time.monotonic()
+        for service in pending:
+            if statuses[service].get('realTimeState') == state:
+                ready_times[service] = now - start_time
+        pending = [service for service in pending if service not in ready_times]
+        if not pending:
+            break
+        if now >= deadline:
+            log.warn(
+                '{} services did not reach the {} state within {} seconds: {}'
+                .format(len(pending), state, timeout, ', '.join('{}/{}'.format(service_folder, service_name) for service_name, service_folder, _ in pending))
+            )
+            break
+        log.debug('Waiting for {} services to reach the {} state'.format(len(pending), state))
+        time.sleep(min(next(intervals), deadline - now))
+    return ready_times
+
+
+def restart_services_in_batches(
+    server_url,
+    token,
+    services,
+    batch_size=25,
+    timeout=300,
+    delay=30,
+    max_retries=3,
+    test_after_restart=True,
+    session=None
+):
+    """Restarts services, given as (service_name, service_folder, service_type) tuples, by stopping and starting them
+    in batches of batch_size with the stopServices and startServices operations, polling their status until they are
+    stopped or started rather than waiting for a fixed delay.
+    Services that fail to restart as part of a batch are retried individually with restart_service, using the given
+    delay and max_retries.
+    Returns a list of the results of restarting each service, as returned by restart_service."""
+    results = {}
+    failed_services = []
+    for i in range(0, len(services), batch_size):
+        batch = services[i:i + batch_size]
+        log.info(
+            'Restarting batch of {} services (URL {}, batch #{} of {})'
+            .format(len(batch), server_url, i // batch_size + 1, (len(services) + batch_size - 1) // batch_size)
+        )
+        try:
+            stop_services(server_url, token, batch, session=session)
+            stop_times = wait_for_services_state(server_url, token, batch, 'STOPPED', timeout, session=session)
+            start_services(server_url, token, batch, session=session)
+            ready_times = wait_for_services_state(server_url, token, batch, 'STARTED', timeout, session=session)
+        except Exception:
+            log.warn('An error occurred while restarting batch of services, retrying them individually', exc_info=True)
+            failed_services.extend(batch)
+            continue
+        for service in batch:
+            service_name, service_folder, service_type = service
+            if service not in ready_times:
+                failed_services.append(service)
+                continue
+            error_message = None
+            if test_after_restart:
+                test_data = test_service(
+                    server_url, token, service_name, service_folder, service_type,
+                    warn_on_errors=True, service_status={'realTimeState': 'STARTED'}, session=session
+                )
+                error_message = test_data.get('error_message')
+                if error_message:
+                    failed_services.append(service)
+                    continue
+            results[service] = {
+                'service_name': service_name,
+                'service_folder': service_folder,
+                'service_type': service_type,
+                'succeeded': True,
+                'attempts': 1,
+                'stop_time': stop_times.get(service),
+                'ready_time': ready_times[service],
+                'configured_state': 'STARTED',
+                'realtime_state': 'STARTED',
+                'error_message': error_message
+            }
+
+    errors = []
+    for service in failed_services:
+        service_name, service_folder, service_type = service
+        log.info('Retrying restart of {} service {}/{} individually'.format(service_type, service_folder, service_name))
+        try:
+            results[service] = restart_service(
+                server_url, token, service_name, service_folder, service_type,
+                delay, max_retries, test_after_restart, timeout, session=session
+            )
+        except Exception as e:
+            errors.append(str(e))
+    if errors:
+        raise RuntimeError(errors)
+    return [results[service] for service in services]
+
+
 def restart_service(
     server_url,
     token,
@@ -722,78 +1128,119 @@ def restart_service(
     delay=30,
     max_retries=3,
     test_after_restart=True,
+    timeout=300,
     session=None
 ):
-    succeeded = False
-    configured_state = None
-    realtime_state = None
-    error_message = None
+    """Restarts a service, waiting for it to stop and then to start (and, if test_after_restart is True, to pass
+    test_service) for at most timeout seconds each, polling its status with exponential backoff.
+    If the service does not become ready, the restart is retried after waiting delay seconds, up to max_retries
+    attempts in total.
+    Returns a dictionary with the number of attempts, the number of seconds the service took to stop and to become
+    ready on the last attempt, and its final state."""
+    stopped = started = {
+        'ready': False,
+        'elapsed': None,
+        'polls': 0,
+        'configured_state': None,
+        'realtime_state': None,
+        'error_message': None
+    }
     retry_count = 0
     while retry_count < max_retries:
+        if retry_count > 0:
+            log.debug(
+                'Waiting {} seconds before retrying restart of service {} (URL {}, Folder: {})'
+                .format(delay, service_name, server_url, service_folder)
+            )
+            time.sleep(delay)
         retry_count += 1
         log.info(
             'Restarting service {} (URL {}, Folder: {}, attempt #{} of {})'
             .format(service_name, server_url, service_folder, retry_count, max_retries)
         )
         stop_service(server_url, token, service_name, service_folder, service_type, session=session)
-        log.debug(
-            'Waiting {} seconds before restarting service {} (URL {}, Folder: {})'
-            .format(delay, service_name, server_url, service_folder)
+        stopped = wait_for_service_state(
+            server_url, token, service_name, service_folder, service_type,
+            'STOPPED', timeout, session=session
         )
-        time.sleep(delay)
         start_service(server_url, token, service_name, service_folder, service_type, session=session)
-        log.debug(
-            'Waiting {} seconds before checking status of service {} (URL {}, Folder: {})'
-            .format(delay, service_name, server_url, service_folder)
+        started = wait_for_service_state(
+            server_url, token, service_name, service_folder, service_type,
+            'STARTED', timeout, probe=test_after_restart, session=session
         )
-        time.sleep(delay)
-        service_status = get_service_status(server_url, token, service_name, service_folder, service_type, session=session)
-        configured_state = service_status.get('configuredState')
-        realtime_state = service_status.get('realTimeState')
-        if realtime_state == 'STARTED':
-            if test_after_restart:
-                test_data = test_service(server_url, token, service_name, service_folder, service_type, warn_on_errors=True, session=session)
-                configured_state = test_data.get('configured_state')
-                realtime_state = test_data.get('realtime_state')
-                error_message = test_data.get('error_message')
-                if realtime_state == 'STARTED' and not error_message:
-                    succeeded = True
-            else:
-                succeeded = True
-            if succeeded:
-                break
+        if started['ready']:
+            break
 
-    if succeeded:
+    configured_state = started['configured_state']
+    realtime_state = started['realtime_state']
+    error_message = started['error_message']
+    if started['ready']:
         log.info(
-            '{} service {}/{} successfully restarted after {} attempts (configured state: {}, realtime state: {})'
-            .format(service_type, service_folder, service_name, retry_count, configured_state, realtime_state)
+            '{} service {}/{} successfully restarted after {} attempts and ready after {:.2f} seconds '
+            '(configured state: {}, realtime state: {})'
+            .format(service_type, service_folder, service_name, retry_count, started['elapsed'], configured_state, realtime_state)
         )
     else:
         raise RuntimeError(
             '{} service {}/{} was not successfully restarted after {} attempts! (configured state: {}, realtime state: {}, error message: {})'
             .format(service_type, service_folder, service_name, retry_count, configured_state, realtime_state, error_message)
         )
+    return {
+        'service_name': service_name,
+        'service_folder': service_folder,
+        'service_type': service_type,
+        'succeeded': True,
+        'attempts': retry_count,
+        'stop_time': stopped['elapsed'],
+        'ready_time': started['elapsed'],
+        'configured_state': configured_state,
+        'realtime_state': realtime_state,
+        'error_message': error_message
+    }
 
 
 def parse_datasets_from_service_manifest(data):
-    tree = ElementTree.fromstring(data)
-    databases_xpath = './Databases/SVCDatabase'
-    datasets_xpath = './Datasets/SVCDataset'
-    database_elements = tree.findall(databases_xpath)
-    for database_element in database_elements:
-        by_reference = bool(strtobool(database_element.find('ByReference').text))
-        conn_props = parse_connection_properties_from_service_manifest(database_element, by_reference)
-        for dataset_element in database_element.findall(datasets_xpath):
-            dataset_path = dataset_element.find('OnPremisePath').text
-            dataset_name = os.path.basename(dataset_path)
-            dataset_type = dataset_element.find('DatasetType').text
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if isinstance(data, bytes):
+        data = io.BytesIO(data)
+    for database in parse_databases_from_service_manifest(data):
+        for dataset in database['datasets']:
+            yield dict(dataset, by_reference=database['by_reference'], conn_props=database['conn_props'])
+
+
+def parse_databases_from_service_manifest(source):
+    """Incrementally parses the databases and their datasets from a service manifest (manifest.xml) read from the
+    file-like object source, yielding each database as soon as it has been read, and discarding the elements that have
+    been parsed so that large manifests are never held in memory as a whole."""
+    depth = 0
+    root = None
+    for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if root is None:
+                root = element
+            continue
+        depth -= 1
+        # SVCDatabase elements are at ./Databases/SVCDatabase relative to the root element
+        if depth == 2 and element.tag == 'SVCDatabase':
+            by_reference = bool(strtobool(element.find('ByReference').text))
             yield dict(
-                dataset_name=dataset_name,
-                dataset_type=dataset_type,
-                dataset_path=dataset_path,
                 by_reference=by_reference,
-                conn_props=conn_props,
+                conn_props=parse_connection_properties_from_service_manifest(element, by_reference),
+                datasets=[
+                    dict(
+                        dataset_name=os.path.basename(dataset_element.find('OnPremisePath').text),
+                        dataset_type=dataset_element.find('DatasetType').text,
+                        dataset_path=dataset_element.find('OnPremisePath').text,
+                    )
+                    for dataset_element in element.findall('./Datasets/SVCDataset')
+                ]
             )
+            element.clear()
+        elif depth == 1:
+            # Discard other top-level elements (e.g. Resources) once they have been read
+            root.remove(element)
 
 
 def parse_connection_properties_from_service_manifest(database_element, by_reference):
@@ -815,18 +1262,31 @@ def parse_connection_properties_from_service_manifest(database_element, by_refer
 
 
 def parse_connection_string(conn_string):
-    properties = {}
+    if not conn_string:
+        return {}
+    # Return a copy so that callers can modify the properties without affecting the memoized result
+    return dict(parse_connection_string_items(conn_string))
+
 
+@functools.lru_cache(maxsize=4096)
+def parse_connection_string_items(conn_string):
+    """Memoized parser for connection strings, which repeat across the datasets of every manifest and data store."""
+    items = []
     for pair in split_quoted_string(conn_string, ';'):
         key, value = split_quoted_string(pair, '=')
-        properties[key] = unquote_string(value)
-    return properties
+        items.append((key, unquote_string(value)))
+    return tuple(items)
+
+
+service_string_database_pattern = re.compile(
+    r'^(?:sde:\w+\$)?(?:sde:\w+:)(?:[\\/];\w+=)?([^;:\$]+)[;:\$]?.*$',
+    re.IGNORECASE
+)
 
 
 def parse_database_from_service_string(database):
     if database and database != 'n/a':
-        pattern = re.compile(r'^(?:sde:\w+\$)?(?:sde:\w+:)(?:[\\/];\w+=)?([^;:\$]+)[;:\$]?.*$', re.IGNORECASE)
-        match = re.match(pattern, database)
+        match = service_string_database_pattern.match(database)
         if match:
             database = match.group(1)
     return database
@@ -924,7 +1384,15 @@ def analyze_staging_result(result):
 
 # Adapted from https://stackoverflow.com/a/50215614
 class SSLContextAdapter(HTTPAdapter):
-    def __init__(self, ciphers=None, **kwargs):
+    """Transport adapter that uses the given SSL ciphers, retries requests that fail with transient errors according to
+    retry_policy (only idempotent requests, unless the request provably was not processed), paces requests with
+    rate_limiter, fails requests fast while circuit_breaker is open, and applies the default connect and read timeouts
+    to requests that do not specify their own."""
+
+    def __init__(self, ciphers=None, retry_policy=None, rate_limiter=None, circuit_breaker=None, **kwargs):
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
         self.ssl_context = create_default_context()
         if ciphers:
             log.debug(f'Using ciphers: {ciphers}')
@@ -939,3 +1407,52 @@ class SSLContextAdapter(HTTPAdapter):
     def proxy_manager_for(self, *args, **kwargs):
         kwargs['ssl_context'] = self.ssl_context
         return super(SSLContextAdapter, self).proxy_manager_for(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = default_timeout
+        idempotent = is_idempotent_request(request)
+        attempt = 0
+        while True:
+            if self.circuit_breaker:
+                self.circuit_breaker.before_request()
+            try:
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                start_time = time.monotonic()
+                response = super().send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if self.rate_limiter:
+                    self.rate_limiter.record(time.monotonic() - start_time, error=True)
+                if self.circuit_breaker:
+                    self.circuit_breaker.record(error=True)
+                if not self.retry_policy or not self.retry_policy.is_retryable_error(e, idempotent):
+                    raise
+                delay = self.retry_policy.get_delay(attempt)
+                if delay is None:
+                    raise
+                reason = str(e)
+            except BaseException:
+                # Record any other failure as well, so that a failed trial request does not keep the circuit open
+                if self.circuit_breaker:
+                    self.circuit_breaker.record(error=True)
+                raise
+            else:
+                error = self.retry_policy is not None and self.retry_policy.is_retryable(response)
+                if self.rate_limiter:
+                    self.rate_limiter.record(time.monotonic() - start_time, error=error)
+                if self.circuit_breaker:
+                    self.circuit_breaker.record(error=error)
+                retryable = error and self.retry_policy.is_retryable(response, idempotent)
+                delay = self.retry_policy.get_delay(attempt, response) if retryable else None
+                if delay is None:
+                    return response
+                reason = 'HTTP {} {}'.format(response.status_code, response.reason)
+                response.close()
+            attempt += 1
+            log.warning(
+                'Retrying request to {} in {:.1f} seconds (attempt {} of {}): {}'
+                .format(request.url.split('?')[0], delay, attempt, self.retry_policy.max_retries, reason)
+            )
+            time.sleep(delay)
+
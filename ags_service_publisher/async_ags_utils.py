@@ -0,0 +1,212 @@
+import asyncio
+import io
+import json
+from ssl import create_default_context
+from urllib.parse import urljoin
+
+import aiohttp
+
+from .admin_client import get_token_provider
+from .ags_utils import get_database_workspaces, parse_databases_from_service_manifest
+from .crawler import default_max_concurrent_requests
+from .logging_io import setup_logger
+from .retry import RetryPolicy, default_connect_timeout, default_read_timeout, get_circuit_breaker
+
+log = setup_logger(__name__)
+
+
+class AsyncAdminClient:
+    """asyncio client for the ArcGIS Server REST API of a single instance, providing the read-only operations of
+    ags_utils as coroutines, so that the manifests, statuses and infos of hundreds of services can be requested
+    concurrently with asyncio.gather.
+    At most max_concurrent_requests requests are in flight at once; the others wait for a free slot. Requests that fail
+    with transient errors are retried according to retry_policy, and fail fast while the circuit breaker shared with
+    the blocking clients of the same instance is open. Requires the aiohttp package."""
+
+    def __init__(
+        self,
+        server_url,
+        token=None,
+        proxies=None,
+        ciphers=None,
+        max_concurrent_requests=default_max_concurrent_requests,
+        ags_instance=None,
+        token_provider=None,
+        retry_policy=None
+    ):
+        self.url = server_url
+        self._token = token
+        self.token_provider = token_provider
+        self.proxies = proxies
+        self.ciphers = ciphers
+        self.max_concurrent_requests = max_concurrent_requests
+        self.ags_instance = ags_instance
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = get_circuit_breaker(server_url)
+        self.session = None
+        self._semaphore = None
+
+    @property
+    def token(self):
+        if self.token_provider:
+            return self.token_provider()
+        return self._token
+
+    @token.setter
+    def token(self, token):
+        self._token = token
+
+    @classmethod
+    def from_user_config(
+        cls,
+        user_config,
+        env_name,
+        ags_instance,
+        max_concurrent_requests=default_max_concurrent_requests,
+        token_manager=None
+    ):
+        ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
+        return cls(
+            ags_instance_props['url'],
+            ags_instance_props.get('token'),
+            ags_instance_props.get('proxies') or user_config.get('proxies'),
+            ags_instance_props.get('ciphers') or user_config.get('ciphers'),
+            max_concurrent_requests,
+            ags_instance,
+            get_token_provider(user_config, env_name, ags_instance, token_manager)
+        )
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.close()
+
+    def open(self):
+        """Creates the session, which must be done within the event loop the client is used in."""
+        ssl_context = create_default_context()
+        if self.ciphers:
+            log.debug(f'Using ciphers: {self.ciphers}')
+            ssl_context.set_ciphers(self.ciphers)
+        ssl_context.load_default_certs()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrent_requests, ssl=ssl_context),
+            timeout=aiohttp.ClientTimeout(sock_connect=default_connect_timeout, sock_read=default_read_timeout)
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def list_service_folders(self):
+        data = await self._post_json('/arcgis/admin/services')
+        return data.get('folders')
+
+    async def list_services(self, service_folder=None):
+        data = await self._post_json(get_path('/arcgis/admin/services', service_folder))
+        return data['services']
+
+    async def get_service_status(self, service_name, service_folder=None, service_type='MapServer'):
+        return await self._post_json(
+            get_path('/arcgis/admin/services', service_folder, f'{service_name}.{service_type}', 'status')
+        )
+
+    async def get_service_info(self, service_name, service_folder=None, service_type='MapServer'):
+        return await self._post_json(
+            get_path('/arcgis/rest/services', service_folder, f'{service_name}/{service_type}')
+        )
+
+    async def get_service_item_info(self, service_name, service_folder=None, service_type='MapServer'):
+        return await self._post_json(
+            get_path('/arcgis/admin/services', service_folder, f'{service_name}.{service_type}', 'iteminfo')
+        )
+
+    async def get_service_manifest(self, service_name, service_folder=None, service_type='MapServer'):
+        return await self._post_json(
+            get_path(
+                '/arcgis/admin/services',
+                service_folder,
+                f'{service_name}.{service_type}',
+                'iteminfo/manifest/manifest.json'
+            )
+        )
+
+    async def list_service_workspaces(self, service_name, service_folder=None, service_type='MapServer'):
+        """Returns a list of the datasets in the manifest (manifest.xml) of a service, like
+        ags_utils.list_service_workspaces."""
+        if service_type == 'GeometryServer':
+            log.warn(f'Unsupported service type {service_type} for service {service_name} in folder {service_folder}')
+            return []
+        content = await self._post(
+            get_path(
+                '/arcgis/admin/services',
+                service_folder,
+                f'{service_name}.{service_type}',
+                'iteminfo/manifest/manifest.xml'
+            )
+        )
+        return [
+            workspace
+            for database in parse_databases_from_service_manifest(io.BytesIO(content))
+            for workspace in get_database_workspaces(database)
+        ]
+
+    async def _post_json(self, path):
+        data = json.loads(await self._post(path, {'f': 'json'}))
+        if data.get('status') == 'error':
+            raise RuntimeError(data.get('messages'))
+        if data.get('error'):
+            raise RuntimeError(data.get('error').get('message'))
+        return data
+
+    async def _post(self, path, params=None):
+        """Sends a request, retrying it after transient errors, and returns the content of the response."""
+        url = urljoin(self.url, path)
+        proxy = (self.proxies or {}).get(url.split(':', 1)[0])
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                self.circuit_breaker.before_request()
+                try:
+                    async with self.session.post(url, params=params, data={'token': self.token}, proxy=proxy) as r:
+                        content = await r.read()
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    self.circuit_breaker.record(error=True)
+                    # Read timeouts are not retried, as by the blocking clients
+                    if isinstance(e, aiohttp.ServerTimeoutError) and not isinstance(e, connection_timeout_errors):
+                        raise
+                    delay = self.retry_policy.get_delay(attempt)
+                    if delay is None:
+                        raise
+                    reason = str(e) or type(e).__name__
+                except BaseException:
+                    self.circuit_breaker.record(error=True)
+                    raise
+                else:
+                    error = r.status in self.retry_policy.status_codes
+                    self.circuit_breaker.record(error=error)
+                    delay = self.retry_policy.get_delay(attempt, r) if error else None
+                    if delay is None:
+                        if r.status != 200:
+                            raise RuntimeError(f'Request to {url} failed with HTTP {r.status} {r.reason}')
+                        return content
+                    reason = f'HTTP {r.status} {r.reason}'
+                attempt += 1
+                log.warning(
+                    f'Retrying request to {url} in {delay:.1f} seconds '
+                    f'(attempt {attempt} of {self.retry_policy.max_retries}): {reason}'
+                )
+                await asyncio.sleep(delay)
+
+
+# Connection timeouts are raised as subclasses of ServerTimeoutError by aiohttp 3.10 and later
+connection_timeout_errors = tuple(
+    error for error in (getattr(aiohttp, 'ConnectionTimeoutError', None),) if error is not None
+)
+
+
+def get_path(*parts):
+    return '/'.join(part for part in parts if part)
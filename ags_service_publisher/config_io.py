@@ -1,5 +1,13 @@
+import functools
+import hashlib
 import os
+import pickle
+import shutil
+import tempfile
+import threading
 from collections import OrderedDict
+from distutils.util import strtobool
+from pathlib import Path
 
 import yaml  # PyYAML: http://pyyaml.org/
 
@@ -9,11 +17,27 @@ from .logging_io import setup_logger
 
 log = setup_logger(__name__)
 
+# Use the much faster LibYAML-based loader if PyYAML was built with it
+default_yaml_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 default_config_dir = os.getenv(
     'AGS_SERVICE_PUBLISHER_CONFIG_DIR',
     os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'configs'))
 )
 
+default_config_cache_dir = os.getenv(
+    'AGS_SERVICE_PUBLISHER_CONFIG_CACHE_DIR',
+    os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache', 'configs'))
+)
+
+default_use_config_cache = bool(strtobool(os.getenv('AGS_SERVICE_PUBLISHER_USE_CONFIG_CACHE', 'true')))
+
+# Pickled configs parsed by this process, by file path, along with the SHA-256 hash of the contents of the file
+_parsed_configs = {}
+
+# Serializes read-modify-write updates of configs (e.g. saving refreshed tokens to userconfig.yml) within this process
+_config_update_lock = threading.RLock()
+
 
 def get_config(config_name, config_dir=default_config_dir):
     log.debug(f'Getting config \'{config_name}\' in directory: {config_dir}')
@@ -26,11 +50,7 @@ def get_configs(
 ):
     if len(included_configs) == 1 and included_configs[0] == '*':
         log.debug(f'No config names specified, reading all configs in directory: {config_dir}')
-        config_names = [
-            os.path.splitext(os.path.basename(config_file))[0] for
-            config_file in
-            superfilter(os.listdir(config_dir), inclusion_patterns=('*.yml',), exclusion_patterns=('userconfig.yml',))
-        ]
+        config_names = list_config_names(config_dir)
     else:
         config_names = included_configs
     config_names = superfilter(config_names, included_configs, excluded_configs)
@@ -38,13 +58,41 @@ def get_configs(
     return OrderedDict(((config_name, get_config(config_name, config_dir)) for config_name in config_names))
 
 
+def list_config_names(config_dir=default_config_dir):
+    return [
+        os.path.splitext(os.path.basename(config_file))[0] for
+        config_file in
+        superfilter(os.listdir(config_dir), inclusion_patterns=('*.yml',), exclusion_patterns=('userconfig.yml',))
+    ]
+
+
 def set_config(config, config_name, config_dir=default_config_dir):
     log.debug(f'Setting config \'{config_name}\' in directory: {config_dir}')
     return write_config_to_file(config, get_config_file_path(config_name, config_dir))
 
 
+def update_config(config_name, update, config_dir=default_config_dir):
+    """Reads the current version of a config, calls update(config) to modify it, and writes it back, without other
+    threads updating it in the meantime. Returns the updated config."""
+    with _config_update_lock:
+        config = get_config(config_name, config_dir)
+        update(config)
+        set_config(config, config_name, config_dir)
+        return config
+
+
+def get_user_config(config_dir=default_config_dir):
+    """Returns the user config (userconfig.yml). It is only parsed again when the file has changed."""
+    return get_config('userconfig', config_dir)
+
+
+def update_user_config(update, config_dir=default_config_dir):
+    return update_config('userconfig', update, config_dir)
+
+
 # Adapted from http://stackoverflow.com/a/21912744
-def ordered_load(stream, Loader=yaml.SafeLoader, object_pairs_hook=OrderedDict):
+@functools.lru_cache(maxsize=None)
+def get_ordered_loader(Loader=default_yaml_loader, object_pairs_hook=OrderedDict):
     class OrderedLoader(Loader):
         pass
 
@@ -55,11 +103,16 @@ def ordered_load(stream, Loader=yaml.SafeLoader, object_pairs_hook=OrderedDict):
     OrderedLoader.add_constructor(
         yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
         construct_mapping)
-    return yaml.load(stream, OrderedLoader)
+    return OrderedLoader
+
+
+def ordered_load(stream, Loader=default_yaml_loader, object_pairs_hook=OrderedDict):
+    return yaml.load(stream, get_ordered_loader(Loader, object_pairs_hook))
 
 
 # Adapted from http://stackoverflow.com/a/21912744
-def ordered_dump(data, stream=None, Dumper=yaml.SafeDumper, **kwds):
+@functools.lru_cache(maxsize=None)
+def get_ordered_dumper(Dumper=yaml.SafeDumper):
     class OrderedDumper(Dumper):
         pass
 
@@ -67,22 +120,48 @@ def ordered_dump(data, stream=None, Dumper=yaml.SafeDumper, **kwds):
         return dumper.represent_dict(data.items())
 
     OrderedDumper.add_representer(OrderedDict, _dict_representer)
+    return OrderedDumper
 
-    return yaml.dump(data, stream, OrderedDumper, **kwds)
+
+def ordered_dump(data, stream=None, Dumper=yaml.SafeDumper, **kwds):
+    return yaml.dump(data, stream, get_ordered_dumper(Dumper), **kwds)
 
 
 def get_config_file_path(config_name, config_dir=default_config_dir):
     return os.path.abspath(os.path.join(config_dir, config_name + '.yml'))
 
 
-def read_config_from_file(file_path):
+def read_config_from_file(file_path, use_config_cache=default_use_config_cache):
+    """Reads a config from a YAML file. If use_config_cache is True, the parsed config is cached in memory and only
+    parsed again when the contents of the file change."""
     log.debug(f'Reading config from file: {file_path}')
     with open(file_path) as f:
-        config = ordered_load(f)
-        return config
+        content = f.read()
+    if not use_config_cache:
+        return ordered_load(content)
+    # Compare contents rather than modification times, which may not change on file systems with coarse timestamps
+    content_hash = hashlib.sha256(content.encode('utf-8')).digest()
+    parsed_config = _parsed_configs.get(file_path)
+    if parsed_config is None or parsed_config[0] != content_hash:
+        parsed_config = _parsed_configs[file_path] = (
+            content_hash,
+            pickle.dumps(ordered_load(content), pickle.HIGHEST_PROTOCOL)
+        )
+    # Unpickle a new copy each time, since callers may modify the config
+    return pickle.loads(parsed_config[1])
 
 
 def write_config_to_file(config, file_path):
     log.debug(f'Writing config to file: {file_path}')
-    with open(file_path, 'w') as f:
-        ordered_dump(config, f, default_flow_style=False, width=float('inf'))
+    # Write to a temporary file first so that a partially written config is never read
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(file_path)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            ordered_dump(config, f, default_flow_style=False, width=float('inf'))
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    except Exception:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+    _parsed_configs.pop(file_path, None)
@@ -0,0 +1,162 @@
+import collections
+import functools
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+from .admin_client import admin_client, admin_client_pool
+from .ags_utils import get_service_folder_report, list_service_folders, list_services
+from .extrafilters import compile_filter, superfilter
+from .helpers import asterisk_tuple, empty_tuple, iter_concurrently
+from .logging_io import setup_logger, with_log_context
+
+log = setup_logger(__name__)
+
+# Maximum number of requests in flight to each ArcGIS Server instance
+default_max_concurrent_requests = int(os.getenv('AGS_SERVICE_PUBLISHER_MAX_CONCURRENT_REQUESTS', 8))
+
+# Maximum number of crawled records buffered for the consumer before the crawl waits for them to be consumed
+default_max_queued_records = 1000
+
+ServiceRecord = collections.namedtuple(
+    'ServiceRecord',
+    ('env_name', 'ags_instance', 'service_folder', 'service_name', 'service_type', 'service')
+)
+ServiceRecord.__doc__ = """A service found by crawl_services. service is the dictionary returned by list_services, or by
+get_service_folder_report if report_parameters were specified."""
+
+
+def get_crawled_instances(
+    user_config,
+    included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+    included_instances=asterisk_tuple, excluded_instances=empty_tuple
+):
+    """Returns a list of the matching (env_name, ags_instance) tuples."""
+    env_names = superfilter(user_config['environments'].keys(), included_envs, excluded_envs)
+    if len(env_names) == 0:
+        raise RuntimeError('No environments specified!')
+    instances = []
+    for env_name in env_names:
+        env = user_config['environments'][env_name]
+        ags_instances = superfilter(env['ags_instances'].keys(), included_instances, excluded_instances)
+        log.debug(f'Crawling ArcGIS Server instances in environment {env_name}: {", ".join(ags_instances)}')
+        instances.extend((env_name, ags_instance) for ags_instance in ags_instances)
+    return instances
+
+
+def crawl_instances(
+    user_config,
+    operation,
+    included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+    included_instances=asterisk_tuple, excluded_instances=empty_tuple,
+    max_queued_records=default_max_queued_records
+):
+    """Calls operation(client, env_name, ags_instance), which must return an iterable, for all matching ArcGIS Server
+    instances concurrently, and yields the items of the iterables as soon as they are produced."""
+
+    def crawl_instance(env_name, ags_instance):
+        with admin_client(user_config, env_name, ags_instance) as client:
+            yield from operation(client, env_name, ags_instance)
+
+    instances = get_crawled_instances(
+        user_config,
+        included_envs, excluded_envs,
+        included_instances, excluded_instances
+    )
+    with admin_client_pool():
+        yield from iter_concurrently(
+            (functools.partial(crawl_instance, env_name, ags_instance) for env_name, ags_instance in instances),
+            len(instances),
+            max_queued_records
+        )
+
+
+def crawl_services(
+    user_config,
+    included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+    included_instances=asterisk_tuple, excluded_instances=empty_tuple,
+    included_service_folders=asterisk_tuple, excluded_service_folders=empty_tuple,
+    included_services=asterisk_tuple, excluded_services=empty_tuple,
+    service_types=None,
+    callback=None,
+    report_parameters=None,
+    max_concurrent_requests=default_max_concurrent_requests,
+    max_queued_records=default_max_queued_records
+):
+    """Crawls the matching services on all matching ArcGIS Server instances, and yields a (record, result) tuple for
+    each of them, where record is a ServiceRecord.
+    Instances are crawled concurrently, and the service folders of each instance are listed with up to
+    max_concurrent_requests concurrent requests. Folders, services and service types (if service_types is specified)
+    are filtered as soon as they are listed, so that nothing is requested for services that are filtered out.
+    If callback is specified, callback(client, record) is called for each service on the same threads, with up to
+    max_concurrent_requests calls in flight per instance, and its return value is yielded as the result; otherwise
+    the result is None. Records are yielded as soon as they are crawled (or their callback completes), in no particular
+    order, through a queue holding up to max_queued_records of them, so that a slow consumer holds the crawl back
+    rather than letting it run ahead."""
+
+    service_filter = compile_filter(included_services, excluded_services)
+
+    def list_folder_services(client, service_folder):
+        services = (
+            get_service_folder_report(client.url, client.token, service_folder, report_parameters, session=client.session)
+            if report_parameters else
+            list_services(client.url, client.token, service_folder, session=client.session)
+        )
+        return [
+            service for service in services
+            if (service_types is None or service['type'] in service_types) and
+            service_filter.matches(service['serviceName'])
+        ]
+
+    def crawl_instance(client, env_name, ags_instance):
+        service_folders = superfilter(
+            list_service_folders(client.url, client.token, session=client.session),
+            included_service_folders,
+            excluded_service_folders
+        )
+        with ThreadPoolExecutor(max_concurrent_requests, thread_name_prefix=f'Crawler-{ags_instance}') as executor:
+            listing_futures = {
+                executor.submit(with_log_context(list_folder_services), client, service_folder): service_folder
+                for service_folder in service_folders
+            }
+            callback_futures = {}
+            for listing_future in as_completed(listing_futures):
+                service_folder = listing_futures[listing_future]
+                for service in listing_future.result():
+                    record = ServiceRecord(
+                        env_name,
+                        ags_instance,
+                        service_folder,
+                        service['serviceName'],
+                        service['type'],
+                        service
+                    )
+                    if callback is None:
+                        yield record, None
+                        continue
+                    callback_futures[executor.submit(with_log_context(callback), client, record)] = record
+                    # Keep at most max_concurrent_requests callbacks queued behind the ones in flight
+                    while len(callback_futures) >= max_concurrent_requests * 2:
+                        done, _ = wait(callback_futures, return_when=FIRST_COMPLETED)
+                        for callback_future in done:
+                            yield callback_futures.pop(callback_future), callback_future.result()
+            for callback_future in as_completed(callback_futures):
+                yield callback_futures[callback_future], callback_future.result()
+
+    yield from crawl_instances(
+        user_config,
+        crawl_instance,
+        included_envs, excluded_envs,
+        included_instances, excluded_instances,
+        max_queued_records
+    )
+
+
+def get_service_record_key(record):
+    """Returns the key by which crawled services are sorted: environment, instance, folder, name and type."""
+    return record.env_name, record.ags_instance, record.service_folder or '', record.service_name, record.service_type
+
+
+def sort_crawled_services(results):
+    """Returns the (record, result) tuples yielded by crawl_services sorted by get_service_record_key, so that reports
+    list the services in the same order on every run even though they are crawled in no particular order."""
+    return sorted(results, key=lambda item: get_service_record_key(item[0]))
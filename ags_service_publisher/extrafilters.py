@@ -1,5 +1,115 @@
 import collections
 import fnmatch
+import functools
+import operator
+import os
+import re
+
+# Characters with a special meaning in fnmatch patterns
+wildcard_pattern = re.compile(r'[*?[]')
+
+
+class CompiledPatterns:
+    """A set of fnmatch patterns compiled into a single predicate. Patterns without wildcards are matched by looking
+    names up in a set, and the other patterns are combined into a single regular expression. Names must already be
+    normalized with os.path.normcase, as fnmatch.fnmatch does."""
+
+    def __init__(self, patterns):
+        patterns = [os.path.normcase(pattern) for pattern in patterns]
+        self.match_all = '*' in patterns
+        self.literals = frozenset(pattern for pattern in patterns if not wildcard_pattern.search(pattern))
+        wildcards = [pattern for pattern in patterns if wildcard_pattern.search(pattern)]
+        self.regex = re.compile('|'.join(fnmatch.translate(pattern) for pattern in wildcards)) if wildcards else None
+
+    def matches(self, name):
+        return (
+            self.match_all or
+            name in self.literals or
+            (self.regex is not None and self.regex.match(name) is not None)
+        )
+
+
+class CompiledFilter:
+    """Inclusion and exclusion patterns compiled for matching many names, with the same semantics as superfilter:
+    a name matches if it matches one or more inclusion patterns (or no inclusion patterns are specified) and does not
+    match any exclusion pattern. Use compile_filter to get one, so that it is compiled only once for each combination of
+    patterns."""
+
+    def __init__(self, inclusion_patterns=(), exclusion_patterns=()):
+        self.inclusion = CompiledPatterns(inclusion_patterns) if inclusion_patterns else None
+        self.exclusion = CompiledPatterns(exclusion_patterns) if exclusion_patterns else None
+
+    def matches(self, name):
+        name = os.path.normcase(name)
+        return (
+            (self.inclusion is None or self.inclusion.matches(name)) and
+            (self.exclusion is None or not self.exclusion.matches(name))
+        )
+
+    @property
+    def is_unrestricted(self):
+        """Whether every name matches."""
+        return (self.inclusion is None or self.inclusion.match_all) and self.exclusion is None
+
+    @property
+    def selectivity_rank(self):
+        """Rough estimate of how few names match, lowest for the fewest: plain names, then wildcard inclusion patterns,
+        then exclusion patterns only, with fewer inclusion patterns ranked lower."""
+        if self.inclusion is None or self.inclusion.match_all:
+            return 2, 0
+        return (0 if self.inclusion.regex is None else 1), len(self.inclusion.literals)
+
+    def matches_key(self, key):
+        """Like matches, but if key is a mapping type, determines whether any of its keys matches."""
+        if isinstance(key, collections.abc.Mapping):
+            return any(self.matches_key(subkey) for subkey in key.keys())
+        return self.matches(key)
+
+
+def compile_filter(inclusion_patterns=(), exclusion_patterns=()):
+    """Returns a CompiledFilter for the given inclusion and exclusion patterns, compiling it only once."""
+    return _compile_filter(tuple(inclusion_patterns or ()), tuple(exclusion_patterns or ()))
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_filter(inclusion_patterns, exclusion_patterns):
+    return CompiledFilter(inclusion_patterns, exclusion_patterns)
+
+
+class RecordFilter:
+    """Filters records (dicts or namedtuples) on several columns at once, each with its own inclusion and exclusion
+    patterns as in superfilter. Columns that match everything are skipped, and the others are checked in order of
+    selectivity (see CompiledFilter.selectivity_rank), so that most records are rejected by the first column checked.
+    Use compile_record_filter to get one."""
+
+    def __init__(self, column_filters):
+        self.column_filters = sorted(
+            (
+                (column, compiled_filter, operator.itemgetter(column), operator.attrgetter(column))
+                for column, compiled_filter in column_filters
+                if not compiled_filter.is_unrestricted
+            ),
+            key=lambda item: item[1].selectivity_rank
+        )
+
+    def matches(self, record):
+        is_mapping = isinstance(record, collections.abc.Mapping)
+        for _, compiled_filter, get_item, get_attr in self.column_filters:
+            if not compiled_filter.matches(get_item(record) if is_mapping else get_attr(record)):
+                return False
+        return True
+
+    def filter(self, records):
+        """Yields the records that match."""
+        return filter(self.matches, records)
+
+
+def compile_record_filter(column_patterns):
+    """Returns a RecordFilter from a mapping of column names to (inclusion_patterns, exclusion_patterns) tuples."""
+    return RecordFilter(
+        (column, compile_filter(inclusion_patterns, exclusion_patterns))
+        for column, (inclusion_patterns, exclusion_patterns) in column_patterns.items()
+    )
 
 
 def superfilter(names, inclusion_patterns=(), exclusion_patterns=()):
@@ -11,21 +121,20 @@ def superfilter(names, inclusion_patterns=(), exclusion_patterns=()):
     names can either be a sequence type (e.g. list, tuple), or mapping type (e.g. dict). In the case of a mapping type,
     the key/value pairs are filtered by key. Mapping types nested within sequence types are also supported.
     Order is preserved for sequence types and OrderedDicts.
-    Returned value type is same as names, unless names is a MappingView, in which case it is returned as a list."""
+    Returned value type is same as names, unless names is a MappingView, in which case it is returned as a list.
+    To match names one at a time, use compile_filter instead."""
     is_mapping = isinstance(names, collections.abc.Mapping)
     is_view = isinstance(names, collections.abc.MappingView)
     keys = names.keys() if is_mapping else names
-    included = multifilter(keys, inclusion_patterns) if inclusion_patterns else keys
-    excluded = multifilter(keys, exclusion_patterns) if exclusion_patterns else ()
-    filtered = set(included) - set(excluded)
+    compiled_filter = compile_filter(inclusion_patterns, exclusion_patterns)
     if is_mapping:
         return type(names)(
-            ((key, value) for key, value in names.items() if key_is_in_collection(key, filtered))
+            ((key, value) for key, value in names.items() if compiled_filter.matches_key(key))
         )
     elif is_view:
-        return [key for key in keys if key_is_in_collection(key, filtered)]
+        return [key for key in keys if compiled_filter.matches_key(key)]
     else:
-        return type(names)((key for key in keys if key_is_in_collection(key, filtered)))
+        return type(names)((key for key in keys if compiled_filter.matches_key(key)))
 
 
 def key_is_in_collection(key, collection):
@@ -41,18 +150,14 @@ def key_is_in_collection(key, collection):
 
 def multifilter(names, patterns):
     """Generator function which yields the names that match one or more of the patterns."""
+    compiled_patterns = CompiledPatterns(patterns)
     for name in names:
         if isinstance(name, collections.abc.Mapping):
             for key in name.keys():
-                for pattern in patterns:
-                    if fnmatch.fnmatch(key, pattern):
-                        yield key
-                        break
-        else:
-            for pattern in patterns:
-                if fnmatch.fnmatch(name, pattern):
-                    yield name
-                    break
+                if compiled_patterns.matches(os.path.normcase(key)):
+                    yield key
+        elif compiled_patterns.matches(os.path.normcase(name)):
+            yield name
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+import collections
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .logging_io import setup_logger, with_log_context
+from .retry import get_instance_object, idempotent_requests
+
+log = setup_logger(__name__)
+
+# Percentile of recent response times after which a duplicate of an idempotent read request is sent (0 to disable)
+default_hedge_percentile = float(os.getenv('AGS_SERVICE_PUBLISHER_HEDGE_PERCENTILE', 95))
+
+# Number of response times required before requests are hedged, and number of recent response times that are kept
+min_latency_samples = 20
+max_latency_samples = 200
+
+_executor = ThreadPoolExecutor(64, thread_name_prefix='HedgedRequest')
+
+
+class LatencyTracker:
+    """Keeps the most recent response times of read requests to a single ArcGIS Server instance."""
+
+    def __init__(self, max_samples=max_latency_samples, name=None):
+        self.name = name
+        self._samples = collections.deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, elapsed):
+        with self._lock:
+            self._samples.append(elapsed)
+
+    def get_percentile(self, percentile, min_samples=min_latency_samples):
+        """Returns the given percentile of the recent response times, or None if there are not enough of them."""
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+
+def get_latency_tracker(server_url):
+    return get_instance_object(server_url, LatencyTracker)
+
+
+def hedged_post(session, url, hedge_percentile=default_hedge_percentile, **kwargs):
+    """Sends an idempotent (read-only) POST request, and if no response has been received once the given percentile of
+    recent response times from the same ArcGIS Server instance has elapsed, sends a duplicate request and returns
+    whichever response arrives first. Must not be used for requests that change anything on the server."""
+    latency_tracker = get_latency_tracker(url)
+    hedge_after = latency_tracker.get_percentile(hedge_percentile) if hedge_percentile else None
+
+    def post():
+        start_time = time.monotonic()
+        with idempotent_requests():
+            response = session.post(url, **kwargs)
+        latency_tracker.record(time.monotonic() - start_time)
+        return response
+
+    if hedge_after is None:
+        return post()
+    post = with_log_context(post)
+    futures = [_executor.submit(post)]
+    done, _ = wait(futures, timeout=hedge_after)
+    if not done:
+        log.debug(f'Sending hedged request to {url} after {hedge_after:.2f} seconds')
+        futures.append(_executor.submit(post))
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for other_future in pending:
+                    other_future.add_done_callback(discard_response)
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def discard_response(future):
+    if future.exception() is None:
+        future.result().close()
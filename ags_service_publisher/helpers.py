@@ -1,10 +1,18 @@
 import collections
 import contextlib
+import functools
 import gc
 import inspect
 import os
+import queue
+import re
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
+from pathlib import Path
+
+from .logging_io import with_log_context
 
 
 class NoDefaultProvided(object):
@@ -40,27 +48,31 @@ def snake_case_to_pascal_case(input_string):
     return ''.join((word.capitalize() for word in input_string.split('_')))
 
 
+@functools.lru_cache(maxsize=None)
+def get_quoted_string_token_pattern(delimiter):
+    return re.compile('["{}]'.format(re.escape(delimiter)))
+
+
 def split_quoted_string(input_string, delimiter):
+    """Splits input_string at each delimiter that is not within double quotes. As before, the last character is never
+    treated as a delimiter."""
+    if not input_string:
+        return []
+    if '"' not in input_string:
+        parts = input_string[:-1].split(delimiter)
+        parts[-1] += input_string[-1]
+        return parts
     parts = []
     quoted = False
-    part = ''
-    length = len(input_string)
-    for i, char in enumerate(input_string):
-        if i == length - 1:
-            part += char
-            parts.append(part)
-            break
-        if not quoted and char == delimiter:
-            parts.append(part)
-            part = ''
-        elif not quoted and char == '"':
-            quoted = True
-            part += char
-        elif quoted and char == '"':
-            quoted = False
-            part += char
-        else:
-            part += char
+    start = 0
+    # Only visit the quotes and delimiters rather than every character
+    for match in get_quoted_string_token_pattern(delimiter).finditer(input_string, 0, len(input_string) - 1):
+        if match.group() == '"':
+            quoted = not quoted
+        elif not quoted:
+            parts.append(input_string[start:match.start()])
+            start = match.end()
+    parts.append(input_string[start:])
     return parts
 
 
@@ -85,6 +97,85 @@ def list_files_in_dir(directory, ext=''):
     ]
 
 
+def iter_concurrently(funcs, max_workers, max_queued_items=1000):
+    """Calls each of the functions, which must return iterables, on a pool of max_workers threads (in the log context of
+    the calling thread), and yields the items of all of the iterables as soon as they are produced, in no particular
+    order.
+    At most max_queued_items items are buffered before the threads wait for them to be consumed. The first exception
+    raised by any of the functions is re-raised, and the remaining threads stop once their current item is produced."""
+    funcs = list(funcs)
+    items = queue.Queue(max_queued_items)
+    stopped = threading.Event()
+    finished = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(func):
+        try:
+            for item in func():
+                if not put((None, item)):
+                    return
+        except Exception as e:
+            put((e, None))
+        finally:
+            put((None, finished))
+
+    with ThreadPoolExecutor(max(1, min(max_workers, len(funcs)))) as executor:
+        for func in funcs:
+            executor.submit(with_log_context(run), func)
+        remaining = len(funcs)
+        try:
+            while remaining:
+                error, item = items.get()
+                if error:
+                    raise error
+                if item is finished:
+                    remaining -= 1
+                    continue
+                yield item
+        finally:
+            stopped.set()
+
+
+def hash_file(file_path, hasher, chunk_size=1024 * 1024):
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher
+
+
+def evict_lru_files(directory, max_size, pattern='*'):
+    """Deletes the least recently used files matching pattern in directory, by modification time, until their total
+    size is at most max_size bytes. Returns the paths of the deleted files."""
+    files = []
+    for file_path in Path(directory).glob(pattern):
+        try:
+            stat = file_path.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, file_path))
+    total_size = sum(size for _, size, _ in files)
+    evicted = []
+    for _, size, file_path in sorted(files):
+        if total_size <= max_size:
+            break
+        try:
+            file_path.unlink()
+        except OSError:
+            # The file may have been removed by another process, or be in use on Windows
+            continue
+        total_size -= size
+        evicted.append(file_path)
+    return evicted
+
+
 # Adapted from http://stackoverflow.com/a/4506081
 def get_func_from_frame(frame):
     code = frame.f_code
@@ -0,0 +1,450 @@
+import contextlib
+import json
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+from .ags_utils import (
+    get_database_workspaces,
+    list_data_stores,
+    list_service_folders,
+    list_service_manifest_databases
+)
+from .config_io import default_config_dir, get_user_config
+from .crawler import crawl_instances, crawl_services, default_max_concurrent_requests, get_crawled_instances
+from .extrafilters import superfilter
+from .helpers import asterisk_tuple, empty_tuple
+from .logging_io import setup_logger
+from .manifest_cache import get_manifest_stamp
+
+log = setup_logger(__name__)
+
+default_inventory_snapshot_path = os.getenv(
+    'AGS_SERVICE_PUBLISHER_INVENTORY_SNAPSHOT_PATH',
+    os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache', 'inventory.sqlite'))
+)
+
+# Increment to rebuild existing snapshots when the schema changes
+inventory_snapshot_version = 3
+
+# Service types whose manifests are not fetched, since they do not have any data sources
+service_types_without_manifests = ('GeometryServer',)
+
+schema = """
+CREATE TABLE IF NOT EXISTS instances (
+    env_name TEXT NOT NULL,
+    ags_instance TEXT NOT NULL,
+    refreshed_at REAL NOT NULL,
+    PRIMARY KEY (env_name, ags_instance)
+);
+CREATE TABLE IF NOT EXISTS folders (
+    env_name TEXT NOT NULL,
+    ags_instance TEXT NOT NULL,
+    service_folder TEXT NOT NULL,
+    PRIMARY KEY (env_name, ags_instance, service_folder)
+);
+CREATE TABLE IF NOT EXISTS services (
+    service_id INTEGER PRIMARY KEY,
+    env_name TEXT NOT NULL,
+    ags_instance TEXT NOT NULL,
+    service_folder TEXT,
+    service_name TEXT NOT NULL,
+    service_type TEXT NOT NULL,
+    configured_state TEXT,
+    realtime_state TEXT,
+    stamp TEXT,
+    manifest TEXT,
+    error TEXT,
+    refreshed_at REAL NOT NULL,
+    UNIQUE (env_name, ags_instance, service_folder, service_name, service_type)
+);
+CREATE INDEX IF NOT EXISTS services_service_name ON services (service_name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS datasets (
+    service_id INTEGER NOT NULL REFERENCES services (service_id) ON DELETE CASCADE,
+    dataset_name TEXT,
+    dataset_type TEXT,
+    user TEXT,
+    database TEXT,
+    version TEXT,
+    dataset_path TEXT,
+    by_reference INTEGER
+);
+CREATE INDEX IF NOT EXISTS datasets_service_id ON datasets (service_id);
+-- Reverse index from datasets to the services using them
+CREATE INDEX IF NOT EXISTS datasets_usages ON datasets (dataset_name, database, user, version, service_id);
+CREATE INDEX IF NOT EXISTS datasets_dataset_name ON datasets (dataset_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS datasets_database ON datasets (database, user, version);
+CREATE TABLE IF NOT EXISTS data_stores (
+    env_name TEXT NOT NULL,
+    ags_instance TEXT NOT NULL,
+    item_path TEXT,
+    item_type TEXT,
+    file_path TEXT,
+    user TEXT,
+    database TEXT,
+    version TEXT
+);
+CREATE INDEX IF NOT EXISTS data_stores_instance ON data_stores (env_name, ags_instance);
+"""
+
+wildcard_pattern = re.compile(r'[*?[]')
+
+dataset_columns = ('dataset_name', 'dataset_type', 'user', 'database', 'version', 'dataset_path', 'by_reference')
+data_store_columns = ('item_path', 'item_type', 'file_path', 'user', 'database', 'version')
+
+
+@contextlib.contextmanager
+def open_inventory_snapshot(snapshot_path=default_inventory_snapshot_path, create=False):
+    """Opens the SQLite database holding the inventory snapshot, creating it (or rebuilding it if it was created by
+    another version of this tool) if create is True."""
+    snapshot_path = Path(snapshot_path)
+    if not create and not snapshot_path.is_file():
+        raise RuntimeError(
+            f'Inventory snapshot {snapshot_path} does not exist! Create it with refresh_inventory_snapshot first.'
+        )
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(snapshot_path)
+    try:
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA foreign_keys = ON')
+        # Let reports read the snapshot while it is being refreshed
+        connection.execute('PRAGMA journal_mode = WAL')
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != inventory_snapshot_version:
+            if not create:
+                raise RuntimeError(
+                    f'Inventory snapshot {snapshot_path} was created by another version of this tool! '
+                    f'Refresh it with refresh_inventory_snapshot first.'
+                )
+            if version:
+                log.info(f'Rebuilding inventory snapshot {snapshot_path} created by another version of this tool')
+                with connection:
+                    for table in ('datasets', 'services', 'folders', 'data_stores', 'instances'):
+                        connection.execute(f'DROP TABLE IF EXISTS {table}')
+            with connection:
+                connection.executescript(schema)
+                connection.execute(f'PRAGMA user_version = {inventory_snapshot_version}')
+        yield connection
+    finally:
+        connection.close()
+
+
+def refresh_inventory_snapshot(
+    included_instances=asterisk_tuple, excluded_instances=empty_tuple,
+    included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+    full_refresh=False,
+    config_dir=default_config_dir,
+    snapshot_path=default_inventory_snapshot_path,
+    max_concurrent_requests=default_max_concurrent_requests
+):
+    """Crawls the matching ArcGIS Server instances and stores their service folders, services, service statuses,
+    manifests, datasets and data stores in the inventory snapshot.
+    Statuses and item infos come from one folder report per service folder, and the manifest and datasets of a service
+    are only fetched again if the stamp in its item info (see get_manifest_stamp) has changed since the last refresh,
+    unless full_refresh is True. Services without a stamp are always fetched again. Services, folders and data stores
+    that no longer exist on the crawled instances are removed from the snapshot."""
+    user_config = get_user_config(config_dir)
+    instances = get_crawled_instances(
+        user_config,
+        included_envs, excluded_envs,
+        included_instances, excluded_instances
+    )
+    refreshed_at = time.time()
+    with open_inventory_snapshot(snapshot_path, create=True) as connection:
+        # Only the main thread uses the connection, so look up the stamps of the known services before crawling
+        stamps = {} if full_refresh else {
+            tuple(row)[:5]: row['stamp'] for row in connection.execute(
+                'SELECT env_name, ags_instance, service_folder, service_name, service_type, stamp FROM services '
+                'WHERE stamp IS NOT NULL AND error IS NULL'
+            )
+        }
+
+        def list_instance_items(client, env_name, ags_instance):
+            for service_folder in list_service_folders(client.url, client.token, session=client.session):
+                yield 'folder', env_name, ags_instance, service_folder
+            for data_store in list_data_stores(client.url, client.token, client.session, max_concurrent_requests):
+                yield 'data_store', env_name, ags_instance, data_store
+
+        def get_service_details(client, record):
+            stamp = get_manifest_stamp(record.service.get('iteminfo'))
+            if stamp is not None and stamps.get(record[:5]) == stamp:
+                return stamp, None
+            details = {'manifest': None, 'datasets': (), 'error': None}
+            if record.service_type in service_types_without_manifests:
+                return stamp, details
+            try:
+                # The manifest is downloaded once, and stored as the databases parsed from it along with their datasets
+                databases = list(
+                    list_service_manifest_databases(
+                        client.url,
+                        client.token,
+                        record.service_name,
+                        record.service_folder,
+                        record.service_type,
+                        session=client.session
+                    )
+                )
+                details['manifest'] = databases
+                details['datasets'] = [
+                    dataset for database in databases for dataset in get_database_workspaces(database)
+                ]
+            except Exception as e:
+                log.warning(
+                    f'Storing service {record.service_folder}/{record.service_name} on ArcGIS Server instance '
+                    f'{record.ags_instance} without its manifest: {e}'
+                )
+                details['error'] = str(e)
+            return stamp, details
+
+        with connection:
+            log.info('Refreshing data stores and service folders in inventory snapshot')
+            for env_name, ags_instance in instances:
+                connection.execute(
+                    'DELETE FROM folders WHERE env_name = ? AND ags_instance = ?', (env_name, ags_instance)
+                )
+                connection.execute(
+                    'DELETE FROM data_stores WHERE env_name = ? AND ags_instance = ?', (env_name, ags_instance)
+                )
+            for item_type, env_name, ags_instance, item in crawl_instances(
+                user_config,
+                list_instance_items,
+                included_envs, excluded_envs,
+                included_instances, excluded_instances
+            ):
+                if item_type == 'folder':
+                    connection.execute('INSERT OR IGNORE INTO folders VALUES (?, ?, ?)', (env_name, ags_instance, item))
+                else:
+                    connection.execute(
+                        'INSERT INTO data_stores VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (env_name, ags_instance) + tuple(item.get(column) for column in data_store_columns)
+                    )
+
+            log.info('Refreshing services in inventory snapshot')
+            refreshed_count = 0
+            unchanged_count = 0
+            for record, (stamp, details) in crawl_services(
+                user_config,
+                included_envs, excluded_envs,
+                included_instances, excluded_instances,
+                callback=get_service_details,
+                report_parameters=('STATUS', 'ITEMINFO'),
+                max_concurrent_requests=max_concurrent_requests
+            ):
+                status = record.service.get('status', {})
+                service_key = tuple(record[:5])
+                if details is None:
+                    unchanged_count += 1
+                    connection.execute(
+                        'UPDATE services SET configured_state = ?, realtime_state = ?, refreshed_at = ? '
+                        'WHERE env_name = ? AND ags_instance = ? AND service_folder IS ? AND service_name = ? '
+                        'AND service_type = ?',
+                        (status.get('configuredState'), status.get('realTimeState'), refreshed_at) + service_key
+                    )
+                    continue
+                refreshed_count += 1
+                log.debug(
+                    f'Refreshing service {record.service_folder}/{record.service_name} ({record.service_type}) '
+                    f'on ArcGIS Server instance {record.ags_instance} in inventory snapshot'
+                )
+                connection.execute(
+                    'DELETE FROM services WHERE env_name = ? AND ags_instance = ? AND service_folder IS ? '
+                    'AND service_name = ? AND service_type = ?',
+                    service_key
+                )
+                service_id = connection.execute(
+                    'INSERT INTO services (env_name, ags_instance, service_folder, service_name, service_type, '
+                    'configured_state, realtime_state, stamp, manifest, error, refreshed_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    service_key + (
+                        status.get('configuredState'),
+                        status.get('realTimeState'),
+                        stamp,
+                        json.dumps(details['manifest']) if details['manifest'] is not None else None,
+                        details['error'],
+                        refreshed_at
+                    )
+                ).lastrowid
+                connection.executemany(
+                    'INSERT INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        (service_id,) + tuple(dataset.get(column) for column in dataset_columns)
+                        for dataset in details['datasets']
+                    )
+                )
+
+            for env_name, ags_instance in instances:
+                removed_count = connection.execute(
+                    'DELETE FROM services WHERE env_name = ? AND ags_instance = ? AND refreshed_at < ?',
+                    (env_name, ags_instance, refreshed_at)
+                ).rowcount
+                if removed_count:
+                    log.info(
+                        f'Removed {removed_count} services that no longer exist on ArcGIS Server instance '
+                        f'{ags_instance} from inventory snapshot'
+                    )
+                connection.execute(
+                    'INSERT OR REPLACE INTO instances VALUES (?, ?, ?)', (env_name, ags_instance, refreshed_at)
+                )
+        log.info(
+            f'Refreshed inventory snapshot {snapshot_path}: {refreshed_count} services refreshed, '
+            f'{unchanged_count} services unchanged'
+        )
+
+
+def get_matching_values(values, included=asterisk_tuple, excluded=empty_tuple):
+    return set(superfilter(sorted({value for value in values if value is not None}), included, excluded))
+
+
+def query_services(
+    connection,
+    included_services=asterisk_tuple, excluded_services=empty_tuple,
+    included_service_folders=asterisk_tuple, excluded_service_folders=empty_tuple,
+    included_instances=asterisk_tuple, excluded_instances=empty_tuple,
+    included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+    columns='*',
+    join='',
+    where='',
+    parameters=(),
+    order_by=()
+):
+    """Returns the rows of the matching services in the inventory snapshot, sorted by environment, instance, folder
+    and name, and then by the columns in order_by."""
+    rows = connection.execute(
+        f'SELECT {columns} FROM services {join} {f"WHERE {where}" if where else ""} '
+        f'ORDER BY {", ".join(("env_name", "ags_instance", "service_folder", "service_name") + tuple(order_by))}',
+        parameters
+    ).fetchall()
+    envs = get_matching_values((row['env_name'] for row in rows), included_envs, excluded_envs)
+    instances = get_matching_values((row['ags_instance'] for row in rows), included_instances, excluded_instances)
+    folders = get_matching_values(
+        (row['service_folder'] for row in rows if row['service_folder'] is not None),
+        included_service_folders, excluded_service_folders
+    )
+    services = get_matching_values((row['service_name'] for row in rows), included_services, excluded_services)
+    return [
+        row for row in rows
+        if row['env_name'] in envs and
+        row['ags_instance'] in instances and
+        (row['service_folder'] is None or row['service_folder'] in folders) and
+        row['service_name'] in services
+    ]
+
+
+def generate_service_inventory_from_snapshot(
+    included_services=asterisk_tuple, excluded_services=empty_tuple,
+    included_service_folders=asterisk_tuple, excluded_service_folders=empty_tuple,
+    included_instances=asterisk_tuple, excluded_instances=empty_tuple,
+    included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+    snapshot_path=default_inventory_snapshot_path
+):
+    log.info(f'Listing services from inventory snapshot {snapshot_path}')
+    with open_inventory_snapshot(snapshot_path) as connection:
+        rows = query_services(
+            connection,
+            included_services, excluded_services,
+            included_service_folders, excluded_service_folders,
+            included_instances, excluded_instances,
+            included_envs, excluded_envs,
+            columns='env_name, ags_instance, service_folder, service_name, service_type'
+        )
+    for row in rows:
+        yield dict(row)
+
+
+def get_dataset_conditions(
+    connection,
+    included_datasets=asterisk_tuple, excluded_datasets=empty_tuple,
+    included_users=asterisk_tuple, excluded_users=empty_tuple,
+    included_databases=asterisk_tuple, excluded_databases=empty_tuple,
+    included_versions=asterisk_tuple, excluded_versions=empty_tuple
+):
+    """Returns an SQL condition selecting the rows of the datasets table that match the filters, and its parameters.
+    The filters are matched with superfilter against the distinct values in the snapshot, narrowed down by the
+    preceding filters, so that the rows themselves are then looked up through the datasets_usages index. If the
+    included dataset names have no wildcards, only the dataset names equal to them (ignoring case) are matched."""
+    conditions = []
+    parameters = []
+    for column, included, excluded in (
+        ('dataset_name', included_datasets, excluded_datasets),
+        ('database', included_databases, excluded_databases),
+        ('user', included_users, excluded_users),
+        ('version', included_versions, excluded_versions),
+    ):
+        if tuple(included) == asterisk_tuple and not excluded:
+            continue
+        candidate_conditions = list(conditions)
+        candidate_parameters = list(parameters)
+        if column == 'dataset_name' and not any(wildcard_pattern.search(pattern) for pattern in included):
+            candidate_conditions.append('dataset_name COLLATE NOCASE IN (SELECT value FROM json_each(?))')
+            candidate_parameters.append(json.dumps(list(included)))
+        values = get_matching_values(
+            (
+                row[0] for row in connection.execute(
+                    f'SELECT DISTINCT {column} FROM datasets '
+                    f'{"WHERE " if candidate_conditions else ""}{" AND ".join(candidate_conditions)}',
+                    candidate_parameters
+                )
+            ),
+            included, excluded
+        )
+        conditions.append(f'{column} IN (SELECT value FROM json_each(?))')
+        parameters.append(json.dumps(sorted(values)))
+    return ' AND '.join(conditions), parameters
+
+
+def find_service_dataset_usages_in_snapshot(
+    included_datasets=asterisk_tuple, excluded_datasets=empty_tuple,
+    included_users=asterisk_tuple, excluded_users=empty_tuple,
+    included_databases=asterisk_tuple, excluded_databases=empty_tuple,
+    included_versions=asterisk_tuple, excluded_versions=empty_tuple,
+    included_services=asterisk_tuple, excluded_services=empty_tuple,
+    included_service_folders=asterisk_tuple, excluded_service_folders=empty_tuple,
+    included_instances=asterisk_tuple, excluded_instances=empty_tuple,
+    included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+    snapshot_path=default_inventory_snapshot_path
+):
+    log.info(f'Finding service dataset usages in inventory snapshot {snapshot_path}')
+    with open_inventory_snapshot(snapshot_path) as connection:
+        where, parameters = get_dataset_conditions(
+            connection,
+            included_datasets, excluded_datasets,
+            included_users, excluded_users,
+            included_databases, excluded_databases,
+            included_versions, excluded_versions
+        )
+        rows = query_services(
+            connection,
+            included_services, excluded_services,
+            included_service_folders, excluded_service_folders,
+            included_instances, excluded_instances,
+            included_envs, excluded_envs,
+            columns=(
+                'env_name, ags_instance, service_folder, service_name, service_type, '
+                f'{", ".join(dataset_columns)}'
+            ),
+            join='JOIN datasets USING (service_id)',
+            where=where,
+            parameters=parameters,
+            order_by=('service_type', 'dataset_name', 'database', 'user', 'version', 'dataset_path')
+        )
+    for row in rows:
+        dataset_usage = dict(row)
+        dataset_usage['by_reference'] = bool(dataset_usage['by_reference'])
+        yield dataset_usage
+
+
+def generate_data_stores_inventory_from_snapshot(
+    included_instances=asterisk_tuple, excluded_instances=empty_tuple,
+    included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+    snapshot_path=default_inventory_snapshot_path
+):
+    log.info(f'Listing data stores from inventory snapshot {snapshot_path}')
+    with open_inventory_snapshot(snapshot_path) as connection:
+        rows = connection.execute('SELECT * FROM data_stores ORDER BY env_name, ags_instance, item_path').fetchall()
+    envs = get_matching_values((row['env_name'] for row in rows), included_envs, excluded_envs)
+    instances = get_matching_values((row['ags_instance'] for row in rows), included_instances, excluded_instances)
+    for row in rows:
+        if row['env_name'] in envs and row['ags_instance'] in instances:
+            yield dict(row)
@@ -1,6 +1,10 @@
+import contextlib
+import contextvars
 import datetime
+import functools
 import logging
 import os
+import threading
 
 default_log_dir = os.getenv(
     'AGS_SERVICE_PUBLISHER_LOG_DIR',
@@ -37,7 +41,7 @@ def setup_console_log_handler(logger=None, verbose=False):
     return console_handler
 
 
-def setup_file_log_handler(logger=None, base_filename=None, log_dir=default_log_dir):
+def setup_file_log_handler(logger=None, base_filename=None, log_dir=default_log_dir, log_context=None):
     log_file_format = '%(asctime)s|%(levelname)s|%(processName)s|%(module)s|%(funcName)s|%(message)s'
     log_file_datetime_format = '%Y%m%d-%H%M%S'
     log_file_level = 'DEBUG'
@@ -58,8 +62,65 @@ def setup_file_log_handler(logger=None, base_filename=None, log_dir=default_log_
     log_file_handler = logging.FileHandler(log_file_path, mode='w')
     log_file_handler.setFormatter(logging.Formatter(log_file_format))
     log_file_handler.setLevel(log_file_level)
+    if log_context is not None:
+        log_file_handler.addFilter(LogContextFilter(log_context))
     logger.addHandler(log_file_handler)
     return log_file_handler
 
 
+_log_context = threading.local()
+
+
+def get_log_context():
+    return getattr(_log_context, 'value', None)
+
+
+@contextlib.contextmanager
+def log_context(value):
+    """Sets the log context of the current thread, e.g. the name of the config being published, so that log records
+    emitted while it is set can be routed to the matching file log handler."""
+    previous_value = get_log_context()
+    _log_context.value = value
+    try:
+        yield
+    finally:
+        _log_context.value = previous_value
+
+
+def with_log_context(func):
+    """Wraps func so that it runs with the log context and the context variables (e.g. the active admin_client_pool)
+    of the calling thread, for use with thread pools."""
+    value = get_log_context()
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        with log_context(value):
+            return func(*args, **kwargs)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Run each call in its own copy of the context, since a context cannot be entered by several threads at once
+        return context.copy().run(run, *args, **kwargs)
+
+    return wrapper
+
+
+class LogContextFilter(logging.Filter):
+    """Only passes log records emitted in the given log context.
+    Records emitted in no log context at all (e.g. by the worker pool, or by shared sessions) are left to the handlers
+    without this filter, such as the console handler, rather than being copied to the log file of every config being
+    published concurrently. Records forwarded from subprocesses carry their log context in their log_context
+    attribute."""
+
+    def __init__(self, value):
+        super().__init__()
+        self.value = value
+
+    def filter(self, record):
+        value = getattr(record, 'log_context', None)
+        if value is None:
+            value = get_log_context()
+        return value is not None and value == self.value
+
+
 log = setup_logger(__name__)
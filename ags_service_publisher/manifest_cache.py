@@ -0,0 +1,142 @@
+import json
+import os
+import tempfile
+import threading
+from distutils.util import strtobool
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from .helpers import evict_lru_files
+from .logging_io import setup_logger
+
+log = setup_logger(__name__)
+
+default_manifest_cache_dir = os.getenv(
+    'AGS_SERVICE_PUBLISHER_MANIFEST_CACHE_DIR',
+    os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache', 'manifests'))
+)
+
+default_use_manifest_cache = bool(strtobool(os.getenv('AGS_SERVICE_PUBLISHER_USE_MANIFEST_CACHE', 'false')))
+
+# Maximum total size of the cached manifests, in megabytes
+default_max_manifest_cache_size = int(os.getenv('AGS_SERVICE_PUBLISHER_MANIFEST_CACHE_MAX_SIZE', 256))
+
+# Increment to invalidate existing cache entries when the format of the entries changes
+manifest_cache_version = 1
+
+# Prefix of the summary that is set in the item info of each service when it is published with update_timestamps
+publishing_summary_prefix = 'Last published by '
+
+
+# Total size of the cached manifests in each cache directory, or None until it is next counted
+_cache_sizes = {}
+_cache_sizes_lock = threading.Lock()
+
+
+def get_manifest_stamp(item_info):
+    """Returns the stamp identifying the published version of a service from its item info, or None if it has none.
+    This is its lastModified time if the item info has one, or else the summary set when it was last published with
+    update_timestamps enabled."""
+    item_info = item_info or {}
+    last_modified = item_info.get('lastModified')
+    if last_modified:
+        return str(last_modified)
+    summary = item_info.get('summary')
+    if summary and summary.startswith(publishing_summary_prefix):
+        return summary
+    return None
+
+
+def get_manifest_cache_path(
+    server_url,
+    service_name,
+    service_folder=None,
+    service_type='MapServer',
+    cache_dir=default_manifest_cache_dir
+):
+    return Path(cache_dir).joinpath(
+        urlsplit(server_url).netloc.lower().replace(':', '_'),
+        (service_folder or '').lower(),
+        f'{service_name}.{service_type}.json'.lower()
+    )
+
+
+def get_cached_manifest(
+    server_url,
+    stamp,
+    service_name,
+    service_folder=None,
+    service_type='MapServer',
+    cache_dir=default_manifest_cache_dir
+):
+    """Returns the parsed databases of the manifest of a service that was cached with the same stamp, or None."""
+    cache_path = get_manifest_cache_path(server_url, service_name, service_folder, service_type, cache_dir)
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get('version') != manifest_cache_version or entry.get('stamp') != stamp:
+        log.debug(f'Cached manifest for service {service_folder}/{service_name} is out of date')
+        return None
+    log.debug(f'Using cached manifest for service {service_folder}/{service_name}')
+    # Mark the entry as recently used for LRU eviction
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return entry['databases']
+
+
+def add_manifest_to_cache(
+    server_url,
+    stamp,
+    databases,
+    service_name,
+    service_folder=None,
+    service_type='MapServer',
+    cache_dir=default_manifest_cache_dir,
+    max_size=default_max_manifest_cache_size
+):
+    cache_path = get_manifest_cache_path(server_url, service_name, service_folder, service_type, cache_dir)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first so that concurrent jobs never see a partially written entry
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_path.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'version': manifest_cache_version, 'stamp': stamp, 'databases': databases}, f)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, cache_path)
+    except Exception:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+    add_manifest_cache_size(cache_dir, size, max_size)
+
+
+def add_manifest_cache_size(cache_dir, size, max_size=default_max_manifest_cache_size):
+    """Adds the size of a newly cached manifest to the total size of the cache, and evicts the least recently used
+    manifests once it exceeds max_size megabytes."""
+    max_size = max_size * 1024 ** 2
+    with _cache_sizes_lock:
+        total_size = _cache_sizes.get(cache_dir)
+        if total_size is None:
+            total_size = sum(entry_path.stat().st_size for entry_path in Path(cache_dir).glob('**/*.json'))
+        else:
+            total_size += size
+        if total_size <= max_size:
+            _cache_sizes[cache_dir] = total_size
+            return
+        evicted = evict_lru_files(cache_dir, max_size, '**/*.json')
+        log.debug(f'Evicted {len(evicted)} manifests from cache')
+        # Recount on the next write, since entries may have been overwritten or removed in the meantime
+        _cache_sizes[cache_dir] = None
+
+
+def invalidate_cached_manifest(
+    server_url,
+    service_name,
+    service_folder=None,
+    service_type='MapServer',
+    cache_dir=default_manifest_cache_dir
+):
+    get_manifest_cache_path(server_url, service_name, service_folder, service_type, cache_dir).unlink(missing_ok=True)
@@ -4,13 +4,17 @@ import multiprocessing
 import logging
 import threading
 
+from .logging_io import get_log_context
 
-def daemon(log_queue):
+
+def daemon(log_queue, log_context=None):
     while True:
         try:
             record_data = log_queue.get()
             if record_data is None:
                 break
+            if record_data.get('log_context') is None:
+                record_data['log_context'] = log_context
             record = logging.makeLogRecord(record_data)
 
             logger = logging.getLogger(record.name)
@@ -26,6 +30,7 @@ def daemon(log_queue):
 
 class MPLogger(logging.Logger):
     log_queue = None
+    log_context = None
 
     def isEnabledFor(self, level):
         return True
@@ -39,6 +44,8 @@ class MPLogger(logging.Logger):
         d = dict(record.__dict__)
         d['msg'] = record.getMessage()
         d['args'] = None
+        if self.log_context is not None:
+            d['log_context'] = self.log_context
         self.log_queue.put(d)
 
 
@@ -56,7 +63,7 @@ def logged_call(log_queue, func, *args, **kwargs):
 @contextlib.contextmanager
 def open_queue():
     log_queue = multiprocessing.Queue()
-    daemon_thread = threading.Thread(target=daemon, args=(log_queue,))
+    daemon_thread = threading.Thread(target=daemon, args=(log_queue, get_log_context()))
     daemon_thread.daemon = True
     daemon_thread.start()
     yield log_queue
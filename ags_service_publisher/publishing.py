@@ -3,13 +3,14 @@ import datetime
 import getpass
 import multiprocessing
 import tempfile
+import threading
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from shutil import copyfile, rmtree
 
 from .ags_utils import (
     analyze_staging_result,
-    create_session,
     delete_service,
     get_site_mode,
     list_services,
@@ -17,12 +18,17 @@ from .ags_utils import (
     get_service_item_info,
     set_service_item_info
 )
-from .config_io import get_config, default_config_dir
+from .admin_client import admin_client
+from .config_io import get_config, get_user_config, default_config_dir
 from .datasources import get_layer_properties, update_data_sources, convert_mxd_to_aprx, open_aprx
 from .extrafilters import superfilter
 from .helpers import asterisk_tuple, deep_get, empty_tuple
-from .logging_io import setup_logger
+from .logging_io import setup_logger, with_log_context
+from .manifest_cache import publishing_summary_prefix
 from .mplog import open_queue, logged_call
+from .publishing_state import get_publishing_inputs
+from .response_cache import invalidate_cached_service
+from .sd_cache import add_sd_to_cache, get_cached_sd, get_sd_cache_key
 from .sddraft_io import modify_sddraft
 from .services import normalize_services, get_source_info
 
@@ -44,6 +50,12 @@ def publish_config(
     create_backups=True,
     update_timestamps=True,
     delete_existing_services=False,
+    stage_once=False,
+    worker_pool=None,
+    max_concurrent_services=1,
+    instance_limiter=None,
+    sd_cache_dir=None,
+    publishing_state=None,
     _publish_services=True,
 ):
     env_names = superfilter(config['environments'].keys(), included_envs, excluded_envs)
@@ -51,7 +63,7 @@ def publish_config(
         raise RuntimeError('No publishable environments specified!')
 
     log.info(f'Publishing environments: {", ".join(env_names)}')
-    user_config = get_config('userconfig', config_dir)
+    user_config = get_user_config(config_dir)
     for env_name in env_names:
         env = config['environments'][env_name]
         ags_instances = superfilter(env['ags_instances'], included_instances, excluded_instances)
@@ -71,6 +83,12 @@ def publish_config(
                 create_backups,
                 update_timestamps,
                 delete_existing_services,
+                stage_once,
+                worker_pool,
+                max_concurrent_services,
+                instance_limiter,
+                sd_cache_dir,
+                publishing_state,
                 _publish_services,
             ):
                 yield result
@@ -95,6 +113,12 @@ def publish_config_name(
     create_backups=True,
     update_timestamps=True,
     delete_existing_services=False,
+    stage_once=False,
+    worker_pool=None,
+    max_concurrent_services=1,
+    instance_limiter=None,
+    sd_cache_dir=None,
+    publishing_state=None,
     _publish_services=True,
 ):
     config = get_config(config_name, config_dir)
@@ -114,6 +138,12 @@ def publish_config_name(
         create_backups,
         update_timestamps,
         delete_existing_services,
+        stage_once,
+        worker_pool,
+        max_concurrent_services,
+        instance_limiter,
+        sd_cache_dir,
+        publishing_state,
         _publish_services,
     ):
         result['config_name'] = config_name
@@ -137,6 +167,12 @@ def publish_env(
     create_backups=True,
     update_timestamps=True,
     delete_existing_services=False,
+    stage_once=False,
+    worker_pool=None,
+    max_concurrent_services=1,
+    instance_limiter=None,
+    sd_cache_dir=None,
+    publishing_state=None,
     _publish_services=True,
 ):
     env = config['environments'][env_name]
@@ -204,6 +240,12 @@ def publish_env(
             create_backups,
             update_timestamps,
             delete_existing_services,
+            stage_once,
+            worker_pool,
+            max_concurrent_services,
+            instance_limiter,
+            sd_cache_dir,
+            publishing_state,
             _publish_services,
         ):
             yield result
@@ -221,12 +263,8 @@ def get_site_modes(ags_instances, env_name, user_config):
         ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
         site_mode = ags_instance_props.get('site_mode')
         if site_mode:
-            server_url = ags_instance_props['url']
-            token = ags_instance_props['token']
-            proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-            ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-            with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                current_site_mode = get_site_mode(server_url, token, session=session)
+            with admin_client(user_config, env_name, ags_instance) as client:
+                current_site_mode = get_site_mode(client.url, client.token, session=client.session)
                 result[ags_instance] = current_site_mode
     return result
 
@@ -236,13 +274,9 @@ def make_sites_editable(ags_instances, env_name, user_config, initial_site_modes
         ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
         site_mode = ags_instance_props.get('site_mode')
         if site_mode:
-            server_url = ags_instance_props['url']
-            token = ags_instance_props['token']
-            proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-            ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
             if initial_site_modes[ags_instance] != 'EDITABLE':
-                with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                    set_site_mode(server_url, token, 'EDITABLE', session=session)
+                with admin_client(user_config, env_name, ags_instance) as client:
+                    set_site_mode(client.url, client.token, 'EDITABLE', session=client.session)
 
 
 def restore_site_modes(ags_instances, env_name, user_config, initial_site_modes):
@@ -250,21 +284,17 @@ def restore_site_modes(ags_instances, env_name, user_config, initial_site_modes)
         ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
         site_mode = ags_instance_props.get('site_mode')
         if site_mode:
-            server_url = ags_instance_props['url']
-            token = ags_instance_props['token']
-            proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-            ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-            with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                current_site_mode = get_site_mode(server_url, token, session=session)
+            with admin_client(user_config, env_name, ags_instance) as client:
+                current_site_mode = get_site_mode(client.url, client.token, session=client.session)
                 if site_mode.upper() == 'INITIAL':
                     if current_site_mode != initial_site_modes[ags_instance]:
-                        set_site_mode(server_url, token, initial_site_modes[ags_instance], session=session)
+                        set_site_mode(client.url, client.token, initial_site_modes[ags_instance], session=client.session)
                 elif site_mode.upper() == 'READ_ONLY':
                     if current_site_mode != 'READ_ONLY':
-                        set_site_mode(server_url, token, 'READ_ONLY', session=session)
+                        set_site_mode(client.url, client.token, 'READ_ONLY', session=client.session)
                 elif site_mode.upper() == 'EDITABLE':
                     if current_site_mode != 'EDITABLE':
-                        set_site_mode(server_url, token, 'EDITABLE', session=session)
+                        set_site_mode(client.url, client.token, 'EDITABLE', session=client.session)
                 else:
                     log.warn(f'Unrecognized site mode {site_mode}')
 
@@ -288,21 +318,63 @@ def publish_services(
     create_backups=True,
     update_timestamps=True,
     delete_existing_services=False,
+    stage_once=False,
+    worker_pool=None,
+    max_concurrent_services=1,
+    instance_limiter=None,
+    sd_cache_dir=None,
+    publishing_state=None,
     _publish_services=True,
 ):
     source_dir = Path(source_dir) if source_dir else None
-    for (
-        service_name,
-        service_type,
-        service_properties
-    ) in normalize_services(
-        services,
-        default_service_properties,
-        env_service_properties
-    ):
+    instance_limiter = instance_limiter or InstanceConcurrencyLimiter()
+
+    def publish_normalized_service(service_name, service_type, service_properties):
+        delete_existing = delete_existing_services
         log.debug(f'Publishing {service_type} service {service_name} to environment {env_name}')
         service_info = source_info[service_name]
         file_path = service_info['source_file']
+        prefixed_service_name = f'{service_prefix}{service_name}{service_suffix}'
+        service_instances = ags_instances
+        publishing_inputs = None
+        if copy_source_files_from_staging_folder and staging_dir and service_info['staging_files']:
+            input_file_path = service_info['staging_files'][0]
+        else:
+            input_file_path = file_path
+        if publishing_state and _publish_services:
+            # The source file is compared as it was after the data sources and network analysis layers were updated
+            # when it was last published, since those updates are made to it in place
+            publishing_inputs = get_publishing_inputs(input_file_path, service_properties, data_source_mappings)
+            service_instances = []
+            for ags_instance in ags_instances:
+                if publishing_state.is_unchanged(
+                    env_name,
+                    ags_instance,
+                    service_folder,
+                    prefixed_service_name,
+                    service_type,
+                    publishing_inputs
+                ):
+                    log.info(
+                        f'Skipping service {service_folder}/{prefixed_service_name} on AGS instance {ags_instance}, '
+                        f'its inputs have not changed since it was last published'
+                    )
+                    yield dict(
+                        env_name=env_name,
+                        ags_instance=ags_instance,
+                        service_folder=service_folder,
+                        service_name=service_name,
+                        service_type=service_type,
+                        file_path=file_path,
+                        succeeded=True,
+                        skipped=True,
+                        error=None,
+                        timestamp=datetime.datetime.now()
+                    )
+                else:
+                    service_instances.append(ags_instance)
+            if not service_instances:
+                return
         with open_queue() as log_queue:
             if create_backups and source_dir:
                 backup_dir = source_dir / 'Backup'
@@ -348,24 +420,16 @@ def publish_services(
                     if not source_file_path.is_file():
                         raise RuntimeError(f'Source file {source_file_path} does not exist!')
                     if data_source_mappings:
-                        proc = multiprocessing.Process(
-                            target=logged_call,
-                            args=(
-                                log_queue,
-                                update_data_sources,
-                                source_file_path,
-                                data_source_mappings
-                            )
+                        error_message = call_in_subprocess(
+                            log_queue,
+                            worker_pool,
+                            f'updating data sources for file {source_file_path}',
+                            update_data_sources,
+                            source_file_path,
+                            data_source_mappings
                         )
-                        proc.start()
-                        log.debug(f'Initializing subprocess {proc.name} (pid {proc.pid}) for updating data sources for file {source_file_path}')
-                        proc.join()
-                        if proc.exitcode != 0:
-                            raise RuntimeError(
-                                f'An error occurred in subprocess {proc.name} (pid {proc.pid}) '
-                                f'while updating data sources for file {source_file_path}'
-                            )
-                        del proc
+                        if error_message:
+                            raise RuntimeError(error_message)
                 if service_type == 'GeocodeServer':
                     source_locator_path = Path(file_path)
                     if staging_dir:
@@ -399,154 +463,327 @@ def publish_services(
                 log.info(f'Recreating network dataset {network_dataset_path}')
 
                 # Delete existing services before attempting to recreate network dataset, otherwise there could be locks preventing it from being deleted cleanly
-                if delete_existing_services:
-                    for ags_instance in ags_instances:
-                        ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
-                        ags_connection = ags_instance_props['ags_connection']
-                        server_url = ags_instance_props['url']
-                        proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-                        ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-                        token = ags_instance_props.get('token')
-                        session_needed = delete_existing_services
-                        with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                            existing_services = list_services(server_url, token, service_folder, session=session)
-                            existing_service = None
-                            for service in existing_services:
-                                if service['serviceName'] == service_name and service['type'] == service_type:
-                                    existing_service = service
-                                    break
-                            if existing_service:
-                                log.debug(f'Deleting existing service {service_folder}/{service_name} on AGS instance {ags_instance}')
-                                delete_service(server_url, token, service_name, service_folder, service_type, session=session)
+                if delete_existing:
+                    for ags_instance in service_instances:
+                        with admin_client(user_config, env_name, ags_instance) as client:
+                            delete_existing_service(client, ags_instance, service_name, service_folder, service_type)
                     # Avoid attempting to delete the services a second time
-                    delete_existing_services = False
+                    delete_existing = False
                 network_dataset_template_path = Path(service_properties.get('network_dataset_template'))
                 network_data_sources = service_properties.get('network_data_sources')
-                proc = multiprocessing.Process(
-                    target=logged_call,
-                    args=(
-                        log_queue,
-                        recreate_network_dataset,
-                        network_dataset_path,
-                        network_dataset_template_path,
-                        network_data_sources,
-                    )
+                error_message = call_in_subprocess(
+                    log_queue,
+                    worker_pool,
+                    f'recreating network dataset {network_dataset_path}',
+                    recreate_network_dataset,
+                    network_dataset_path,
+                    network_dataset_template_path,
+                    network_data_sources,
                 )
-                proc.start()
-                log.debug(f'Initializing subprocess {proc.name} (pid {proc.pid}) for recreating network dataset {network_dataset_path}')
-                proc.join()
-                if proc.exitcode != 0:
-                    raise RuntimeError(
-                        f'An error occurred in subprocess {proc.name} (pid {proc.pid}) '
-                        f'while recreating network dataset {network_dataset_path}'
-                    )
-                del proc
+                if error_message:
+                    raise RuntimeError(error_message)
             
             if service_properties.get('update_network_analysis_layers'):
                 network_analysis_layers = service_properties.get('network_analysis_layers')
                 log.info(f'Updating network analysis layers in {file_path}')
-                proc = multiprocessing.Process(
-                    target=logged_call,
-                    args=(
-                        log_queue,
-                        update_network_analysis_layers,
-                        file_path,
-                        network_analysis_layers,
-                    )
+                error_message = call_in_subprocess(
+                    log_queue,
+                    worker_pool,
+                    f'updating network analysis layers in {file_path}',
+                    update_network_analysis_layers,
+                    file_path,
+                    network_analysis_layers,
                 )
-                proc.start()
-                log.debug(f'Initializing subprocess {proc.name} (pid {proc.pid}) for updating network analysis layers in {file_path}')
-                proc.join()
-                if proc.exitcode != 0:
-                    raise RuntimeError(
-                        f'An error occurred in subprocess {proc.name} (pid {proc.pid}) '
-                        f'while updating network analysis layers in {file_path}'
-                    )
-                del proc
+                if error_message:
+                    raise RuntimeError(error_message)
+
+            if publishing_inputs is not None:
+                publishing_inputs = get_publishing_inputs(input_file_path, service_properties, data_source_mappings)
 
             errors = list()
-            for ags_instance in ags_instances:
-                ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
-                ags_connection = ags_instance_props['ags_connection']
-                server_url = ags_instance_props['url']
-                proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-                ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-                token = ags_instance_props.get('token')
-                session_needed = update_timestamps or delete_existing_services
-                with create_session(server_url, proxies=proxies, ciphers=ciphers) if session_needed else contextlib.nullcontext() as session:
-                    if delete_existing_services:
-                        existing_services = list_services(server_url, token, service_folder, session=session)
-                        existing_service = None
-                        for service in existing_services:
-                            if service['serviceName'] == service_name and service['type'] == service_type:
-                                existing_service = service
-                                break
-                        if existing_service:
-                            log.debug(f'Deleting existing service {service_folder}/{service_name} on AGS instance {ags_instance}')
-                            delete_service(server_url, token, service_name, service_folder, service_type, session=session)
-
-                    if _publish_services:
-                        proc = multiprocessing.Process(
-                            target=logged_call,
-                            args=(
-                                log_queue,
-                                publish_service,
-                                service_name,
-                                service_type,
-                                source_dir,
-                                ags_instance,
-                                ags_connection,
-                                service_folder,
-                                service_properties,
-                                service_prefix,
-                                service_suffix
-                            )
+
+            def publishing_result(ags_instance, error_message, client):
+                timestamp = datetime.datetime.now()
+                invalidate_cached_service(client.url, prefixed_service_name, service_folder, service_type)
+                if error_message:
+                    succeeded = False
+                    if not warn_on_publishing_errors:
+                        errors.append(error_message)
+                    else:
+                        raise RuntimeError(error_message)
+                else:
+                    succeeded = True
+                    if publishing_state:
+                        publishing_state.record(
+                            env_name,
+                            ags_instance,
+                            service_folder,
+                            prefixed_service_name,
+                            service_type,
+                            publishing_inputs,
+                            timestamp
                         )
-                        proc.start()
-                        log.debug(f'Initializing subprocess {proc.name} (pid {proc.pid}) for publishing service {service_folder}/{service_name} to AGS instance {ags_instance}')
-                        proc.join()
-                        error_message = None
-                        timestamp = datetime.datetime.now()
-                        if proc.exitcode != 0:
-                            succeeded = False
-                            error_message = (
-                                f'An error occurred in subprocess {proc.name} (pid {proc.pid}, exitcode {proc.exitcode}) '
-                                f'while publishing service {service_folder}/{service_name} to AGS instance {ags_instance}'
-                            )
-                            if not warn_on_publishing_errors:
-                                errors.append(error_message)
-                            else:
-                                raise RuntimeError(error_message)
-                        else:
-                            succeeded = True
-                            if update_timestamps:
-                                set_publishing_summary(
-                                    user_config,
-                                    env_name,
-                                    ags_instance,
+                    if update_timestamps:
+                        set_publishing_summary(
+                            client,
+                            ags_instance,
+                            service_name,
+                            service_folder,
+                            service_type,
+                            timestamp
+                        )
+                return dict(
+                    env_name=env_name,
+                    ags_instance=ags_instance,
+                    service_folder=service_folder,
+                    service_name=service_name,
+                    service_type=service_type,
+                    file_path=file_path,
+                    succeeded=succeeded,
+                    skipped=False,
+                    error=error_message,
+                    timestamp=timestamp
+                )
+
+            if stage_once and _publish_services:
+                if delete_existing:
+                    for ags_instance in service_instances:
+                        with admin_client(user_config, env_name, ags_instance) as client:
+                            delete_existing_service(client, ags_instance, service_name, service_folder, service_type)
+
+                for ags_instance, error_message in stage_and_upload_service(
+                    log_queue,
+                    service_name,
+                    service_type,
+                    source_dir,
+                    service_instances,
+                    env_name,
+                    user_config,
+                    service_folder,
+                    service_properties,
+                    service_prefix,
+                    service_suffix,
+                    worker_pool,
+                    instance_limiter,
+                    sd_cache_dir
+                ):
+                    with admin_client(user_config, env_name, ags_instance) as client:
+                        yield publishing_result(ags_instance, error_message, client)
+            else:
+                for ags_instance in service_instances:
+                    ags_connection = user_config['environments'][env_name]['ags_instances'][ags_instance]['ags_connection']
+                    with admin_client(user_config, env_name, ags_instance) as client:
+                        if delete_existing:
+                            delete_existing_service(client, ags_instance, service_name, service_folder, service_type)
+
+                        if _publish_services:
+                            with instance_limiter(ags_instance):
+                                error_message = call_in_subprocess(
+                                    log_queue,
+                                    worker_pool,
+                                    f'publishing service {service_folder}/{service_name} to AGS instance {ags_instance}',
+                                    publish_service,
                                     service_name,
-                                    service_folder,
                                     service_type,
-                                    timestamp,
-                                    session
+                                    source_dir,
+                                    ags_instance,
+                                    ags_connection,
+                                    service_folder,
+                                    service_properties,
+                                    service_prefix,
+                                    service_suffix,
+                                    sd_cache_dir
                                 )
-                        yield dict(
-                            env_name=env_name,
-                            ags_instance=ags_instance,
-                            service_folder=service_folder,
-                            service_name=service_name,
-                            service_type=service_type,
-                            file_path=file_path,
-                            succeeded=succeeded,
-                            error=error_message,
-                            timestamp=timestamp
-                        )
+                            yield publishing_result(ags_instance, error_message, client)
             if len(errors) > 0 and not warn_on_publishing_errors:
                 log.error(
                     f'One or more errors occurred while publishing service {service_folder}/{service_name}, aborting.'
                 )
                 raise RuntimeError(errors)
 
+    normalized_services = normalize_services(
+        services,
+        default_service_properties,
+        env_service_properties
+    )
+    if max_concurrent_services > 1:
+        log.debug(f'Publishing up to {max_concurrent_services} services concurrently to environment {env_name}')
+
+        def publish_service_results(normalized_service):
+            return list(publish_normalized_service(*normalized_service))
+
+        with ThreadPoolExecutor(max_concurrent_services, thread_name_prefix='PublishingThread') as executor:
+            futures = [
+                executor.submit(with_log_context(publish_service_results), normalized_service)
+                for normalized_service in normalized_services
+            ]
+            try:
+                for future in as_completed(futures):
+                    for result in future.result():
+                        yield result
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    else:
+        for normalized_service in normalized_services:
+            for result in publish_normalized_service(*normalized_service):
+                yield result
+
+
+class InstanceConcurrencyLimiter:
+    """Limits the number of services that are published concurrently to each ArcGIS Server instance."""
+
+    def __init__(self, max_concurrency=None):
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def __call__(self, ags_instance):
+        if not self.max_concurrency:
+            return contextlib.nullcontext()
+        with self._lock:
+            semaphore = self._semaphores.get(ags_instance)
+            if semaphore is None:
+                semaphore = self._semaphores[ags_instance] = threading.BoundedSemaphore(self.max_concurrency)
+        return semaphore
+
+
+def delete_existing_service(client, ags_instance, service_name, service_folder, service_type):
+    existing_services = list_services(client.url, client.token, service_folder, session=client.session)
+    for service in existing_services:
+        if service['serviceName'] == service_name and service['type'] == service_type:
+            log.debug(f'Deleting existing service {service_folder}/{service_name} on AGS instance {ags_instance}')
+            delete_service(client.url, client.token, service_name, service_folder, service_type, session=client.session)
+            break
+
+
+def stage_and_upload_service(
+    log_queue,
+    service_name,
+    service_type,
+    source_dir,
+    ags_instances,
+    env_name,
+    user_config,
+    service_folder=None,
+    service_properties=None,
+    service_prefix='',
+    service_suffix='',
+    worker_pool=None,
+    instance_limiter=None,
+    sd_cache_dir=None
+):
+    """Stages a service definition once, using the connection file of the first ArcGIS Server instance, and then
+    uploads the resulting SD file to all of the ArcGIS Server instances in parallel.
+    If sd_cache_dir is specified, a previously staged SD file is reused if neither the source file nor the service
+    properties have changed.
+    Yields an (ags_instance, error_message) tuple for each instance, where error_message is None if publishing
+    succeeded."""
+    instance_limiter = instance_limiter or InstanceConcurrencyLimiter()
+    tempdir = Path(tempfile.mkdtemp())
+    log.debug(f'Temporary directory created: {tempdir}')
+    try:
+        sd = tempdir / f'{service_prefix}{service_name}{service_suffix}.sd'
+        staging_instance = ags_instances[0]
+        staging_connection = user_config['environments'][env_name]['ags_instances'][staging_instance]['ags_connection']
+        sd_cache_key = None
+        if sd_cache_dir:
+            sd_cache_key = get_sd_cache_key(
+                service_name,
+                service_type,
+                find_source_file(service_name, service_type, source_dir),
+                staging_connection,
+                service_folder,
+                service_properties,
+                service_prefix,
+                service_suffix
+            )
+        if sd_cache_key and get_cached_sd(sd_cache_key, sd, sd_cache_dir):
+            log.info(f'Using cached SD file for service {service_folder}/{service_name}, skipping staging')
+            error_message = None
+        else:
+            error_message = call_in_subprocess(
+                log_queue,
+                worker_pool,
+                f'staging service {service_folder}/{service_name}',
+                stage_service,
+                service_name,
+                service_type,
+                source_dir,
+                staging_instance,
+                staging_connection,
+                sd,
+                service_folder,
+                service_properties,
+                service_prefix,
+                service_suffix
+            )
+            if not error_message and sd_cache_key:
+                add_sd_to_cache(sd, sd_cache_key, sd_cache_dir)
+        if error_message:
+            for ags_instance in ags_instances:
+                yield ags_instance, error_message
+            return
+
+        def upload(ags_instance):
+            ags_connection = user_config['environments'][env_name]['ags_instances'][ags_instance]['ags_connection']
+            with instance_limiter(ags_instance):
+                return call_in_subprocess(
+                    log_queue,
+                    worker_pool,
+                    f'uploading service {service_folder}/{service_name} to AGS instance {ags_instance}',
+                    upload_service_definition,
+                    sd,
+                    service_prefix + service_name + service_suffix,
+                    ags_instance,
+                    ags_connection,
+                    service_folder
+                )
+
+        # Leaving the executor's context waits for any uploads still reading the SD file before it is removed
+        with ThreadPoolExecutor(len(ags_instances), thread_name_prefix='UploadThread') as executor:
+            uploads = {
+                ags_instance: executor.submit(with_log_context(upload), ags_instance)
+                for ags_instance in ags_instances
+            }
+            for ags_instance, future in uploads.items():
+                yield ags_instance, future.result()
+    finally:
+        log.debug(f'Cleaning up temporary directory: {tempdir}')
+        rmtree(tempdir, ignore_errors=True)
+
+
+def call_in_subprocess(log_queue, worker_pool, description, func, *args):
+    """Calls func in a process from worker_pool if one is provided, otherwise in a new subprocess.
+    Returns an error message if the call failed, or None if it succeeded."""
+    if worker_pool:
+        log.debug(f'Submitting task to worker pool for {description}')
+        try:
+            worker_pool.apply(func, *args)
+        except Exception as e:
+            return f'An error occurred in a worker process while {description}: {e}'
+        return None
+
+    proc = multiprocessing.Process(
+        target=logged_call,
+        args=(
+            log_queue,
+            func,
+            *args
+        )
+    )
+    proc.start()
+    log.debug(f'Initializing subprocess {proc.name} (pid {proc.pid}) for {description}')
+    proc.join()
+    if proc.exitcode != 0:
+        return (
+            f'An error occurred in subprocess {proc.name} (pid {proc.pid}, exitcode {proc.exitcode}) '
+            f'while {description}'
+        )
+    return None
+
+
 def recreate_network_dataset(network_dataset_path, network_dataset_template_path, network_data_sources):
     log.debug(f'Recreating network dataset {str(network_dataset_path)}')
     network_fds_path = network_dataset_path.parent
@@ -678,6 +915,71 @@ def publish_service(
     service_folder=None,
     service_properties=None,
     service_prefix='',
+    service_suffix='',
+    sd_cache_dir=None
+):
+    prefixed_service_name = f'{service_prefix}{service_name}{service_suffix}'
+
+    log.info(
+        f'Publishing {service_type} service {prefixed_service_name} to ArcGIS Server instance {ags_instance}, '
+        f'Connection File: {ags_connection}, Service Folder: {service_folder}'
+    )
+
+    tempdir = Path(tempfile.mkdtemp())
+    log.debug(f'Temporary directory created: {tempdir}')
+    try:
+        sd_cache_key = None
+        if sd_cache_dir:
+            sd_cache_key = get_sd_cache_key(
+                service_name,
+                service_type,
+                find_source_file(service_name, service_type, source_dir),
+                ags_connection,
+                service_folder,
+                service_properties,
+                service_prefix,
+                service_suffix
+            )
+        sd = tempdir / f'{prefixed_service_name}.sd'
+        if sd_cache_key and get_cached_sd(sd_cache_key, sd, sd_cache_dir):
+            log.info(f'Using cached SD file for service {service_folder}/{prefixed_service_name}, skipping staging')
+        else:
+            stage_service(
+                service_name,
+                service_type,
+                source_dir,
+                ags_instance,
+                ags_connection,
+                sd,
+                service_folder,
+                service_properties,
+                service_prefix,
+                service_suffix
+            )
+            if sd_cache_key:
+                add_sd_to_cache(sd, sd_cache_key, sd_cache_dir)
+        upload_service_definition(sd, prefixed_service_name, ags_instance, ags_connection, service_folder)
+    except Exception:
+        log.exception(
+            f'An error occurred while publishing service {service_folder}/{prefixed_service_name} '
+            f'to ArcGIS Server instance {ags_instance}'
+        )
+        raise
+    finally:
+        log.debug(f'Cleaning up temporary directory: {tempdir}')
+        rmtree(tempdir, ignore_errors=True)
+
+
+def stage_service(
+    service_name,
+    service_type,
+    source_dir,
+    ags_instance,
+    ags_connection,
+    sd,
+    service_folder=None,
+    service_properties=None,
+    service_prefix='',
     service_suffix=''
 ):
     log.debug('Importing arcpy...')
@@ -694,21 +996,18 @@ def publish_service(
     service_name = f'{service_prefix}{service_name}{service_suffix}'
 
     log.info(
-        f'Publishing {service_type} service {service_name} to ArcGIS Server instance {ags_instance}, '
+        f'Staging {service_type} service {service_name} using ArcGIS Server instance {ags_instance}, '
         f'Connection File: {ags_connection}, Service Folder: {service_folder}'
     )
 
-    tempdir = Path(tempfile.mkdtemp())
-    log.debug(f'Temporary directory created: {tempdir}')
+    sd = Path(sd)
+    tempdir = sd.parent
     try:
         sddraft = tempdir / f'{service_name}.sddraft'
-        sd = tempdir / f'{service_name}.sd'
         if service_type in ('MapServer', 'ImageServer'):
-            file_path = Path(source_dir) / f'{original_service_name}.aprx'
-            if not file_path.exists():
-                file_path = Path(source_dir) / f'{original_service_name}.mxd'
-                if not file_path.exists():
-                    raise RuntimeError(f'No MXD or ArcGIS Pro project file found for service {service_name} in {source_dir}')
+            file_path = find_source_file(original_service_name, service_type, source_dir)
+            if not file_path:
+                raise RuntimeError(f'No MXD or ArcGIS Pro project file found for service {service_name} in {source_dir}')
             if file_path.suffix.lower() == '.aprx':
                 aprx = open_aprx(file_path)
             elif file_path.suffix.lower() == '.mxd':
@@ -783,12 +1082,6 @@ def publish_service(
             if not sd.is_file():
                 log.debug(f'Staging SDDraft file: {sddraft} to SD file: {sd}')
                 arcpy.StageService_server(str(sddraft), str(sd))
-            log.debug(f'Uploading SD file: {sd} to AGS connection: {ags_connection}')
-            arcpy.UploadServiceDefinition_server(str(sd), ags_connection)
-            log.info(
-                f'Service {service_folder}/{service_name} successfully published to '
-                f'{ags_instance} at {datetime.datetime.now():%#m/%#d/%y %#I:%M:%S %p}'
-            )
         else:
             error_message = (
                 f'Analysis failed for service {service_folder}/{service_name} '
@@ -798,49 +1091,77 @@ def publish_service(
             raise RuntimeError(error_message, analysis['errors'])
     except Exception:
         log.exception(
-            f'An error occurred while publishing service {service_folder}/{service_name} '
+            f'An error occurred while staging service {service_folder}/{service_name} '
+            f'using ArcGIS Server instance {ags_instance}'
+        )
+        raise
+
+
+def find_source_file(service_name, service_type, source_dir):
+    """Returns the path of the ArcGIS Pro project or MXD file for a map or image service, or None if none is found."""
+    if service_type not in ('MapServer', 'ImageServer'):
+        return None
+    for ext in ('.aprx', '.mxd'):
+        file_path = Path(source_dir) / f'{service_name}{ext}'
+        if file_path.exists():
+            return file_path
+    return None
+
+
+def upload_service_definition(sd, service_name, ags_instance, ags_connection, service_folder=None):
+    log.debug('Importing arcpy...')
+    try:
+        import arcpy
+    except Exception:
+        log.exception('An error occurred importing arcpy')
+        raise
+    log.debug('Successfully imported arcpy')
+
+    try:
+        log.debug(f'Uploading SD file: {sd} to AGS connection: {ags_connection}')
+        arcpy.UploadServiceDefinition_server(str(sd), ags_connection)
+        log.info(
+            f'Service {service_folder}/{service_name} successfully published to '
+            f'{ags_instance} at {datetime.datetime.now():%#m/%#d/%y %#I:%M:%S %p}'
+        )
+    except Exception:
+        log.exception(
+            f'An error occurred while uploading service {service_folder}/{service_name} '
             f'to ArcGIS Server instance {ags_instance}'
         )
         raise
-    finally:
-        log.debug(f'Cleaning up temporary directory: {tempdir}')
-        rmtree(tempdir, ignore_errors=True)
 
 
 def set_publishing_summary(
-    user_config,
-    env_name,
+    client,
     ags_instance,
     service_name,
     service_folder,
     service_type,
-    timestamp,
-    session
+    timestamp
 ):
     try:
-        ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
-        server_url = ags_instance_props['url']
-        token = ags_instance_props['token']
         item_info = get_service_item_info(
-            server_url,
-            token,
+            client.url,
+            client.token,
             service_name,
             service_folder,
             service_type,
-            session=session
+            session=client.session
         )
-        item_info['summary'] = 'Last published by {} on {:%#m/%#d/%y at %#I:%M:%S %p}'.format(
+        item_info['summary'] = '{}{} on {:%#m/%#d/%y at %#I:%M:%S %p}'.format(
+            publishing_summary_prefix,
             getpass.getuser(),
             timestamp
         )
         set_service_item_info(
-            server_url,
-            token,
+            client.url,
+            client.token,
             item_info,
             service_name,
             service_folder,
             service_type,
-            session=session
+            session=client.session
         )
     except Exception:
         log.warning(
@@ -879,7 +1200,7 @@ def cleanup_env(
     ags_instances = superfilter(env['ags_instances'], included_instances, excluded_instances)
     if len(ags_instances) == 0:
         raise RuntimeError('No cleanable instances specified!')
-    user_config = get_config('userconfig', config_dir)
+    user_config = get_user_config(config_dir)
     for ags_instance in ags_instances:
         cleanup_instance(ags_instance, env_name, config, user_config)
 
@@ -895,17 +1216,12 @@ def cleanup_instance(
     log.info(
         f'Cleaning up unused services on environment {env_name}, ArcGIS Server instance {ags_instance}, service folder {service_folder}'
     )
-    ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
-    server_url = ags_instance_props['url']
-    token = ags_instance_props['token']
-    proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-    ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-    with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-        existing_services = list_services(server_url, token, service_folder, session=session)
+    with admin_client(user_config, env_name, ags_instance) as client:
+        existing_services = list_services(client.url, client.token, service_folder, session=client.session)
         services_to_remove = [service for service in existing_services if service['serviceName'] not in configured_services]
         log.info(
             f'Removing {len(services_to_remove)} services: '
             f'{", ".join((service["serviceName"] for service in services_to_remove))}'
         )
         for service in services_to_remove:
-            delete_service(server_url, token, service['serviceName'], service_folder, service['type'], session=session)
+            delete_service(client.url, client.token, service['serviceName'], service_folder, service['type'], session=client.session)
@@ -0,0 +1,109 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from .helpers import hash_file
+from .logging_io import setup_logger
+
+log = setup_logger(__name__)
+
+default_state_dir = os.getenv(
+    'AGS_SERVICE_PUBLISHER_STATE_DIR',
+    os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'state'))
+)
+
+
+def get_file_fingerprint(file_path):
+    """Returns a SHA-256 hash of the file and its sidecar files (e.g. the .xml, .lox and .loz files of a locator)."""
+    file_path = Path(file_path)
+    hasher = hashlib.sha256()
+    hash_file(file_path, hasher)
+    for sidecar_path in (
+        file_path.parent / f'{file_path.name}.xml',
+        file_path.parent / f'{file_path.stem}.lox',
+        file_path.parent / f'{file_path.stem}.loz',
+    ):
+        if sidecar_path.is_file():
+            hasher.update(sidecar_path.name.encode('utf-8'))
+            hash_file(sidecar_path, hasher)
+    return hasher.hexdigest()
+
+
+def get_publishing_inputs(source_file, service_properties, data_source_mappings):
+    """Returns the inputs that determine the published service, normalized so that they can be compared with the
+    inputs recorded in the publishing state."""
+    return json.loads(
+        json.dumps(
+            {
+                'source_file_fingerprint': get_file_fingerprint(source_file) if source_file else None,
+                'service_properties': service_properties or {},
+                'data_source_mappings': data_source_mappings or {},
+            },
+            sort_keys=True,
+            default=str
+        )
+    )
+
+
+class PublishingState:
+    """Local store of the inputs of the services that were last published successfully to each ArcGIS Server
+    instance, used to skip publishing services whose inputs have not changed.
+    The state of each instance is stored in a JSON file at <state_dir>/<env_name>/<ags_instance>.json."""
+
+    def __init__(self, state_dir=default_state_dir):
+        self.state_dir = Path(state_dir)
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def is_unchanged(self, env_name, ags_instance, service_folder, service_name, service_type, inputs):
+        with self._lock:
+            record = self._get_state(env_name, ags_instance).get(
+                self._get_service_key(service_folder, service_name, service_type)
+            )
+        return record is not None and record['inputs'] == inputs
+
+    def record(self, env_name, ags_instance, service_folder, service_name, service_type, inputs, timestamp=None):
+        timestamp = timestamp or datetime.datetime.now()
+        with self._lock:
+            state = self._get_state(env_name, ags_instance)
+            state[self._get_service_key(service_folder, service_name, service_type)] = {
+                'inputs': inputs,
+                'timestamp': timestamp.isoformat()
+            }
+            self._write_state(env_name, ags_instance, state)
+
+    @staticmethod
+    def _get_service_key(service_folder, service_name, service_type):
+        return f'{service_folder}/{service_name}.{service_type}'
+
+    def _get_state_file_path(self, env_name, ags_instance):
+        return self.state_dir / env_name / f'{ags_instance}.json'
+
+    def _get_state(self, env_name, ags_instance):
+        key = (env_name, ags_instance)
+        if key not in self._states:
+            state_file_path = self._get_state_file_path(env_name, ags_instance)
+            if state_file_path.is_file():
+                log.debug(f'Reading publishing state file: {state_file_path}')
+                with open(state_file_path, 'r') as f:
+                    self._states[key] = json.load(f)
+            else:
+                self._states[key] = {}
+        return self._states[key]
+
+    def _write_state(self, env_name, ags_instance, state):
+        state_file_path = self._get_state_file_path(env_name, ags_instance)
+        state_file_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that an interrupted job never leaves a truncated state file behind
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=state_file_path.parent)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f, indent=2, sort_keys=True)
+            os.replace(temp_path, state_file_path)
+        except Exception:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
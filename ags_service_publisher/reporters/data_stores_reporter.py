@@ -2,6 +2,7 @@ import collections
 
 from ..config_io import default_config_dir
 from ..helpers import asterisk_tuple, empty_tuple
+from ..inventory_snapshot import generate_data_stores_inventory_from_snapshot
 from ..logging_io import setup_logger
 from ..services import generate_data_stores_inventory
 from .base_reporter import BaseReporter
@@ -28,8 +29,15 @@ class DataStoresReporter(BaseReporter):
     def generate_report_records(
         included_instances=asterisk_tuple, excluded_instances=empty_tuple,
         included_envs=asterisk_tuple, excluded_envs=empty_tuple,
-        config_dir=default_config_dir
+        config_dir=default_config_dir,
+        snapshot_path=None
     ):
+        if snapshot_path:
+            return generate_data_stores_inventory_from_snapshot(
+                included_instances, excluded_instances,
+                included_envs, excluded_envs,
+                snapshot_path
+            )
         return generate_data_stores_inventory(
             included_instances, excluded_instances,
             included_envs, excluded_envs,
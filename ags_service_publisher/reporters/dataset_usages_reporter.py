@@ -2,6 +2,7 @@ import collections
 
 from ..config_io import default_config_dir
 from ..helpers import asterisk_tuple, empty_tuple
+from ..inventory_snapshot import find_service_dataset_usages_in_snapshot
 from ..logging_io import setup_logger
 from ..services import find_service_dataset_usages
 from .base_reporter import BaseReporter
@@ -38,10 +39,23 @@ class DatasetUsagesReporter(BaseReporter):
         included_service_folders=asterisk_tuple, excluded_service_folders=empty_tuple,
         included_instances=asterisk_tuple, excluded_instances=empty_tuple,
         included_envs=asterisk_tuple, excluded_envs=empty_tuple,
-        config_dir=default_config_dir
+        config_dir=default_config_dir,
+        snapshot_path=None
     ):
-        return sorted(
-            find_service_dataset_usages(
+        if snapshot_path:
+            dataset_usages = find_service_dataset_usages_in_snapshot(
+                included_datasets, excluded_datasets,
+                included_users, excluded_users,
+                included_databases, excluded_databases,
+                included_versions, excluded_versions,
+                included_services, excluded_services,
+                included_service_folders, excluded_service_folders,
+                included_instances, excluded_instances,
+                included_envs, excluded_envs,
+                snapshot_path
+            )
+        else:
+            dataset_usages = find_service_dataset_usages(
                 included_datasets, excluded_datasets,
                 included_users, excluded_users,
                 included_databases, excluded_databases,
@@ -51,7 +65,9 @@ class DatasetUsagesReporter(BaseReporter):
                 included_instances, excluded_instances,
                 included_envs, excluded_envs,
                 config_dir
-            ),
+            )
+        return sorted(
+            dataset_usages,
             key=lambda record: tuple(
                 record[field].lower() for field in (
                     'dataset_name',
@@ -6,7 +6,7 @@ from shutil import rmtree
 
 from ..config_io import default_config_dir, get_configs
 from ..datasources import convert_mxd_to_aprx, get_aprx_data_sources
-from ..extrafilters import superfilter
+from ..extrafilters import compile_record_filter, superfilter
 from ..helpers import asterisk_tuple, empty_tuple
 from ..logging_io import setup_logger
 from ..services import get_source_info, normalize_services
@@ -48,6 +48,13 @@ class MapDataSourcesReporter(BaseReporter):
         warn_on_validation_errors=False,
         config_dir=default_config_dir
     ):
+        data_source_filter = compile_record_filter({
+            'dataset_name': (included_datasets, excluded_datasets),
+            'user': (included_users, excluded_users),
+            'database': (included_databases, excluded_databases),
+            'version': (included_versions, excluded_versions),
+        })
+
         for config_name, config in get_configs(included_configs, excluded_configs, config_dir).items():
             env_names = superfilter(config['environments'].keys(), included_envs, excluded_envs)
             services = superfilter(config['services'], included_services, excluded_services)
@@ -104,22 +111,18 @@ class MapDataSourcesReporter(BaseReporter):
                             else:
                                 raise RuntimeError(f'Unrecognized file type for {file_path}')
                             try:
-                                for layer_properties in get_aprx_data_sources(temp_aprx_path if temp_aprx_path else file_path):
-                                    if (
-                                        superfilter((layer_properties['dataset_name'],), included_datasets, excluded_datasets) and
-                                        superfilter((layer_properties['user'],), included_users, excluded_users) and
-                                        superfilter((layer_properties['database'],), included_databases, excluded_databases) and
-                                        superfilter((layer_properties['version'],), included_versions, excluded_versions)
-                                    ):
-                                        yield dict(
-                                            config_name=config_name,
-                                            env_name=env_name,
-                                            service_name=service_name,
-                                            file_path=str(file_path),
-                                            file_type=file_type,
-                                            source_or_target=source_or_target,
-                                            **layer_properties
-                                        )
+                                for layer_properties in data_source_filter.filter(
+                                    get_aprx_data_sources(temp_aprx_path if temp_aprx_path else file_path)
+                                ):
+                                    yield dict(
+                                        config_name=config_name,
+                                        env_name=env_name,
+                                        service_name=service_name,
+                                        file_path=str(file_path),
+                                        file_type=file_type,
+                                        source_or_target=source_or_target,
+                                        **layer_properties
+                                    )
                             finally:
                                 if tempdir:
                                     log.debug(f'Cleaning up temporary directory: {tempdir}')
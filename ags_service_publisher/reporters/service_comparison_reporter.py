@@ -3,6 +3,7 @@ import itertools
 
 from ..config_io import default_config_dir
 from ..helpers import asterisk_tuple, empty_tuple
+from ..inventory_snapshot import generate_service_inventory_from_snapshot
 from ..logging_io import setup_logger
 from ..services import generate_service_inventory
 from .base_reporter import BaseReporter
@@ -32,15 +33,25 @@ class ServiceComparisonReporter(BaseReporter):
         included_instances=asterisk_tuple, excluded_instances=empty_tuple,
         included_envs=asterisk_tuple, excluded_envs=empty_tuple,
         case_insensitive=False,
-        config_dir=default_config_dir
+        config_dir=default_config_dir,
+        snapshot_path=None
     ):
-        records = generate_service_inventory(
-            included_services, excluded_services,
-            included_service_folders, excluded_service_folders,
-            included_instances, excluded_instances,
-            included_envs, excluded_envs,
-            config_dir
-        )
+        if snapshot_path:
+            records = generate_service_inventory_from_snapshot(
+                included_services, excluded_services,
+                included_service_folders, excluded_service_folders,
+                included_instances, excluded_instances,
+                included_envs, excluded_envs,
+                snapshot_path
+            )
+        else:
+            records = generate_service_inventory(
+                included_services, excluded_services,
+                included_service_folders, excluded_service_folders,
+                included_instances, excluded_instances,
+                included_envs, excluded_envs,
+                config_dir
+            )
 
         group_keys = (
             'env_name',
@@ -79,8 +90,9 @@ class ServiceComparisonReporter(BaseReporter):
                     result['message'] = message
                     yield result
 
+        # Records are crawled concurrently, so sort them to bring the records of each instance together
         for key, group in itertools.groupby(
-            records,
+            sorted(records, key=lambda x: comparator(x, group_keys)),
             key=lambda x: comparator(x, group_keys)
         ):
             unique_keys.append(key)
@@ -2,6 +2,7 @@ import collections
 
 from ..config_io import default_config_dir
 from ..helpers import asterisk_tuple, empty_tuple
+from ..inventory_snapshot import generate_service_inventory_from_snapshot
 from ..logging_io import setup_logger
 from ..services import generate_service_inventory
 from .base_reporter import BaseReporter
@@ -27,8 +28,17 @@ class ServiceInventoryReporter(BaseReporter):
         included_service_folders=asterisk_tuple, excluded_service_folders=empty_tuple,
         included_instances=asterisk_tuple, excluded_instances=empty_tuple,
         included_envs=asterisk_tuple, excluded_envs=empty_tuple,
-        config_dir=default_config_dir
+        config_dir=default_config_dir,
+        snapshot_path=None
     ):
+        if snapshot_path:
+            return generate_service_inventory_from_snapshot(
+                included_services, excluded_services,
+                included_service_folders, excluded_service_folders,
+                included_instances, excluded_instances,
+                included_envs, excluded_envs,
+                snapshot_path
+            )
         return generate_service_inventory(
             included_services, excluded_services,
             included_service_folders, excluded_service_folders,
@@ -4,6 +4,7 @@ from ..config_io import default_config_dir, get_configs
 from ..helpers import asterisk_tuple, empty_tuple
 from ..logging_io import setup_logger
 from ..publishing import publish_config_name
+from ..publishing_state import PublishingState
 from .base_reporter import BaseReporter
 
 log = setup_logger(__name__)
@@ -20,6 +21,7 @@ class ServicePublishingReporter(BaseReporter):
         ('service_type', 'Service Type'),
         ('file_path', 'File Path'),
         ('succeeded', 'Succeeded'),
+        ('skipped', 'Skipped'),
         ('error', 'Error'),
         ('timestamp', 'Timestamp')
     ))
@@ -39,8 +41,11 @@ class ServicePublishingReporter(BaseReporter):
         warn_on_validation_errors=False,
         warn_on_publishing_errors=False,
         config_dir=default_config_dir,
-        create_backups=True
+        create_backups=True,
+        stage_once=False,
+        incremental=False
     ):
+        publishing_state = PublishingState() if incremental else None
         for config_name, config in get_configs(included_configs, excluded_configs, config_dir).items():
             for result in publish_config_name(
                 config_name,
@@ -54,6 +59,8 @@ class ServicePublishingReporter(BaseReporter):
                 service_suffix,
                 warn_on_publishing_errors,
                 warn_on_validation_errors,
-                create_backups
+                create_backups,
+                stage_once=stage_once,
+                publishing_state=publishing_state
             ):
                 yield result
@@ -0,0 +1,213 @@
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .hedging import hedged_post
+from .helpers import evict_lru_files
+from .logging_io import setup_logger
+from .manifest_cache import invalidate_cached_manifest
+
+log = setup_logger(__name__)
+
+default_response_cache_dir = os.getenv(
+    'AGS_SERVICE_PUBLISHER_RESPONSE_CACHE_DIR',
+    os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache', 'responses'))
+)
+
+# Time (in seconds) for which cached responses are used, or 0 to disable the response cache
+default_response_cache_ttl = float(os.getenv('AGS_SERVICE_PUBLISHER_RESPONSE_CACHE_TTL', 0))
+
+# Maximum total size of the cached responses, in megabytes
+default_max_response_cache_size = int(os.getenv('AGS_SERVICE_PUBLISHER_RESPONSE_CACHE_MAX_SIZE', 1024))
+
+# Increment to invalidate existing cache entries when the format of the entries changes
+response_cache_version = 1
+
+
+class ResponseCache:
+    """On-disk cache of the responses to read-only ArcGIS Server REST API requests.
+    Entries are stored in a directory tree mirroring the host and path of the requested URL, with one file per set of
+    request parameters (excluding the token), so that the entries for a service or folder can be invalidated when it is
+    changed through this tool. Entries older than ttl seconds are ignored, and the least recently used entries are
+    evicted once the cache exceeds max_size megabytes."""
+
+    def __init__(
+        self,
+        ttl=default_response_cache_ttl,
+        cache_dir=default_response_cache_dir,
+        max_size=default_max_response_cache_size
+    ):
+        self.ttl = ttl
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size * 1024 ** 2
+        self._lock = threading.Lock()
+        self._size = None
+
+    @property
+    def enabled(self):
+        return bool(self.ttl)
+
+    def get_instance_dir(self, url):
+        return self.cache_dir / urlsplit(url).netloc.lower().replace(':', '_')
+
+    def get_entry_path(self, url, params=None, data=None):
+        parts = urlsplit(url)
+        request_parameters = {
+            'version': response_cache_version,
+            'query': parts.query,
+            'params': params,
+            'data': {key: value for key, value in (data or {}).items() if key != 'token'}
+        }
+        cache_key = hashlib.sha256(json.dumps(request_parameters, sort_keys=True, default=str).encode('utf-8'))
+        return self.get_instance_dir(url).joinpath(
+            *(part for part in parts.path.lower().split('/') if part)
+        ) / f'{cache_key.hexdigest()}.response'
+
+    def get(self, url, params=None, data=None):
+        """Returns the cached response to the request, or None if it is not in the cache or has expired."""
+        entry_path = self.get_entry_path(url, params, data)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry['time'] > self.ttl:
+            log.debug(f'Response cache entry expired for {url}')
+            return None
+        log.debug(f'Response cache hit for {url}')
+        # Mark the entry as recently used for LRU eviction
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        response = requests.Response()
+        response.status_code = entry['status_code']
+        response.reason = entry['reason']
+        response.url = entry['url']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = entry['encoding']
+        response._content = base64.b64decode(entry['content'])
+        return response
+
+    def put(self, url, response, params=None, data=None):
+        """Adds a successful response to the cache, unless it is an ArcGIS Server error response."""
+        if response.status_code != 200 or is_error_response(response):
+            return
+        entry_path = self.get_entry_path(url, params, data)
+        entry = {
+            'time': time.time(),
+            'status_code': response.status_code,
+            'reason': response.reason,
+            'url': response.url,
+            'headers': {key: value for key, value in response.headers.items() if key.lower() == 'content-type'},
+            'encoding': response.encoding,
+            'content': base64.b64encode(response.content).decode('ascii')
+        }
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that concurrent jobs never see a partially written entry
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=entry_path.parent)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, entry_path)
+        except Exception:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+        self._add_size(size)
+
+    def invalidate_service(self, server_url, service_name, service_folder=None, service_type='MapServer'):
+        """Removes the cached responses for a service, and for the listings of the service folder it is in, from both
+        the admin and the REST services directories."""
+        log.debug(f'Invalidating cached responses for service {service_folder}/{service_name}.{service_type}')
+        arcgis_dir = self.get_instance_dir(server_url) / 'arcgis'
+        admin_services_dir = arcgis_dir / 'admin' / 'services'
+        admin_folder_dir = admin_services_dir / service_folder.lower() if service_folder else admin_services_dir
+        rest_services_dir = arcgis_dir / 'rest' / 'services'
+        rest_folder_dir = rest_services_dir / service_folder.lower() if service_folder else rest_services_dir
+        shutil.rmtree(admin_folder_dir / f'{service_name}.{service_type}'.lower(), ignore_errors=True)
+        shutil.rmtree(rest_folder_dir / service_name.lower() / service_type.lower(), ignore_errors=True)
+        for listing_dir in {admin_services_dir, admin_folder_dir, rest_services_dir, rest_folder_dir}:
+            for entry_path in listing_dir.glob('*.response'):
+                entry_path.unlink(missing_ok=True)
+
+    def clear(self, server_url=None):
+        """Removes all cached responses, or those for the ArcGIS Server instance at server_url."""
+        shutil.rmtree(self.get_instance_dir(server_url) if server_url else self.cache_dir, ignore_errors=True)
+        with self._lock:
+            self._size = None
+
+    def _add_size(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(
+                    entry_path.stat().st_size for entry_path in self.cache_dir.glob('**/*.response')
+                )
+            else:
+                self._size += size
+            if self._size <= self.max_size:
+                return
+            evicted = evict_lru_files(self.cache_dir, self.max_size, '**/*.response')
+            log.debug(f'Evicted {len(evicted)} responses from cache')
+            # Recount on the next write, since entries may have been overwritten or removed in the meantime
+            self._size = None
+
+
+def is_error_response(response):
+    if 'json' not in response.headers.get('Content-Type', '') and not response.content.lstrip().startswith(b'{'):
+        return False
+    try:
+        data = response.json()
+    except ValueError:
+        return True
+    return isinstance(data, dict) and (data.get('status') == 'error' or 'error' in data)
+
+
+_response_cache = ResponseCache()
+
+
+def get_response_cache():
+    return _response_cache
+
+
+def configure_response_cache(
+    ttl=default_response_cache_ttl,
+    cache_dir=default_response_cache_dir,
+    max_size=default_max_response_cache_size
+):
+    """Enables (or, if ttl is 0, disables) the response cache used by cached_post."""
+    global _response_cache
+    log.debug(f'Response cache TTL: {ttl} seconds, directory: {cache_dir}')
+    _response_cache = ResponseCache(ttl, cache_dir, max_size)
+
+
+def cached_post(session, url, params=None, data=None, **kwargs):
+    """Sends an idempotent (read-only) POST request via hedged_post, returning the cached response instead if the
+    response cache is enabled and contains a response to the same request that has not expired."""
+    cache = _response_cache
+    if not cache.enabled:
+        return hedged_post(session, url, params=params, data=data, **kwargs)
+    response = cache.get(url, params, data)
+    if response is None:
+        response = hedged_post(session, url, params=params, data=data, **kwargs)
+        try:
+            cache.put(url, response, params, data)
+        except OSError:
+            log.warning(f'An error occurred adding the response for {url} to the response cache', exc_info=True)
+    return response
+
+
+def invalidate_cached_service(server_url, service_name, service_folder=None, service_type='MapServer'):
+    # Invalidate even if the cache is disabled, since it may be enabled in other jobs sharing the cache directory
+    _response_cache.invalidate_service(server_url, service_name, service_folder, service_type)
+    invalidate_cached_manifest(server_url, service_name, service_folder, service_type)
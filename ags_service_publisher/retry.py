@@ -0,0 +1,291 @@
+import contextlib
+import contextvars
+import email.utils
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from .logging_io import setup_logger
+
+log = setup_logger(__name__)
+
+# Number of times a request is retried after a transient error
+default_max_retries = int(os.getenv('AGS_SERVICE_PUBLISHER_MAX_RETRIES', 3))
+
+# Maximum number of requests per second sent to each ArcGIS Server instance
+default_max_request_rate = float(os.getenv('AGS_SERVICE_PUBLISHER_MAX_REQUEST_RATE', 20))
+
+# Response time (in seconds) above which the request rate to an ArcGIS Server instance is reduced
+default_latency_threshold = float(os.getenv('AGS_SERVICE_PUBLISHER_LATENCY_THRESHOLD', 10))
+
+# Time (in seconds) to wait for a connection to an ArcGIS Server instance to be established
+default_connect_timeout = float(os.getenv('AGS_SERVICE_PUBLISHER_CONNECT_TIMEOUT', 10))
+
+# Time (in seconds) to wait for a response to a request, or for long-running operations such as stopping, starting or
+# deleting services and changing the site mode
+default_read_timeout = float(os.getenv('AGS_SERVICE_PUBLISHER_READ_TIMEOUT', 120))
+default_long_read_timeout = float(os.getenv('AGS_SERVICE_PUBLISHER_LONG_READ_TIMEOUT', 900))
+
+default_timeout = (default_connect_timeout, default_read_timeout)
+long_operation_timeout = (default_connect_timeout, default_long_read_timeout)
+
+# Number of consecutive failed requests after which requests to an ArcGIS Server instance fail fast, and the time (in
+# seconds) after which a trial request is let through again
+default_circuit_breaker_threshold = int(os.getenv('AGS_SERVICE_PUBLISHER_CIRCUIT_BREAKER_THRESHOLD', 5))
+default_circuit_breaker_reset_timeout = float(os.getenv('AGS_SERVICE_PUBLISHER_CIRCUIT_BREAKER_RESET_TIMEOUT', 30))
+
+# HTTP status codes returned by the web adaptor or ArcGIS Server when it is overloaded or temporarily unavailable
+retry_status_codes = (429, 502, 503, 504)
+
+# HTTP status codes which, when sent with a Retry-After header, mean that the request was rejected without being
+# processed, so that even requests that change something on the server can be retried
+unprocessed_status_codes = (429, 503)
+
+_idempotent_requests = contextvars.ContextVar('idempotent_requests', default=False)
+
+
+def get_backoff_intervals(initial_interval=1, max_interval=30, backoff_factor=2):
+    """Yields exponentially increasing intervals (in seconds) to wait between polls, capped at max_interval, with
+    random jitter so that concurrent pollers do not all poll at the same moment."""
+    interval = initial_interval
+    while True:
+        yield interval / 2 + random.uniform(0, interval / 2)
+        interval = min(interval * backoff_factor, max_interval)
+
+
+@contextlib.contextmanager
+def idempotent_requests():
+    """Marks the requests sent within the context (on the current thread) as idempotent, so that they are retried after
+    any transient error. Other requests, except GET requests, may change something on the server, so they are only
+    retried when they provably were not processed."""
+    token = _idempotent_requests.set(True)
+    try:
+        yield
+    finally:
+        _idempotent_requests.reset(token)
+
+
+def is_idempotent_request(request):
+    return request.method in ('GET', 'HEAD', 'OPTIONS') or _idempotent_requests.get()
+
+
+def get_retry_after(response):
+    """Returns the number of seconds to wait according to the Retry-After header of a response, or None if it has no
+    valid Retry-After header."""
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        return max(0., float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0., retry_at.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """Decides whether and how long to wait before retrying a request that failed with a transient error.
+    The delay grows exponentially with each attempt, with random jitter, and is extended to honor any Retry-After
+    header sent by the server (up to max_retry_after seconds)."""
+
+    def __init__(
+        self,
+        max_retries=default_max_retries,
+        initial_interval=1,
+        max_interval=30,
+        backoff_factor=2,
+        status_codes=retry_status_codes,
+        max_retry_after=120
+    ):
+        self.max_retries = max_retries
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.status_codes = status_codes
+        self.max_retry_after = max_retry_after
+
+    def is_retryable(self, response, idempotent=True):
+        if idempotent:
+            return response.status_code in self.status_codes
+        return response.status_code in unprocessed_status_codes and get_retry_after(response) is not None
+
+    def is_retryable_error(self, error, idempotent=True):
+        # Read timeouts are never retried, since the server may still be processing the request, and other connection
+        # errors only for idempotent requests, since the connection may have been dropped after the request was sent
+        if isinstance(error, requests.exceptions.ReadTimeout):
+            return False
+        return idempotent or isinstance(error, requests.exceptions.ConnectTimeout)
+
+    def get_delay(self, attempt, response=None):
+        """Returns the number of seconds to wait before retrying a request for the given (zero-based) attempt, or None
+        if it should not be retried."""
+        if attempt >= self.max_retries:
+            return None
+        interval = min(self.initial_interval * self.backoff_factor ** attempt, self.max_interval)
+        delay = interval / 2 + random.uniform(0, interval / 2)
+        retry_after = get_retry_after(response) if response is not None else None
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+
+class AdaptiveRateLimiter:
+    """Token bucket limiting the rate of requests sent to a single ArcGIS Server instance.
+    The rate starts at max_rate requests per second. It is halved (down to min_rate) when a request fails with a
+    transient error or takes longer than latency_threshold seconds, at most once per cooldown seconds so that a burst
+    of concurrent failures only counts once, and is increased again by increase_step after each healthy response."""
+
+    def __init__(
+        self,
+        max_rate=default_max_request_rate,
+        min_rate=0.5,
+        latency_threshold=default_latency_threshold,
+        decrease_factor=0.5,
+        increase_step=0.5,
+        cooldown=2,
+        name=None
+    ):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.latency_threshold = latency_threshold
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self.cooldown = cooldown
+        self.name = name
+        self.rate = max_rate
+        self._tokens = max(1., max_rate)
+        self._updated = time.monotonic()
+        self._last_decrease = float('-inf')
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Waits until a request may be sent."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(max(1., self.rate), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve a token even if none is available yet, so that waiting threads are served in turn
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def record(self, elapsed, error=False):
+        """Adjusts the rate according to the outcome and response time (in seconds) of a request."""
+        with self._lock:
+            if error or elapsed > self.latency_threshold:
+                now = time.monotonic()
+                if now - self._last_decrease < self.cooldown:
+                    return
+                self._last_decrease = now
+                rate = max(self.min_rate, self.rate * self.decrease_factor)
+                if rate < self.rate:
+                    log.debug(
+                        f'Reducing request rate to {self.name} from {self.rate:.2f}/s to {rate:.2f}/s '
+                        f'({"error" if error else f"response took {elapsed:.1f}s"})'
+                    )
+                self.rate = rate
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """Fails requests to a single ArcGIS Server instance fast once it is clearly down.
+    After threshold consecutive requests fail with a connection error, timeout or transient HTTP error, the circuit
+    opens and requests raise CircuitOpenError without being sent. After reset_timeout seconds, one trial request is let
+    through: if it succeeds the circuit closes again, otherwise it stays open for another reset_timeout seconds."""
+
+    def __init__(
+        self,
+        threshold=default_circuit_breaker_threshold,
+        reset_timeout=default_circuit_breaker_reset_timeout,
+        name=None
+    ):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.failures = 0
+        self._opened = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened is not None
+
+    def before_request(self):
+        """Raises CircuitOpenError if a request may not be sent."""
+        if not self.threshold:
+            return
+        with self._lock:
+            if self._opened is None:
+                return
+            remaining = self._opened + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._trial_in_progress:
+                raise CircuitOpenError(
+                    f'ArcGIS Server instance {self.name} is unavailable after {self.failures} consecutive failed '
+                    f'requests (circuit breaker is open)'
+                )
+            self._trial_in_progress = True
+            log.info(f'Sending trial request to ArcGIS Server instance {self.name}')
+
+    def record(self, error=False):
+        if not self.threshold:
+            return
+        with self._lock:
+            self._trial_in_progress = False
+            if not error:
+                if self._opened is not None:
+                    log.info(f'ArcGIS Server instance {self.name} is available again (circuit breaker closed)')
+                self.failures = 0
+                self._opened = None
+                return
+            self.failures += 1
+            if self._opened is not None or self.failures >= self.threshold:
+                if self._opened is None:
+                    log.warning(
+                        f'Failing requests to ArcGIS Server instance {self.name} fast for {self.reset_timeout} seconds '
+                        f'after {self.failures} consecutive failed requests (circuit breaker opened)'
+                    )
+                self._opened = time.monotonic()
+
+
+_instance_objects = {}
+_instance_objects_lock = threading.Lock()
+
+
+def get_instance_key(server_url):
+    parts = urlsplit(server_url)
+    return parts.scheme, parts.netloc.lower()
+
+
+def get_instance_object(server_url, factory):
+    """Returns the object created by factory (called with the host name) that is shared by all sessions connecting to
+    the ArcGIS Server instance at server_url."""
+    key = (factory,) + get_instance_key(server_url)
+    with _instance_objects_lock:
+        instance_object = _instance_objects.get(key)
+        if instance_object is None:
+            instance_object = _instance_objects[key] = factory(name=urlsplit(server_url).netloc)
+        return instance_object
+
+
+def get_rate_limiter(server_url):
+    """Returns the AdaptiveRateLimiter shared by all sessions connecting to the ArcGIS Server instance at server_url."""
+    return get_instance_object(server_url, AdaptiveRateLimiter)
+
+
+def get_circuit_breaker(server_url):
+    """Returns the CircuitBreaker shared by all sessions connecting to the ArcGIS Server instance at server_url."""
+    return get_instance_object(server_url, CircuitBreaker)
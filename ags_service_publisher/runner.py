@@ -1,14 +1,22 @@
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from .ags_utils import prompt_for_credentials, generate_token, import_sde_connection_file, create_session
-from .config_io import get_config, get_configs, set_config, default_config_dir
+from .admin_client import with_admin_client_pool
+from .ags_utils import generate_token_info, import_sde_connection_file, create_session
+from .config_io import get_configs, get_user_config, update_user_config, default_config_dir
 from .datasources import convert_mxd_to_aprx, list_sde_connection_files_in_folder
 from .extrafilters import superfilter
 from .helpers import asterisk_tuple, empty_tuple
-from .logging_io import setup_logger, setup_console_log_handler, setup_file_log_handler, default_log_dir
-from .publishing import cleanup_config, publish_config
+from .inventory_snapshot import (
+    default_inventory_snapshot_path,
+    find_service_dataset_usages_in_snapshot,
+    refresh_inventory_snapshot
+)
+from .logging_io import log_context, setup_logger, with_log_context, setup_console_log_handler, setup_file_log_handler, default_log_dir
+from .mplog import open_queue
+from .publishing import InstanceConcurrencyLimiter, cleanup_config, publish_config
 from .reporters import (
     DatasetGeometryStatisticsReporter,
     DatasetUsagesReporter,
@@ -22,7 +30,13 @@ from .reporters import (
     ServicePublishingReporter
 )
 from .reporters.base_reporter import default_report_dir
+from .publishing_state import PublishingState
+from .response_cache import configure_response_cache
+from .sd_cache import default_sd_cache_dir
+from .service_index import find_service_configs, get_service_config_names
 from .services import get_source_info, normalize_services, restart_services, test_services
+from .token_manager import TokenManager
+from .workers import WorkerPool
 
 log = setup_logger(__name__)
 main_logger = setup_logger()
@@ -36,7 +50,13 @@ class Runner:
         log_to_file=True,
         log_dir=default_log_dir,
         config_dir=default_config_dir,
-        report_dir=default_report_dir
+        report_dir=default_report_dir,
+        refresh_tokens=False,
+        username=None,
+        password=None,
+        token_expiration=15,
+        response_cache_ttl=None,
+        inventory_snapshot_path=default_inventory_snapshot_path
     ):
         self.verbose = verbose
         self.quiet = quiet
@@ -44,6 +64,7 @@ class Runner:
         self.log_dir = log_dir
         self.config_dir = config_dir
         self.report_dir = report_dir
+        self.inventory_snapshot_path = inventory_snapshot_path
 
         if not self.quiet:
             setup_console_log_handler(main_logger, self.verbose)
@@ -54,6 +75,17 @@ class Runner:
         log.debug(f'Using config directory: {self.config_dir}')
         log.debug(f'Using report directory: {self.report_dir}')
 
+        self.token_manager = TokenManager(
+            username,
+            password,
+            token_expiration,
+            config_dir=self.config_dir
+        ) if refresh_tokens else None
+
+        if response_cache_ttl is not None:
+            configure_response_cache(response_cache_ttl)
+
+    @with_admin_client_pool
     def run_batch_publishing_job(
         self,
         included_configs=asterisk_tuple, excluded_configs=empty_tuple,
@@ -69,15 +101,39 @@ class Runner:
         create_backups=True,
         update_timestamps=True,
         delete_existing_services=False,
+        stage_once=False,
+        worker_pool_size=0,
+        max_tasks_per_worker=None,
+        max_worker_memory=None,
+        max_concurrent_configs=1,
+        max_concurrent_services=1,
+        max_concurrent_publishes_per_instance=None,
+        use_sd_cache=False,
+        incremental=False,
         publish_services=True,
     ):
+        included_configs = get_service_config_names(
+            included_configs, excluded_configs,
+            included_services, excluded_services,
+            included_envs, excluded_envs,
+            self.config_dir
+        )
+        if len(included_configs) == 0:
+            raise RuntimeError('No publishable services specified!')
         configs = get_configs(included_configs, excluded_configs, self.config_dir)
         log.info(f'Batch publishing configs: {", ".join(config_name for config_name in configs.keys())}')
 
-        def publishing_job_generator():
-            for config_name, config in configs.items():
-                log_file_handler = setup_file_log_handler(main_logger, config_name, self.log_dir) if self.log_to_file else None
+        instance_limiter = InstanceConcurrencyLimiter(max_concurrent_publishes_per_instance)
+        publishing_state = PublishingState() if incremental else None
+
+        def publish_config_results(config_name, config, worker_pool=None):
+            with log_context(config_name):
+                log_file_handler = (
+                    setup_file_log_handler(main_logger, config_name, self.log_dir, log_context=config_name)
+                    if self.log_to_file else None
+                )
                 try:
+                    results = []
                     for result in publish_config(
                         config,
                         self.config_dir,
@@ -93,20 +149,59 @@ class Runner:
                         create_backups,
                         update_timestamps,
                         delete_existing_services,
+                        stage_once,
+                        worker_pool,
+                        max_concurrent_services,
+                        instance_limiter,
+                        default_sd_cache_dir if use_sd_cache else None,
+                        publishing_state,
                         publish_services,
                     ):
                         result['config_name'] = config_name
-                        yield result
+                        results.append(result)
+                    return results
                 except Exception:
                     log.exception(f'An error occurred while publishing config \'{config_name}\'')
-                    log.error(f'See the log file at {log_file_handler.baseFilename}')
+                    if log_file_handler:
+                        log.error(f'See the log file at {log_file_handler.baseFilename}')
                     raise
                 finally:
                     if log_file_handler:
                         main_logger.removeHandler(log_file_handler)
-
-        return list(publishing_job_generator())
-
+                        log_file_handler.close()
+
+        def run_publishing_job(worker_pool=None):
+            if max_concurrent_configs > 1:
+                log.debug(f'Publishing up to {max_concurrent_configs} configs concurrently')
+                with ThreadPoolExecutor(max_concurrent_configs, thread_name_prefix='ConfigThread') as executor:
+                    futures = [
+                        executor.submit(with_log_context(publish_config_results), config_name, config, worker_pool)
+                        for config_name, config in configs.items()
+                    ]
+                    try:
+                        # Collect results in config order so that the output is the same as when publishing serially
+                        return [result for future in futures for result in future.result()]
+                    except BaseException:
+                        for future in futures:
+                            future.cancel()
+                        raise
+            return [
+                result
+                for config_name, config in configs.items()
+                for result in publish_config_results(config_name, config, worker_pool)
+            ]
+
+        if worker_pool_size:
+            with open_queue() as log_queue, WorkerPool(
+                log_queue,
+                worker_pool_size,
+                max_tasks_per_worker,
+                max_worker_memory
+            ) as worker_pool:
+                return run_publishing_job(worker_pool)
+        return run_publishing_job()
+
+    @with_admin_client_pool
     def run_batch_cleanup_job(
         self,
         included_configs=asterisk_tuple, excluded_configs=empty_tuple,
@@ -133,6 +228,7 @@ class Runner:
                 if log_file_handler:
                     main_logger.removeHandler(log_file_handler)
 
+    @with_admin_client_pool
     def run_service_inventory_report(
         self,
         included_services=asterisk_tuple, excluded_services=empty_tuple,
@@ -140,7 +236,8 @@ class Runner:
         included_instances=asterisk_tuple, excluded_instances=empty_tuple,
         included_envs=asterisk_tuple, excluded_envs=empty_tuple,
         output_filename=None,
-        output_format='csv'
+        output_format='csv',
+        use_inventory_snapshot=False
     ):
         reporter = ServiceInventoryReporter(
             output_dir=self.report_dir,
@@ -152,9 +249,11 @@ class Runner:
             included_service_folders, excluded_service_folders,
             included_instances, excluded_instances,
             included_envs, excluded_envs,
-            self.config_dir
+            self.config_dir,
+            self.inventory_snapshot_path if use_inventory_snapshot else None
         )
 
+    @with_admin_client_pool
     def run_service_comparison_report(
         self,
         included_services=asterisk_tuple, excluded_services=empty_tuple,
@@ -163,7 +262,8 @@ class Runner:
         included_envs=asterisk_tuple, excluded_envs=empty_tuple,
         case_insensitive=False,
         output_filename=None,
-        output_format='csv'
+        output_format='csv',
+        use_inventory_snapshot=False
     ):
         reporter = ServiceComparisonReporter(
             output_dir=self.report_dir,
@@ -176,9 +276,11 @@ class Runner:
             included_instances, excluded_instances,
             included_envs, excluded_envs,
             case_insensitive,
-            self.config_dir
+            self.config_dir,
+            self.inventory_snapshot_path if use_inventory_snapshot else None
         )
 
+    @with_admin_client_pool
     def run_dataset_usages_report(
         self,
         included_datasets=asterisk_tuple, excluded_datasets=empty_tuple,
@@ -191,6 +293,7 @@ class Runner:
         included_envs=asterisk_tuple, excluded_envs=empty_tuple,
         output_filename=None,
         output_format='csv',
+        use_inventory_snapshot=False
     ):
         reporter = DatasetUsagesReporter(
             output_dir=self.report_dir,
@@ -206,15 +309,18 @@ class Runner:
             included_service_folders, excluded_service_folders,
             included_instances, excluded_instances,
             included_envs, excluded_envs,
-            self.config_dir
+            self.config_dir,
+            self.inventory_snapshot_path if use_inventory_snapshot else None
         )
 
+    @with_admin_client_pool
     def run_data_stores_report(
         self,
         included_instances=asterisk_tuple, excluded_instances=empty_tuple,
         included_envs=asterisk_tuple, excluded_envs=empty_tuple,
         output_filename=None,
         output_format='csv',
+        use_inventory_snapshot=False
     ):
         reporter = DataStoresReporter(
             output_dir=self.report_dir,
@@ -224,9 +330,68 @@ class Runner:
         return reporter.create_report(
             included_instances, excluded_instances,
             included_envs, excluded_envs,
-            self.config_dir
+            self.config_dir,
+            self.inventory_snapshot_path if use_inventory_snapshot else None
+        )
+
+    @with_admin_client_pool
+    def refresh_inventory_snapshot(
+        self,
+        included_instances=asterisk_tuple, excluded_instances=empty_tuple,
+        included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+        full_refresh=False
+    ):
+        refresh_inventory_snapshot(
+            included_instances, excluded_instances,
+            included_envs, excluded_envs,
+            full_refresh,
+            self.config_dir,
+            self.inventory_snapshot_path
         )
 
+    def find_dataset_usages(
+        self,
+        included_datasets=asterisk_tuple, excluded_datasets=empty_tuple,
+        included_users=asterisk_tuple, excluded_users=empty_tuple,
+        included_databases=asterisk_tuple, excluded_databases=empty_tuple,
+        included_versions=asterisk_tuple, excluded_versions=empty_tuple,
+        included_services=asterisk_tuple, excluded_services=empty_tuple,
+        included_service_folders=asterisk_tuple, excluded_service_folders=empty_tuple,
+        included_instances=asterisk_tuple, excluded_instances=empty_tuple,
+        included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+    ):
+        """Returns a list of the usages of the matching datasets by services, looked up in the inventory snapshot as of
+        its last refresh."""
+        return list(find_service_dataset_usages_in_snapshot(
+            included_datasets, excluded_datasets,
+            included_users, excluded_users,
+            included_databases, excluded_databases,
+            included_versions, excluded_versions,
+            included_services, excluded_services,
+            included_service_folders, excluded_service_folders,
+            included_instances, excluded_instances,
+            included_envs, excluded_envs,
+            self.inventory_snapshot_path
+        ))
+
+    def find_service_configs(
+        self,
+        included_services=asterisk_tuple, excluded_services=empty_tuple,
+        included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+        included_configs=asterisk_tuple, excluded_configs=empty_tuple,
+    ):
+        """Returns a list of the configs and environments in which the matching services are defined, looked up in the
+        service index."""
+        return [
+            entry._asdict() for entry in find_service_configs(
+                included_services, excluded_services,
+                included_envs, excluded_envs,
+                included_configs, excluded_configs,
+                self.config_dir
+            )
+        ]
+
+    @with_admin_client_pool
     def run_map_data_sources_report(
         self,
         included_configs=asterisk_tuple, excluded_configs=empty_tuple,
@@ -241,6 +406,12 @@ class Runner:
         output_format='csv',
         warn_on_validation_errors=False
     ):
+        included_configs = get_service_config_names(
+            included_configs, excluded_configs,
+            included_services, excluded_services,
+            included_envs, excluded_envs,
+            self.config_dir
+        )
         reporter = MapDataSourcesReporter(
             output_dir=self.report_dir,
             output_filename=output_filename,
@@ -268,13 +439,20 @@ class Runner:
         reuse_credentials=False,
         expiration=15
     ):
-        user_config = get_config('userconfig', self.config_dir)
+        user_config = get_user_config(self.config_dir)
         env_names = superfilter(user_config['environments'].keys(), included_envs, excluded_envs)
         if len(env_names) == 0:
             raise RuntimeError('No environments specified!')
-        if reuse_credentials:
-            username, password = prompt_for_credentials(username, password)
-        needs_save = False
+        if reuse_credentials or (username and password):
+            # The same credentials are used for each instance, so the tokens can be refreshed concurrently
+            token_manager = TokenManager(username, password, expiration, config_dir=self.config_dir)
+            for env_name in env_names:
+                env = user_config['environments'][env_name]
+                ags_instances = superfilter(env['ags_instances'].keys(), included_instances, excluded_instances)
+                log.info(f'Refreshing tokens for ArcGIS Server instances: {", ".join(ags_instances)}')
+                token_manager.refresh_tokens(user_config, env_name, ags_instances, force=True)
+            return
+        token_infos = {}
         for env_name in env_names:
             env = user_config['environments'][env_name]
             ags_instances = superfilter(env['ags_instances'].keys(), included_instances, excluded_instances)
@@ -286,13 +464,26 @@ class Runner:
                 proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
                 ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
                 with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                    new_token = generate_token(server_url, username, password, expiration, ags_instance, session=session)
-                    if new_token:
-                        ags_instance_props['token'] = new_token
-                        if not needs_save:
-                            needs_save = True
-        if needs_save:
-            set_config(user_config, 'userconfig', self.config_dir)
+                    token_info = generate_token_info(
+                        server_url,
+                        username,
+                        password,
+                        expiration,
+                        ags_instance,
+                        session=session
+                    )
+                    if token_info:
+                        token_infos[env_name, ags_instance] = token_info
+
+        def set_tokens(user_config):
+            for (env_name, ags_instance), token_info in token_infos.items():
+                ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
+                ags_instance_props['token'] = token_info['token']
+                ags_instance_props['token_expires'] = token_info['expires']
+
+        if token_infos:
+            # Update the current userconfig.yml so that changes made while generating the tokens are not overwritten
+            update_user_config(set_tokens, self.config_dir)
 
     def batch_convert_mxd_to_aprx(
         self,
@@ -305,6 +496,13 @@ class Runner:
     ):
         log.info('Batch converting MXDs to APRX files')
 
+        included_configs = get_service_config_names(
+            included_configs, excluded_configs,
+            included_services, excluded_services,
+            included_envs, excluded_envs,
+            self.config_dir
+        )
+
         for config_name, config in get_configs(included_configs, excluded_configs, self.config_dir).items():
             env_names = superfilter(config['environments'].keys(), included_envs, excluded_envs)
             services = superfilter(config['services'], included_services, excluded_services)
@@ -385,7 +583,7 @@ class Runner:
     ):
         log.info('Batch importing SDE connection files')
 
-        user_config = get_config('userconfig', self.config_dir)
+        user_config = get_user_config(self.config_dir)
         env_names = superfilter(user_config['environments'].keys(), included_envs, excluded_envs)
         if len(env_names) == 0:
             raise RuntimeError('No environments specified!')
@@ -411,6 +609,7 @@ class Runner:
                         os.path.join(sde_connections_dir, sde_connection_file + '.sde')
                     )
 
+    @with_admin_client_pool
     def batch_restart_services(
         self,
         included_services=asterisk_tuple, excluded_services=empty_tuple,
@@ -420,11 +619,13 @@ class Runner:
         include_running_services=True,
         delay=30,
         max_retries=3,
-        test_after_restart=True
+        test_after_restart=True,
+        batch_size=None,
+        timeout=300
     ):
         log.info('Batch restarting services')
 
-        restart_services(
+        return restart_services(
             included_services, excluded_services,
             included_service_folders, excluded_service_folders,
             included_instances, excluded_instances,
@@ -433,9 +634,12 @@ class Runner:
             delay,
             max_retries,
             test_after_restart,
-            self.config_dir
+            self.config_dir,
+            batch_size,
+            timeout
         )
 
+    @with_admin_client_pool
     def batch_test_services(
         self,
         included_services=asterisk_tuple, excluded_services=empty_tuple,
@@ -455,6 +659,7 @@ class Runner:
             self.config_dir
         ))
 
+    @with_admin_client_pool
     def run_service_health_report(
         self,
         included_services=asterisk_tuple, excluded_services=empty_tuple,
@@ -479,6 +684,7 @@ class Runner:
             self.config_dir
         )
 
+    @with_admin_client_pool
     def run_service_analysis_report(
         self,
         included_envs=asterisk_tuple, excluded_envs=empty_tuple,
@@ -503,6 +709,7 @@ class Runner:
             self.config_dir
         )
 
+    @with_admin_client_pool
     def run_service_layer_fields_report(
         self,
         included_envs=asterisk_tuple, excluded_envs=empty_tuple,
@@ -527,6 +734,7 @@ class Runner:
             self.config_dir
         )
 
+    @with_admin_client_pool
     def run_dataset_geometry_statistics_report(
         self,
         included_datasets=asterisk_tuple, excluded_datasets=empty_tuple,
@@ -557,6 +765,7 @@ class Runner:
             self.config_dir
         )
 
+    @with_admin_client_pool
     def run_service_publishing_report(
         self,
         included_configs=asterisk_tuple, excluded_configs=empty_tuple,
@@ -570,8 +779,16 @@ class Runner:
         warn_on_publishing_errors=False,
         warn_on_validation_errors=False,
         output_filename=None,
-        output_format='csv'
+        output_format='csv',
+        stage_once=False,
+        incremental=False
     ):
+        included_configs = get_service_config_names(
+            included_configs, excluded_configs,
+            included_services, excluded_services,
+            included_envs, excluded_envs,
+            self.config_dir
+        )
         reporter = ServicePublishingReporter(
             output_dir=self.report_dir,
             output_filename=output_filename,
@@ -588,5 +805,7 @@ class Runner:
             service_suffix,
             warn_on_publishing_errors,
             warn_on_validation_errors,
-            self.config_dir
+            self.config_dir,
+            stage_once=stage_once,
+            incremental=incremental
         )
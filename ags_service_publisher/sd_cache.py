@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from .helpers import evict_lru_files, hash_file
+from .logging_io import setup_logger
+
+log = setup_logger(__name__)
+
+default_sd_cache_dir = os.getenv(
+    'AGS_SERVICE_PUBLISHER_SD_CACHE_DIR',
+    os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache', 'sd'))
+)
+
+# Maximum total size of the cached SD files, in megabytes
+default_max_sd_cache_size = int(os.getenv('AGS_SERVICE_PUBLISHER_SD_CACHE_MAX_SIZE', 10240))
+
+# Increment to invalidate existing cache entries when the staging process changes
+sd_cache_version = 1
+
+
+def get_sd_cache_key(
+    service_name,
+    service_type,
+    source_file,
+    ags_connection,
+    service_folder=None,
+    service_properties=None,
+    service_prefix='',
+    service_suffix=''
+):
+    """Returns a key identifying the SD file that staging the given source file with the given service properties
+    would produce, or None if the service cannot be cached.
+    Only map and image services are cached, and services that copy their data to the server are excluded since their
+    data is not part of the key."""
+    if service_type not in ('MapServer', 'ImageServer'):
+        return None
+    if not source_file or not Path(source_file).is_file():
+        return None
+    service_properties = service_properties or {}
+    if service_properties.get('copy_data_to_server'):
+        return None
+    hasher = hashlib.sha256()
+    hasher.update(
+        json.dumps(
+            {
+                'version': sd_cache_version,
+                'service_name': f'{service_prefix}{service_name}{service_suffix}',
+                'service_type': service_type,
+                'service_folder': service_folder,
+                'service_properties': service_properties,
+            },
+            sort_keys=True,
+            default=str
+        ).encode('utf-8')
+    )
+    # The connection file determines the target server that is embedded in the SD file
+    hash_file(source_file, hasher)
+    for file_path in (ags_connection, service_properties.get('tile_scheme_file')):
+        if file_path and Path(file_path).is_file():
+            hash_file(file_path, hasher)
+    return hasher.hexdigest()
+
+
+def get_cached_sd(cache_key, sd, cache_dir=default_sd_cache_dir):
+    """Links (or, if that is not possible, copies) the cached SD file for cache_key to sd, and returns sd, or None if it
+    is not in the cache.
+    The caller gets its own link to the file, so that evicting the entry from the cache while the SD file is still being
+    uploaded (by this or any other job) does not remove the file being uploaded."""
+    cached_sd = Path(cache_dir) / f'{cache_key}.sd'
+    try:
+        # Mark the entry as recently used for LRU eviction
+        os.utime(cached_sd)
+        try:
+            os.link(cached_sd, sd)
+        except OSError:
+            if not cached_sd.is_file():
+                raise
+            # Hard links are not supported between different file systems, or by some file systems
+            shutil.copyfile(cached_sd, sd)
+    except FileNotFoundError:
+        log.debug(f'SD cache miss for key {cache_key}')
+        return None
+    log.debug(f'SD cache hit for key {cache_key}: {cached_sd}')
+    return Path(sd)
+
+
+def add_sd_to_cache(sd, cache_key, cache_dir=default_sd_cache_dir, max_size=default_max_sd_cache_size):
+    """Copies the SD file to the cache under cache_key, then evicts the least recently used entries until the cache
+    is at most max_size megabytes."""
+    cache_dir = Path(cache_dir)
+    if not cache_dir.is_dir():
+        log.debug(f'Creating SD cache directory: {cache_dir}')
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    cached_sd = cache_dir / f'{cache_key}.sd'
+    log.debug(f'Adding SD file {sd} to cache: {cached_sd}')
+    # Copy to a temporary file first so that concurrent publishing jobs never see a partially written SD file
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f, open(sd, 'rb') as source:
+            shutil.copyfileobj(source, f)
+        os.replace(temp_path, cached_sd)
+    except Exception:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+    for evicted in evict_lru_files(cache_dir, max_size * 1024 ** 2, '*.sd'):
+        log.debug(f'Evicted SD file from cache: {evicted}')
+    return cached_sd
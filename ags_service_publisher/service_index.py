@@ -0,0 +1,156 @@
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from .config_io import default_config_cache_dir, default_config_dir, get_config, list_config_names
+from .extrafilters import compile_record_filter
+from .helpers import asterisk_tuple, empty_tuple
+from .logging_io import setup_logger
+from .services import normalize_services
+
+log = setup_logger(__name__)
+
+# Increment to rebuild existing indexes when the format of the index changes
+service_index_version = 2
+
+ServiceIndexEntry = collections.namedtuple(
+    'ServiceIndexEntry',
+    ('service_name', 'config_name', 'env_name', 'service_folder', 'service_type', 'source_dir')
+)
+
+_service_index_lock = threading.Lock()
+
+
+def get_service_index_path(config_dir=default_config_dir, cache_dir=default_config_cache_dir):
+    config_dir_hash = hashlib.sha256(os.path.normcase(os.path.abspath(config_dir)).encode('utf-8')).hexdigest()
+    return Path(cache_dir) / f'service_index_{config_dir_hash[:16]}.json'
+
+
+def index_config_services(config):
+    """Returns a list of the services defined by a config in each of its environments, as lists of the fields of
+    ServiceIndexEntry other than config_name."""
+    entries = []
+    default_service_properties = config.get('default_service_properties')
+    for env_name, env in config['environments'].items():
+        source_dir = env.get('source_dir')
+        service_folder = config.get('service_folder', Path(source_dir).name if source_dir else None)
+        for service_name, service_type, _ in normalize_services(
+            config.get('services') or (),
+            default_service_properties,
+            env.get('service_properties', {})
+        ):
+            entries.append([service_name, env_name, service_folder, service_type, source_dir])
+    return entries
+
+
+def get_service_index(config_dir=default_config_dir, cache_dir=default_config_cache_dir):
+    """Returns a list of ServiceIndexEntry tuples for every service in every environment of every config in
+    config_dir, in the order get_configs lists the configs.
+    The index is persisted in cache_dir, and only the configs whose files have changed (or been added) since it was last
+    refreshed are parsed again. Configs that cannot be read are left out of the index with a warning."""
+    index_path = get_service_index_path(config_dir, cache_dir)
+    with _service_index_lock:
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') != service_index_version:
+                raise ValueError('Service index is out of date')
+        except (OSError, ValueError):
+            index = {'version': service_index_version, 'configs': {}}
+        indexed_configs = index['configs']
+        configs = {}
+        changed = False
+        for config_name in list_config_names(config_dir):
+            # Compare contents rather than modification times, which may not change on file systems with coarse
+            # timestamps
+            with open(os.path.join(config_dir, f'{config_name}.yml'), 'rb') as f:
+                file_version = hashlib.sha256(f.read()).hexdigest()
+            indexed_config = indexed_configs.get(config_name)
+            if indexed_config is None or indexed_config['file_version'] != file_version:
+                log.debug(f'Indexing services in config \'{config_name}\'')
+                indexed_config = {'file_version': file_version, 'services': []}
+                try:
+                    indexed_config['services'] = index_config_services(get_config(config_name, config_dir))
+                except Exception as e:
+                    # Index the config as unreadable until it changes, so that one broken config does not prevent
+                    # the services in the other configs from being found
+                    indexed_config['error'] = f'{type(e).__name__}: {e}'
+                changed = True
+            if 'error' in indexed_config:
+                log.warning(
+                    f'Services in config \'{config_name}\' could not be indexed: {indexed_config["error"]}'
+                )
+            configs[config_name] = indexed_config
+        if changed or configs.keys() != indexed_configs.keys():
+            index['configs'] = configs
+            try:
+                write_service_index(index, index_path)
+            except OSError:
+                log.warning(f'An error occurred saving the service index to {index_path}', exc_info=True)
+    return [
+        ServiceIndexEntry(service_name, config_name, env_name, service_folder, service_type, source_dir)
+        for config_name, indexed_config in configs.items()
+        for service_name, env_name, service_folder, service_type, source_dir in indexed_config['services']
+    ]
+
+
+def write_service_index(index, index_path):
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first so that concurrent jobs never see a partially written index
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=index_path.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, index_path)
+    except Exception:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+def find_service_configs(
+    included_services=asterisk_tuple, excluded_services=empty_tuple,
+    included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+    included_configs=asterisk_tuple, excluded_configs=empty_tuple,
+    config_dir=default_config_dir,
+    cache_dir=default_config_cache_dir
+):
+    """Returns a list of the ServiceIndexEntry tuples of the matching services, without loading any configs that have
+    not changed since the service index was last refreshed."""
+    entry_filter = compile_record_filter({
+        'service_name': (included_services, excluded_services),
+        'env_name': (included_envs, excluded_envs),
+        'config_name': (included_configs, excluded_configs),
+    })
+    return list(entry_filter.filter(get_service_index(config_dir, cache_dir)))
+
+
+def get_service_config_names(
+    included_configs=asterisk_tuple, excluded_configs=empty_tuple,
+    included_services=asterisk_tuple, excluded_services=empty_tuple,
+    included_envs=asterisk_tuple, excluded_envs=empty_tuple,
+    config_dir=default_config_dir,
+    cache_dir=default_config_cache_dir
+):
+    """Narrows down included_configs to the names of the configs that define one or more matching services in one or
+    more matching environments, according to the service index, so that only those configs need to be loaded.
+    Returns included_configs as-is if all services are included."""
+    if tuple(included_services) == asterisk_tuple:
+        return included_configs
+    config_names = list(dict.fromkeys(
+        entry.config_name for entry in find_service_configs(
+            included_services, excluded_services,
+            included_envs, excluded_envs,
+            included_configs, excluded_configs,
+            config_dir,
+            cache_dir
+        )
+    ))
+    if config_names:
+        log.debug(f'Configs defining services {", ".join(included_services)}: {", ".join(config_names)}')
+    else:
+        log.warning(f'No configs define services matching {", ".join(included_services)}')
+    return config_names
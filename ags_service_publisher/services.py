@@ -6,19 +6,18 @@ from itertools import chain
 from pathlib import Path
 from shutil import rmtree
 
+from .admin_client import admin_client
 from .ags_utils import (
     analyze_staging_result,
-    create_session,
     get_service_manifest,
-    get_service_status,
     list_data_stores,
-    list_service_folders,
     list_service_workspaces,
-    list_services,
     restart_service,
+    restart_services_in_batches,
     test_service
 )
-from .config_io import get_config, default_config_dir
+from .config_io import get_user_config, default_config_dir
+from .crawler import crawl_instances, crawl_services, default_max_concurrent_requests, sort_crawled_services
 from .datasources import (
     convert_mxd_to_aprx,
     open_aprx,
@@ -26,7 +25,7 @@ from .datasources import (
     get_layer_fields,
     get_layer_properties,
 )
-from .extrafilters import superfilter
+from .extrafilters import compile_record_filter
 from .helpers import asterisk_tuple, deep_get, empty_tuple
 from .logging_io import setup_logger
 
@@ -40,63 +39,67 @@ def generate_service_inventory(
     included_envs=asterisk_tuple, excluded_envs=empty_tuple,
     config_dir=default_config_dir
 ):
-    user_config = get_config('userconfig', config_dir)
-    env_names = superfilter(user_config['environments'].keys(), included_envs, excluded_envs)
-    if len(env_names) == 0:
-        raise RuntimeError('No environments specified!')
-    for env_name in env_names:
-        env = user_config['environments'][env_name]
-        ags_instances = superfilter(env['ags_instances'].keys(), included_instances, excluded_instances)
-        log.info(f'Listing services on ArcGIS Server instances {", ".join(ags_instances)}')
-        for ags_instance in ags_instances:
-            ags_instance_props = env['ags_instances'][ags_instance]
-            server_url = ags_instance_props['url']
-            token = ags_instance_props['token']
-            proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-            ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-            with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                service_folders = list_service_folders(server_url, token, session=session)
-                for service_folder in superfilter(service_folders, included_service_folders, excluded_service_folders):
-                    for service in list_services(server_url, token, service_folder, session=session):
-                        service_name = service['serviceName']
-                        service_type = service['type']
-                        if superfilter((service_name,), included_services, excluded_services):
-                            yield dict(
-                                env_name=env_name,
-                                ags_instance=ags_instance,
-                                service_folder=service_folder,
-                                service_name=service_name,
-                                service_type=service_type
-                            )
+    user_config = get_user_config(config_dir)
+    log.info('Listing services')
+    for record, _ in sort_crawled_services(crawl_services(
+        user_config,
+        included_envs, excluded_envs,
+        included_instances, excluded_instances,
+        included_service_folders, excluded_service_folders,
+        included_services, excluded_services
+    )):
+        yield dict(
+            env_name=record.env_name,
+            ags_instance=record.ags_instance,
+            service_folder=record.service_folder,
+            service_name=record.service_name,
+            service_type=record.service_type
+        )
 
 
 def generate_data_stores_inventory(
     included_instances=asterisk_tuple, excluded_instances=empty_tuple,
     included_envs=asterisk_tuple, excluded_envs=empty_tuple,
-    config_dir=default_config_dir
+    config_dir=default_config_dir,
+    max_concurrent_requests=default_max_concurrent_requests
 ):
-    user_config = get_config('userconfig', config_dir)
-    env_names = superfilter(user_config['environments'].keys(), included_envs, excluded_envs)
-    if len(env_names) == 0:
-        raise RuntimeError('No environments specified!')
-    for env_name in env_names:
-        env = user_config['environments'][env_name]
-        ags_instances = superfilter(env['ags_instances'].keys(), included_instances, excluded_instances)
-        log.info(f'Listing data stores on ArcGIS Server instances {", ".join(ags_instances)}')
-        for ags_instance in ags_instances:
-            ags_instance_props = env['ags_instances'][ags_instance]
-            server_url = ags_instance_props['url']
-            token = ags_instance_props['token']
-            proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-            ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-            with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                data_stores = list_data_stores(server_url, token, session=session)
-                for data_store in data_stores:
-                    yield dict(
-                        env_name=env_name,
-                        ags_instance=ags_instance,
-                        **data_store
-                    )
+    user_config = get_user_config(config_dir)
+
+    def list_instance_data_stores(client, env_name, ags_instance):
+        for data_store in list_data_stores(client.url, client.token, client.session, max_concurrent_requests):
+            yield dict(
+                env_name=env_name,
+                ags_instance=ags_instance,
+                **data_store
+            )
+
+    log.info('Listing data stores')
+    # Data stores are listed in no particular order, so sort them to list them in the same order on every run
+    yield from sorted(
+        crawl_instances(
+            user_config,
+            list_instance_data_stores,
+            included_envs, excluded_envs,
+            included_instances, excluded_instances
+        ),
+        key=lambda data_store: (data_store['env_name'], data_store['ags_instance'], data_store.get('item_path') or '')
+    )
+
+
+def get_crawled_service_manifest(client, record):
+    """crawl_services callback that returns the manifest of a service, or the exception raised while getting it, so that
+    manifests can be fetched concurrently while arcpy processes the services one at a time."""
+    try:
+        return get_service_manifest(
+            client.url,
+            client.token,
+            record.service_name,
+            record.service_folder,
+            record.service_type,
+            session=client.session
+        )
+    except Exception as e:
+        return e
 
 
 def analyze_services(
@@ -115,154 +118,145 @@ def analyze_services(
         raise
     log.debug('Successfully imported arcpy')
     arcpy.env.overwriteOutput = True
-    user_config = get_config('userconfig', config_dir)
-    env_names = superfilter(user_config['environments'].keys(), included_envs, excluded_envs)
-
-    for env_name in env_names:
-        log.debug(f'Analyzing services for environment {env_name}')
-        env = user_config['environments'][env_name]
-        for ags_instance in superfilter(env['ags_instances'], included_instances, excluded_instances):
-            ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
-            ags_connection = ags_instance_props['ags_connection']
-            server_url = ags_instance_props['url']
-            token = ags_instance_props['token']
-            proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-            ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-            with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                service_folders = list_service_folders(server_url, token, session=session)
-                for service_folder in superfilter(service_folders, included_service_folders, excluded_service_folders):
-                    for service in list_services(server_url, token, service_folder, session=session):
-                        service_name = service['serviceName']
-                        service_type = service['type']
-                        if (
-                            service_type in ('MapServer', 'GeocodeServer') and
-                            superfilter((service_name,), included_services, excluded_services)
-                        ):
-                            service_props = dict(
-                                env_name=env_name,
-                                ags_instance=ags_instance,
-                                service_folder=service_folder,
-                                service_name=service_name,
-                                service_type=service_type
+    user_config = get_user_config(config_dir)
+    crawled_services = sort_crawled_services(crawl_services(
+        user_config,
+        included_envs, excluded_envs,
+        included_instances, excluded_instances,
+        included_service_folders, excluded_service_folders,
+        included_services, excluded_services,
+        service_types=('MapServer', 'GeocodeServer'),
+        callback=get_crawled_service_manifest
+    ))
+    for (env_name, ags_instance, service_folder, service_name, service_type, _), service_manifest in crawled_services:
+        log.debug(f'Analyzing service {service_folder}/{service_name} on ArcGIS Server instance {ags_instance}')
+        ags_connection = user_config['environments'][env_name]['ags_instances'][ags_instance]['ags_connection']
+        service_props = dict(
+            env_name=env_name,
+            ags_instance=ags_instance,
+            service_folder=service_folder,
+            service_name=service_name,
+            service_type=service_type
+        )
+        try:
+            if isinstance(service_manifest, Exception):
+                raise service_manifest
+            service_props['file_path'] = file_path = service_manifest['resources'][0]['onPremisePath']
+            file_path = Path(file_path)
+            file_type = {
+                'MapServer': 'ArcGIS Pro project file' if file_path.suffix.lower() == '.aprx' else 'MXD',
+                'GeocodeServer': 'Locator'
+            }[service_type]
+            log.info(
+                f'Analyzing {service_type} service {service_folder}/{service_name} '
+                f'on ArcGIS Server instance {ags_instance} (Connection File: {ags_connection}, '
+                f'{file_type} Path: {file_path})'
+            )
+            if not arcpy.Exists(file_path):
+                raise RuntimeError(f'{file_type} {file_path} does not exist!')
+            try:
+                tempdir = Path(tempfile.mkdtemp())
+                log.debug(f'Temporary directory created: {tempdir}')
+                sddraft = tempdir / f'{service_name}.sddraft'
+                sd = tempdir / f'{service_name}.sd'
+                log.debug(f'Creating SDDraft file: {sddraft}')
+
+                if service_type == 'MapServer':
+                    if file_path.suffix.lower() == '.aprx':
+                        aprx = open_aprx(file_path)
+                    elif file_path.suffix.lower() == '.mxd':
+                        temp_aprx_path = tempdir / f'{service_name}.aprx'
+                        convert_mxd_to_aprx(file_path, temp_aprx_path)
+                        aprx = open_aprx(temp_aprx_path)
+                    else:
+                        raise RuntimeError(f'Unrecognized file type for {file_path}')
+
+                    map_ = aprx.listMaps()[0]
+                    map_service_draft = arcpy.sharing.CreateSharingDraft(
+                        server_type='STANDALONE_SERVER',
+                        service_type='MAP_SERVICE',
+                        service_name=service_name,
+                        draft_value=map_
+                    )
+                    map_service_draft.targetServer = ags_connection
+                    map_service_draft.serverFolder = service_folder
+                    map_service_draft.exportToSDDraft(str(sddraft))
+                    log.debug(f'Staging SDDraft file: {sddraft} to SD file: {sd}')
+                    result = arcpy.StageService_server(str(sddraft), str(sd))
+                    analysis = analyze_staging_result(result)
+                elif service_type == 'GeocodeServer':
+                    locator_path = file_path
+                    analysis = arcpy.CreateGeocodeSDDraft(
+                        str(locator_path),
+                        str(sddraft),
+                        service_name,
+                        'FROM_CONNECTION_FILE',
+                        ags_connection,
+                        False,
+                        service_folder
+                    )
+                else:
+                    raise RuntimeError(f'Unsupported service type {service_type}!')
+
+                for key, log_method in (('warnings', log.warn), ('errors', log.error)):
+                    items = analysis[key]
+                    severity = key[:-1].title()
+                    if items:
+                        log.info('----' + key.upper() + '---')
+                        for ((message, code), layerlist) in items.items():
+                            code = f'{code:05d}'
+                            log_method(f'    {message} (CODE {code})')
+                            code = f'="{code}"'
+                            issue_props = dict(
+                                severity=severity,
+                                code=code,
+                                message=message
                             )
-                            try:
-                                service_manifest = get_service_manifest(server_url, token, service_name, service_folder, service_type, session=session)
-                                service_props['file_path'] = file_path = service_manifest['resources'][0]['onPremisePath']
-                                file_path = Path(file_path)
-                                file_type = {
-                                    'MapServer': 'ArcGIS Pro project file' if file_path.suffix.lower() == '.aprx' else 'MXD',
-                                    'GeocodeServer': 'Locator'
-                                }[service_type]
-                                log.info(
-                                    f'Analyzing {service_type} service {service_folder}/{service_name} '
-                                    f'on ArcGIS Server instance {ags_instance} (Connection File: {ags_connection}, '
-                                    f'{file_type} Path: {file_path})'
-                                )
-                                if not arcpy.Exists(file_path):
-                                    raise RuntimeError(f'{file_type} {file_path} does not exist!')
-                                try:
-                                    tempdir = Path(tempfile.mkdtemp())
-                                    log.debug(f'Temporary directory created: {tempdir}')
-                                    sddraft = tempdir / f'{service_name}.sddraft'
-                                    sd = tempdir / f'{service_name}.sd'
-                                    log.debug(f'Creating SDDraft file: {sddraft}')
-
-                                    if service_type == 'MapServer':
-                                        if file_path.suffix.lower() == '.aprx':
-                                            aprx = open_aprx(file_path)
-                                        elif file_path.suffix.lower() == '.mxd':
-                                            temp_aprx_path = tempdir / f'{service_name}.aprx'
-                                            convert_mxd_to_aprx(file_path, temp_aprx_path)
-                                            aprx = open_aprx(temp_aprx_path)
-                                        else:
-                                            raise RuntimeError(f'Unrecognized file type for {file_path}')
-
-                                        map_ = aprx.listMaps()[0]
-                                        map_service_draft = arcpy.sharing.CreateSharingDraft(
-                                            server_type='STANDALONE_SERVER',
-                                            service_type='MAP_SERVICE',
-                                            service_name=service_name,
-                                            draft_value=map_
-                                        )
-                                        map_service_draft.targetServer = ags_connection
-                                        map_service_draft.serverFolder = service_folder
-                                        map_service_draft.exportToSDDraft(str(sddraft))
-                                        log.debug(f'Staging SDDraft file: {sddraft} to SD file: {sd}')
-                                        result = arcpy.StageService_server(str(sddraft), str(sd))
-                                        analysis = analyze_staging_result(result)
-                                    elif service_type == 'GeocodeServer':
-                                        locator_path = file_path
-                                        analysis = arcpy.CreateGeocodeSDDraft(
-                                            str(locator_path),
-                                            str(sddraft),
-                                            service_name,
-                                            'FROM_CONNECTION_FILE',
-                                            ags_connection,
-                                            False,
-                                            service_folder
-                                        )
-                                    else:
-                                        raise RuntimeError(f'Unsupported service type {service_type}!')
-
-                                    for key, log_method in (('warnings', log.warn), ('errors', log.error)):
-                                        items = analysis[key]
-                                        severity = key[:-1].title()
-                                        if items:
-                                            log.info('----' + key.upper() + '---')
-                                            for ((message, code), layerlist) in items.items():
-                                                code = f'{code:05d}'
-                                                log_method(f'    {message} (CODE {code})')
-                                                code = f'="{code}"'
-                                                issue_props = dict(
-                                                    severity=severity,
-                                                    code=code,
-                                                    message=message
-                                                )
-                                                if not layerlist:
-                                                    yield dict(chain(
-                                                        service_props.items(),
-                                                        issue_props.items()
-                                                    ))
-                                                else:
-                                                    log_method('       applies to:')
-                                                    for layer in layerlist:
-                                                        layer_name = deep_get(layer, 'longName', layer.name)
-                                                        layer_props = dict(
-                                                            dataset_name=layer.datasetName,
-                                                            workspace_path=layer.workspacePath,
-                                                            layer_name=layer_name
-                                                        )
-                                                        log_method(f'           {layer_name}')
-                                                        yield dict(chain(
-                                                            service_props.items(),
-                                                            issue_props.items(),
-                                                            layer_props.items()
-                                                        ))
-
-                                    if analysis['errors']:
-                                        error_message = (
-                                            f'Analysis failed for service {service_folder}/{service_name} '
-                                            f'at {datetime.datetime.now():%#m/%#d/%y %#I:%M:%S %p}'
-                                        )
-                                        log.error(error_message)
-                                        raise RuntimeError(error_message, analysis['errors'])
-                                finally:
-                                    log.debug(f'Cleaning up temporary directory: {tempdir}')
-                                    rmtree(tempdir, ignore_errors=True)
-                            except Exception as e:
-                                log.exception(
-                                    f'An error occurred while analyzing {service_type} '
-                                    f'service {service_folder}/{service_name} '
-                                    f'on ArcGIS Server instance {ags_instance}'
-                                )
-                                if not warn_on_errors:
-                                    raise
-                                else:
-                                    yield dict(
-                                        severity='Error',
-                                        message=str(e),
-                                        **service_props
+                            if not layerlist:
+                                yield dict(chain(
+                                    service_props.items(),
+                                    issue_props.items()
+                                ))
+                            else:
+                                log_method('       applies to:')
+                                for layer in layerlist:
+                                    layer_name = deep_get(layer, 'longName', layer.name)
+                                    layer_props = dict(
+                                        dataset_name=layer.datasetName,
+                                        workspace_path=layer.workspacePath,
+                                        layer_name=layer_name
                                     )
+                                    log_method(f'           {layer_name}')
+                                    yield dict(chain(
+                                        service_props.items(),
+                                        issue_props.items(),
+                                        layer_props.items()
+                                    ))
+
+                if analysis['errors']:
+                    error_message = (
+                        f'Analysis failed for service {service_folder}/{service_name} '
+                        f'at {datetime.datetime.now():%#m/%#d/%y %#I:%M:%S %p}'
+                    )
+                    log.error(error_message)
+                    raise RuntimeError(error_message, analysis['errors'])
+            finally:
+                log.debug(f'Cleaning up temporary directory: {tempdir}')
+                rmtree(tempdir, ignore_errors=True)
+        except Exception as e:
+            log.exception(
+                f'An error occurred while analyzing {service_type} '
+                f'service {service_folder}/{service_name} '
+                f'on ArcGIS Server instance {ags_instance}'
+            )
+            if not warn_on_errors:
+                raise
+            else:
+                yield dict(
+                    severity='Error',
+                    message=str(e),
+                    **service_props
+                )
 
 
 def list_service_layer_fields(
@@ -281,134 +275,125 @@ def list_service_layer_fields(
         raise
     log.debug('Successfully imported arcpy')
     arcpy.env.overwriteOutput = True
-    user_config = get_config('userconfig', config_dir)
-    env_names = superfilter(user_config['environments'].keys(), included_envs, excluded_envs)
-
-    for env_name in env_names:
-        log.debug(f'Listing service layers and fields for environment {env_name}')
-        env = user_config['environments'][env_name]
-        for ags_instance in superfilter(env['ags_instances'], included_instances, excluded_instances):
-            ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
-            ags_connection = ags_instance_props['ags_connection']
-            server_url = ags_instance_props['url']
-            token = ags_instance_props['token']
-            proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-            ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-            with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                service_folders = list_service_folders(server_url, token, session=session)
-                for service_folder in superfilter(service_folders, included_service_folders, excluded_service_folders):
-                    for service in list_services(server_url, token, service_folder, session=session):
-                        service_name = service['serviceName']
-                        service_type = service['type']
-                        if (
-                            service_type == 'MapServer' and
-                            superfilter((service_name,), included_services, excluded_services)
-                        ):
-                            service_props = dict(
-                                env_name=env_name,
-                                ags_instance=ags_instance,
-                                service_folder=service_folder,
-                                service_name=service_name,
-                                service_type=service_type,
-                                ags_connection=ags_connection
+    user_config = get_user_config(config_dir)
+    crawled_services = sort_crawled_services(crawl_services(
+        user_config,
+        included_envs, excluded_envs,
+        included_instances, excluded_instances,
+        included_service_folders, excluded_service_folders,
+        included_services, excluded_services,
+        service_types=('MapServer',),
+        callback=get_crawled_service_manifest
+    ))
+    for (env_name, ags_instance, service_folder, service_name, service_type, _), service_manifest in crawled_services:
+        log.debug(f'Listing service layers and fields for service {service_folder}/{service_name} on ArcGIS Server instance {ags_instance}')
+        ags_connection = user_config['environments'][env_name]['ags_instances'][ags_instance]['ags_connection']
+        service_props = dict(
+            env_name=env_name,
+            ags_instance=ags_instance,
+            service_folder=service_folder,
+            service_name=service_name,
+            service_type=service_type,
+            ags_connection=ags_connection
+        )
+        try:
+            if isinstance(service_manifest, Exception):
+                raise service_manifest
+            service_props['file_path'] = file_path = service_manifest['resources'][0]['onPremisePath']
+            file_path = Path(file_path)
+            log.info(
+                f'Listing layers and fields for {service_type} service {service_folder}/{service_name} '
+                f'on ArcGIS Server instance {ags_instance} '
+                f'(Connection File: {ags_connection}, File Path: {file_path})'
+            )
+            file_type = 'ArcGIS Pro project file' if file_path.suffix.lower() == '.aprx' else 'MXD'
+            if not arcpy.Exists(file_path):
+                raise RuntimeError(f'{file_type} {file_path} does not exist!')
+            try:
+                tempdir = None
+                if file_path.suffix.lower() == '.aprx':
+                    aprx = open_aprx(file_path)
+                elif file_path.suffix.lower() == '.mxd':
+                    tempdir = Path(tempfile.mkdtemp())
+                    log.debug(f'Temporary directory created: {tempdir}')
+                    temp_aprx_path = tempdir / f'{service_name}.aprx'
+                    convert_mxd_to_aprx(file_path, temp_aprx_path)
+                    aprx = open_aprx(temp_aprx_path)
+                else:
+                    raise RuntimeError(f'Unrecognized file type for {file_path}')
+
+                for layer in list_layers_in_map(aprx.listMaps()[0]):
+                    if not (
+                        deep_get(layer, 'isGroupLayer', False) or
+                        deep_get(layer, 'isRasterLayer', False)
+                    ):
+                        layer_name = deep_get(layer, 'longName', layer.name)
+                        try:
+                            layer_props = get_layer_properties(layer)
+                        except Exception as e:
+                            log.exception(
+                                f'An error occurred while retrieving properties for layer {layer_name} in {file_type} {file_path}'
                             )
-                            try:
-                                service_manifest = get_service_manifest(server_url, token, service_name, service_folder, service_type, session=session)
-                                service_props['file_path'] = file_path = service_manifest['resources'][0]['onPremisePath']
-                                file_path = Path(file_path)
-                                log.info(
-                                    f'Listing layers and fields for {service_type} service {service_folder}/{service_name} '
-                                    f'on ArcGIS Server instance {ags_instance} '
-                                    f'(Connection File: {ags_connection}, File Path: {file_path})'
+                            if not warn_on_errors:
+                                raise
+                            else:
+                                yield dict(
+                                    error=f'Error retrieving layer properties: {e}',
+                                    layer_name=layer_name,
+                                    **service_props
                                 )
-                                file_type = 'ArcGIS Pro project file' if file_path.suffix.lower() == '.aprx' else 'MXD'
-                                if not arcpy.Exists(file_path):
-                                    raise RuntimeError(f'{file_type} {file_path} does not exist!')
-                                try:
-                                    tempdir = None
-                                    if file_path.suffix.lower() == '.aprx':
-                                        aprx = open_aprx(file_path)
-                                    elif file_path.suffix.lower() == '.mxd':
-                                        tempdir = Path(tempfile.mkdtemp())
-                                        log.debug(f'Temporary directory created: {tempdir}')
-                                        temp_aprx_path = tempdir / f'{service_name}.aprx'
-                                        convert_mxd_to_aprx(file_path, temp_aprx_path)
-                                        aprx = open_aprx(temp_aprx_path)
-                                    else:
-                                        raise RuntimeError(f'Unrecognized file type for {file_path}')
-
-                                    for layer in list_layers_in_map(aprx.listMaps()[0]):
-                                        if not (
-                                            deep_get(layer, 'isGroupLayer', False) or
-                                            deep_get(layer, 'isRasterLayer', False)
-                                        ):
-                                            layer_name = deep_get(layer, 'longName', layer.name)
-                                            try:
-                                                layer_props = get_layer_properties(layer)
-                                            except Exception as e:
-                                                log.exception(
-                                                    f'An error occurred while retrieving properties for layer {layer_name} in {file_type} {file_path}'
-                                                )
-                                                if not warn_on_errors:
-                                                    raise
-                                                else:
-                                                    yield dict(
-                                                        error=f'Error retrieving layer properties: {e}',
-                                                        layer_name=layer_name,
-                                                        **service_props
-                                                    )
-                                                    continue
-                                            try:
-                                                if layer_props['is_broken']:
-                                                    raise RuntimeError(
-                                                        f'Layer\'s data source is broken '
-                                                        f'(Layer: {layer_name}, '
-                                                        f'Data Source: {deep_get(layer, "dataSource", "n/a")}'
-                                                    )
-                                                for field_props in get_layer_fields(layer):
-                                                    field_props['needs_index'] = not field_props['has_index'] and (
-                                                        field_props['in_definition_query'] or
-                                                        field_props['in_label_class_expression'] or
-                                                        field_props['in_label_class_sql_query'] or
-                                                        field_props['field_name'] in layer_props['symbology_fields'] or
-                                                        field_props['field_type'] == 'Geometry'
-                                                    )
-
-                                                    yield dict(chain(
-                                                        service_props.items(),
-                                                        layer_props.items(),
-                                                        field_props.items()
-                                                    ))
-                                            except Exception as e:
-                                                log.exception(
-                                                    f'An error occurred while listing fields for layer {layer_name} in {file_type} {file_path}'
-                                                )
-                                                if not warn_on_errors:
-                                                    raise
-                                                else:
-                                                    yield dict(chain(
-                                                        service_props.items(),
-                                                        layer_props.items()
-                                                    ),
-                                                        error=f'Error retrieving layer fields: {e}'
-                                                    )
-                                finally:
-                                    if tempdir:
-                                        log.debug(f'Cleaning up temporary directory: {tempdir}')
-                                        rmtree(tempdir, ignore_errors=True)
-                            except Exception as e:
-                                log.exception(
-                                    f'An error occurred while listing layers and fields for '
-                                    f'{service_type} service {service_folder}/{service_name} on '
-                                    f'ArcGIS Server instance {ags_instance} (Connection File: {ags_connection})'
+                                continue
+                        try:
+                            if layer_props['is_broken']:
+                                raise RuntimeError(
+                                    f'Layer\'s data source is broken '
+                                    f'(Layer: {layer_name}, '
+                                    f'Data Source: {deep_get(layer, "dataSource", "n/a")}'
                                 )
-                                if not warn_on_errors:
-                                    raise
-                                else:
-                                    yield dict(
-                                        error=str(e),
-                                        **service_props
-                                    )
+                            for field_props in get_layer_fields(layer):
+                                field_props['needs_index'] = not field_props['has_index'] and (
+                                    field_props['in_definition_query'] or
+                                    field_props['in_label_class_expression'] or
+                                    field_props['in_label_class_sql_query'] or
+                                    field_props['field_name'] in layer_props['symbology_fields'] or
+                                    field_props['field_type'] == 'Geometry'
+                                )
+
+                                yield dict(chain(
+                                    service_props.items(),
+                                    layer_props.items(),
+                                    field_props.items()
+                                ))
+                        except Exception as e:
+                            log.exception(
+                                f'An error occurred while listing fields for layer {layer_name} in {file_type} {file_path}'
+                            )
+                            if not warn_on_errors:
+                                raise
+                            else:
+                                yield dict(chain(
+                                    service_props.items(),
+                                    layer_props.items()
+                                ),
+                                    error=f'Error retrieving layer fields: {e}'
+                                )
+            finally:
+                if tempdir:
+                    log.debug(f'Cleaning up temporary directory: {tempdir}')
+                    rmtree(tempdir, ignore_errors=True)
+        except Exception as e:
+            log.exception(
+                f'An error occurred while listing layers and fields for '
+                f'{service_type} service {service_folder}/{service_name} on '
+                f'ArcGIS Server instance {ags_instance} (Connection File: {ags_connection})'
+            )
+            if not warn_on_errors:
+                raise
+            else:
+                yield dict(
+                    error=str(e),
+                    **service_props
+                )
 
 
 def find_service_dataset_usages(
@@ -420,54 +405,52 @@ def find_service_dataset_usages(
     included_service_folders=asterisk_tuple, excluded_service_folders=empty_tuple,
     included_instances=asterisk_tuple, excluded_instances=empty_tuple,
     included_envs=asterisk_tuple, excluded_envs=empty_tuple,
-    config_dir=default_config_dir
+    config_dir=default_config_dir,
+    max_concurrent_requests=default_max_concurrent_requests
 ):
-    user_config = get_config('userconfig', config_dir)
-    env_names = superfilter(user_config['environments'].keys(), included_envs, excluded_envs)
-    if len(env_names) == 0:
-        raise RuntimeError('No environments specified!')
-    for env_name in env_names:
-        env = user_config['environments'][env_name]
-        ags_instances = superfilter(env['ags_instances'].keys(), included_instances, excluded_instances)
-        log.info(f'Finding service dataset usages on ArcGIS Server instances {", ".join(ags_instances)}')
-        for ags_instance in ags_instances:
-            ags_instance_props = env['ags_instances'][ags_instance]
-            server_url = ags_instance_props['url']
-            token = ags_instance_props['token']
-            proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-            ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-            with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                service_folders = list_service_folders(server_url, token, session=session)
-                for service_folder in superfilter(service_folders, included_service_folders, excluded_service_folders):
-                    for service in list_services(server_url, token, service_folder, session=session):
-                        service_name = service['serviceName']
-                        service_type = service['type']
-                        service_props = dict(
-                            env_name=env_name,
-                            ags_instance=ags_instance,
-                            service_folder=service_folder,
-                            service_name=service_name,
-                            service_type=service_type
-                        )
-                        if superfilter((service_name,), included_services, excluded_services):
-                            for dataset_props in list_service_workspaces(
-                                server_url,
-                                token,
-                                service_name,
-                                service_folder,
-                                service_type,
-                                session=session
-                            ):
-                                if (
-                                    superfilter((dataset_props['dataset_name'],), included_datasets, excluded_datasets) and
-                                    superfilter((dataset_props['user'],), included_users, excluded_users) and
-                                    superfilter((dataset_props['database'],), included_databases, excluded_databases) and
-                                    superfilter((dataset_props['version'],), included_versions, excluded_versions)
-                                ):
-                                    yield dict(chain(
-                                        service_props.items(),
-                                        dataset_props.items()
-                                    ))
+    user_config = get_user_config(config_dir)
+
+    def list_workspaces(client, record):
+        return list(
+            list_service_workspaces(
+                client.url,
+                client.token,
+                record.service_name,
+                record.service_folder,
+                record.service_type,
+                session=client.session
+            ) or ()
+        )
+
+    dataset_filter = compile_record_filter({
+        'dataset_name': (included_datasets, excluded_datasets),
+        'user': (included_users, excluded_users),
+        'database': (included_databases, excluded_databases),
+        'version': (included_versions, excluded_versions),
+    })
+
+    log.info('Finding service dataset usages')
+    for record, datasets in sort_crawled_services(crawl_services(
+        user_config,
+        included_envs, excluded_envs,
+        included_instances, excluded_instances,
+        included_service_folders, excluded_service_folders,
+        included_services, excluded_services,
+        callback=list_workspaces,
+        max_concurrent_requests=max_concurrent_requests
+    )):
+        service_props = dict(
+            env_name=record.env_name,
+            ags_instance=record.ags_instance,
+            service_folder=record.service_folder,
+            service_name=record.service_name,
+            service_type=record.service_type
+        )
+        for dataset_props in dataset_filter.filter(datasets):
+            yield dict(chain(
+                service_props.items(),
+                dataset_props.items()
+            ))
 
 
 def restart_services(
@@ -479,41 +462,63 @@ def restart_services(
     delay=30,
     max_retries=3,
     test_after_restart=True,
-    config_dir=default_config_dir
+    config_dir=default_config_dir,
+    batch_size=None,
+    timeout=300
 ):
-    user_config = get_config('userconfig', config_dir)
-    env_names = superfilter(user_config['environments'].keys(), included_envs, excluded_envs)
-    if len(env_names) == 0:
-        raise RuntimeError('No environments specified!')
-    for env_name in env_names:
-        env = user_config['environments'][env_name]
-        ags_instances = superfilter(env['ags_instances'].keys(), included_instances, excluded_instances)
-        log.info(f'Restarting services on ArcGIS Server instances {", ".join(ags_instances)}')
-        for ags_instance in ags_instances:
-            ags_instance_props = env['ags_instances'][ags_instance]
-            server_url = ags_instance_props['url']
-            token = ags_instance_props['token']
-            proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-            ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-            with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                service_folders = list_service_folders(server_url, token, session=session)
-                for service_folder in superfilter(service_folders, included_service_folders, excluded_service_folders):
-                    for service in list_services(server_url, token, service_folder, session=session):
-                        service_name = service['serviceName']
-                        service_type = service['type']
-                        if superfilter((service_name,), included_services, excluded_services):
-                            if not include_running_services:
-                                status = get_service_status(server_url, token, service_name, service_folder, service_type, session=session)
-                                configured_state = status.get('configuredState')
-                                if configured_state == 'STARTED':
-                                    log.debug(
-                                        f'Skipping restart of service {service_folder}/{service_name} ({service_type}) '
-                                        f'because its configured state is {configured_state} and '
-                                        f'include_running_services is {include_running_services}'
-                                    )
-                                    continue
-                                restart_service(server_url, token, service_name, service_folder, service_type, delay, max_retries, test_after_restart, session=session)
-                            restart_service(server_url, token, service_name, service_folder, service_type, delay, max_retries, test_after_restart, session=session)
+    """Restarts the matching services, and returns a list of the results of restarting each service, including how
+    long it took to become ready."""
+    user_config = get_user_config(config_dir)
+    # Crawl all instances before restarting anything, and restart the services of each instance in turn
+    services_to_restart = collections.defaultdict(list)
+    for record, _ in sort_crawled_services(crawl_services(
+        user_config,
+        included_envs, excluded_envs,
+        included_instances, excluded_instances,
+        included_service_folders, excluded_service_folders,
+        included_services, excluded_services,
+        # Get the status of every service in the folder in one request when it is needed
+        report_parameters=None if include_running_services else ('STATUS',)
+    )):
+        if not include_running_services:
+            configured_state = record.service.get('status', {}).get('configuredState')
+            if configured_state == 'STARTED':
+                log.debug(
+                    f'Skipping restart of service {record.service_folder}/{record.service_name} '
+                    f'({record.service_type}) because its configured state is {configured_state} and '
+                    f'include_running_services is {include_running_services}'
+                )
+                continue
+        services_to_restart[record.env_name, record.ags_instance].append(
+            (record.service_name, record.service_folder, record.service_type)
+        )
+    results = []
+    for (env_name, ags_instance), services in services_to_restart.items():
+        log.info(f'Restarting {len(services)} services on ArcGIS Server instance {ags_instance}')
+        with admin_client(user_config, env_name, ags_instance) as client:
+            if batch_size:
+                instance_results = restart_services_in_batches(
+                    client.url,
+                    client.token,
+                    services,
+                    batch_size,
+                    timeout,
+                    delay,
+                    max_retries,
+                    test_after_restart,
+                    session=client.session
+                )
+            else:
+                instance_results = (
+                    restart_service(
+                        client.url, client.token, service_name, service_folder, service_type,
+                        delay, max_retries, test_after_restart, timeout, session=client.session
+                    )
+                    for service_name, service_folder, service_type in services
+                )
+            for result in instance_results:
+                results.append(dict(env_name=env_name, ags_instance=ags_instance, **result))
+    return results
 
 
 def test_services(
@@ -522,38 +527,43 @@ def test_services(
     included_instances=asterisk_tuple, excluded_instances=empty_tuple,
     included_envs=asterisk_tuple, excluded_envs=empty_tuple,
     warn_on_errors=False,
-    config_dir=default_config_dir
+    config_dir=default_config_dir,
+    max_concurrent_requests=default_max_concurrent_requests
 ):
-    user_config = get_config('userconfig', config_dir)
-    env_names = superfilter(user_config['environments'].keys(), included_envs, excluded_envs)
-    if len(env_names) == 0:
-        raise RuntimeError('No environments specified!')
-    for env_name in env_names:
-        env = user_config['environments'][env_name]
-        ags_instances = superfilter(env['ags_instances'].keys(), included_instances, excluded_instances)
-        log.info(f'Testing services on ArcGIS Server instances {", ".join(ags_instances)}')
-        for ags_instance in ags_instances:
-            ags_instance_props = env['ags_instances'][ags_instance]
-            server_url = ags_instance_props['url']
-            token = ags_instance_props['token']
-            proxies = ags_instance_props.get('proxies') or user_config.get('proxies')
-            ciphers = ags_instance_props.get('ciphers') or user_config.get('ciphers')
-            with create_session(server_url, proxies=proxies, ciphers=ciphers) as session:
-                service_folders = list_service_folders(server_url, token, session=session)
-                for service_folder in superfilter(service_folders, included_service_folders, excluded_service_folders):
-                    for service in list_services(server_url, token, service_folder, session=session):
-                        service_name = service['serviceName']
-                        service_type = service['type']
-                        if superfilter((service_name,), included_services, excluded_services):
-                            test_data = test_service(server_url, token, service_name, service_folder, service_type, warn_on_errors, session=session)
-                            yield dict(
-                                env_name=env_name,
-                                ags_instance=ags_instance,
-                                service_folder=service_folder,
-                                service_name=service_name,
-                                service_type=service_type,
-                                **test_data
-                            )
+    user_config = get_user_config(config_dir)
+
+    def test(client, record):
+        # The status of each service comes from the folder report, so only the health check itself is requested
+        return test_service(
+            client.url,
+            client.token,
+            record.service_name,
+            record.service_folder,
+            record.service_type,
+            warn_on_errors,
+            record.service.get('status', {}),
+            session=client.session
+        )
+
+    log.info('Testing services')
+    for record, test_data in sort_crawled_services(crawl_services(
+        user_config,
+        included_envs, excluded_envs,
+        included_instances, excluded_instances,
+        included_service_folders, excluded_service_folders,
+        included_services, excluded_services,
+        callback=test,
+        report_parameters=('STATUS',),
+        max_concurrent_requests=max_concurrent_requests
+    )):
+        yield dict(
+            env_name=record.env_name,
+            ags_instance=record.ags_instance,
+            service_folder=record.service_folder,
+            service_name=record.service_name,
+            service_type=record.service_type,
+            **test_data
+        )
 
 
 def normalize_services(services, default_service_properties=None, env_service_properties=None):
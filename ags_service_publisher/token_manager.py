@@ -0,0 +1,109 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .ags_utils import create_session, generate_token_info, prompt_for_credentials
+from .config_io import default_config_dir, update_user_config
+from .logging_io import setup_logger, with_log_context
+
+log = setup_logger(__name__)
+
+
+def get_token_expiry(ags_instance_props):
+    """Returns the expiry time of the token of an ArcGIS Server instance in seconds since the epoch, or None if it is
+    not known."""
+    token_expires = ags_instance_props.get('token_expires')
+    return token_expires / 1000 if token_expires else None
+
+
+class TokenManager:
+    """Keeps the tokens of ArcGIS Server instances valid for the duration of long jobs.
+    Tokens are refreshed with the given credentials when they are requested within refresh_margin seconds of their
+    expiry (or when their expiry is not known), and refreshed tokens are saved to userconfig.yml along with their expiry
+    time. Only one refresh is performed at a time for each instance, even if several threads request its token."""
+
+    def __init__(
+        self,
+        username=None,
+        password=None,
+        expiration=15,
+        refresh_margin=120,
+        config_dir=default_config_dir,
+        max_workers=8
+    ):
+        self.username, self.password = prompt_for_credentials(username, password)
+        self.expiration = expiration
+        self.refresh_margin = refresh_margin
+        self.config_dir = config_dir
+        self.max_workers = max_workers
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._instance_locks = {}
+
+    def get_token(self, user_config, env_name, ags_instance, force=False):
+        """Returns a valid token for the ArcGIS Server instance, refreshing it first if it is about to expire (or
+        regardless, if force is True)."""
+        key = (env_name, ags_instance)
+        with self._lock:
+            instance_lock = self._instance_locks.setdefault(key, threading.Lock())
+        with instance_lock:
+            token, expiry = self._tokens.get(key) or self._get_configured_token(user_config, env_name, ags_instance)
+            if force or expiry is None or expiry - time.time() < self.refresh_margin:
+                token, expiry = self._refresh_token(user_config, env_name, ags_instance)
+            self._tokens[key] = token, expiry
+        return token
+
+    def refresh_tokens(self, user_config, env_name, ags_instances, force=False):
+        """Gets valid tokens for several ArcGIS Server instances concurrently, refreshing them as needed."""
+        if not ags_instances:
+            return {}
+        with ThreadPoolExecutor(min(self.max_workers, len(ags_instances)), thread_name_prefix='TokenManager') as executor:
+            return dict(zip(
+                ags_instances,
+                executor.map(
+                    with_log_context(lambda ags_instance: self.get_token(user_config, env_name, ags_instance, force)),
+                    ags_instances
+                )
+            ))
+
+    @staticmethod
+    def _get_configured_token(user_config, env_name, ags_instance):
+        ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
+        return ags_instance_props.get('token'), get_token_expiry(ags_instance_props)
+
+    def _refresh_token(self, user_config, env_name, ags_instance):
+        ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
+        server_url = ags_instance_props['url']
+        log.info(f'Refreshing token for ArcGIS Server instance {ags_instance}')
+        with create_session(
+            server_url,
+            ags_instance_props.get('proxies') or user_config.get('proxies'),
+            ags_instance_props.get('ciphers') or user_config.get('ciphers')
+        ) as session:
+            token_info = generate_token_info(
+                server_url,
+                self.username,
+                self.password,
+                self.expiration,
+                ags_instance,
+                session=session
+            )
+        expiry = token_info['expires'] / 1000
+        log.debug(
+            f'Token for ArcGIS Server instance {ags_instance} expires at '
+            f'{datetime.datetime.fromtimestamp(expiry):%Y-%m-%d %H:%M:%S}'
+        )
+        ags_instance_props['token'] = token_info['token']
+        ags_instance_props['token_expires'] = token_info['expires']
+        self._save_token(env_name, ags_instance, token_info)
+        return token_info['token'], expiry
+
+    def _save_token(self, env_name, ags_instance, token_info):
+        # Update the current userconfig.yml so that changes made since it was loaded are not overwritten
+        def set_token(user_config):
+            ags_instance_props = user_config['environments'][env_name]['ags_instances'][ags_instance]
+            ags_instance_props['token'] = token_info['token']
+            ags_instance_props['token_expires'] = token_info['expires']
+
+        update_user_config(set_token, self.config_dir)
@@ -0,0 +1,243 @@
+import collections
+import itertools
+import multiprocessing
+import pickle
+import queue
+import threading
+import traceback
+from concurrent.futures import Future
+
+from .logging_io import get_log_context, setup_logger
+from .mplog import MPLogger, logged_call
+
+log = setup_logger(__name__)
+
+
+def import_arcpy():
+    log.debug('Importing arcpy...')
+    try:
+        import arcpy  # noqa: F401
+    except Exception:
+        log.exception('An error occurred importing arcpy')
+        return
+    log.debug('Successfully imported arcpy')
+
+
+def get_process_memory():
+    """Returns the resident set size of the current process in bytes."""
+    import psutil
+    return psutil.Process().memory_info().rss
+
+
+def worker_main(worker_id, task_queue, result_queue, log_queue, initializer, max_tasks, max_memory):
+    if initializer:
+        logged_call(log_queue, initializer)
+    tasks_completed = 0
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, log_context, func, args, kwargs = task
+        MPLogger.log_context = log_context
+        try:
+            # Pickle the result here rather than in the result queue's feeder thread, which would drop an unpicklable
+            # result and leave the task incomplete
+            result = ('done', pickle.dumps(logged_call(log_queue, func, *args, **kwargs)))
+        except Exception:
+            result = ('failed', traceback.format_exc())
+        tasks_completed += 1
+        retire_reason = None
+        if max_tasks and tasks_completed >= max_tasks:
+            retire_reason = f'completed {tasks_completed} tasks'
+        elif max_memory:
+            memory = get_process_memory()
+            if memory > max_memory:
+                retire_reason = f'memory usage of {memory / 1024 ** 2:.0f} MB exceeds {max_memory / 1024 ** 2:.0f} MB'
+        result_queue.put((worker_id, task_id) + result + (retire_reason,))
+        if retire_reason:
+            break
+
+
+class WorkerProcess:
+    def __init__(self, worker_id, process, task_queue):
+        self.worker_id = worker_id
+        self.process = process
+        self.task_queue = task_queue
+        self.task = None
+
+
+class WorkerPool:
+    """Pool of long-lived worker processes that run functions via mplog.logged_call, so that log records emitted by
+    the workers are handled by the loggers of the main process.
+    The initializer (by default, importing arcpy) is run once when each worker starts, rather than once per task.
+    Workers are recycled after completing max_tasks_per_worker tasks, or when their resident memory exceeds
+    max_worker_memory megabytes, to contain memory leaks. Workers that exit unexpectedly are replaced and their current
+    task is failed."""
+
+    poll_interval = 1
+
+    def __init__(
+        self,
+        log_queue,
+        processes=1,
+        max_tasks_per_worker=None,
+        max_worker_memory=None,
+        initializer=import_arcpy
+    ):
+        self.log_queue = log_queue
+        self.processes = processes
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_worker_memory = max_worker_memory * 1024 ** 2 if max_worker_memory else None
+        self.initializer = initializer
+        self._lock = threading.Lock()
+        self._result_queue = multiprocessing.Queue()
+        self._workers = {}
+        self._retired = []
+        self._pending = collections.deque()
+        self._futures = {}
+        self._task_ids = itertools.count()
+        self._worker_ids = itertools.count()
+        self._closing = False
+        self._stopped = threading.Event()
+        self._collector = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def start(self):
+        log.debug(
+            f'Starting worker pool with {self.processes} processes '
+            f'(max tasks per worker: {self.max_tasks_per_worker}, max worker memory: {self.max_worker_memory})'
+        )
+        with self._lock:
+            for _ in range(self.processes):
+                self._spawn_worker()
+        self._collector = threading.Thread(target=self._collect_results, name='WorkerPoolCollector')
+        self._collector.daemon = True
+        self._collector.start()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            if self._closing:
+                raise RuntimeError('Cannot submit tasks to a worker pool that is closing')
+            task_id = next(self._task_ids)
+            self._futures[task_id] = future
+            self._pending.append((task_id, get_log_context(), func, args, kwargs))
+            self._dispatch()
+        return future
+
+    def apply(self, func, *args, **kwargs):
+        return self.submit(func, *args, **kwargs).result()
+
+    def close(self):
+        with self._lock:
+            self._closing = True
+            futures = list(self._futures.values())
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+        with self._lock:
+            for worker in self._workers.values():
+                worker.task_queue.put(None)
+            self._retired.extend(self._workers.values())
+            self._workers.clear()
+        for worker in self._retired:
+            worker.process.join()
+        self._stopped.set()
+        if self._collector:
+            self._collector.join()
+        log.debug('Worker pool closed')
+
+    def _spawn_worker(self):
+        worker_id = next(self._worker_ids)
+        task_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=worker_main,
+            args=(
+                worker_id,
+                task_queue,
+                self._result_queue,
+                self.log_queue,
+                self.initializer,
+                self.max_tasks_per_worker,
+                self.max_worker_memory
+            ),
+            name=f'WorkerPoolProcess-{worker_id}'
+        )
+        process.start()
+        log.debug(f'Started worker process {process.name} (pid {process.pid})')
+        self._workers[worker_id] = WorkerProcess(worker_id, process, task_queue)
+
+    def _dispatch(self):
+        for worker in self._workers.values():
+            if not self._pending:
+                break
+            if worker.task is None:
+                worker.task = self._pending.popleft()
+                worker.task_queue.put(worker.task)
+
+    def _handle_result(self, message):
+        worker_id, task_id, status, value, retire_reason = message
+        future = self._futures.pop(task_id, None)
+        if future:
+            if status == 'done':
+                try:
+                    future.set_result(pickle.loads(value))
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                log.debug(f'Task {task_id} failed in worker process:\n{value}')
+                future.set_exception(RuntimeError(value.strip().splitlines()[-1]))
+        worker = self._workers.get(worker_id)
+        if worker:
+            worker.task = None
+            if retire_reason:
+                log.debug(f'Recycling worker process {worker.process.name} (pid {worker.process.pid}): {retire_reason}')
+                self._retired.append(self._workers.pop(worker_id))
+                if not self._closing:
+                    self._spawn_worker()
+
+    def _reap_dead_workers(self):
+        self._retired = [worker for worker in self._retired if worker.process.is_alive()]
+        dead_workers = [worker for worker in self._workers.values() if not worker.process.is_alive()]
+        if not dead_workers:
+            return
+        # Handle any results the workers sent before exiting
+        while True:
+            try:
+                self._handle_result(self._result_queue.get_nowait())
+            except queue.Empty:
+                break
+        for worker in dead_workers:
+            if self._workers.pop(worker.worker_id, None) is None:
+                continue
+            error_message = (
+                f'Worker process {worker.process.name} (pid {worker.process.pid}) exited unexpectedly '
+                f'with exitcode {worker.process.exitcode}'
+            )
+            log.error(error_message)
+            if worker.task:
+                future = self._futures.pop(worker.task[0], None)
+                if future:
+                    future.set_exception(RuntimeError(error_message))
+            if not self._closing:
+                self._spawn_worker()
+
+    def _collect_results(self):
+        while not self._stopped.is_set():
+            try:
+                message = self._result_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                message = None
+            with self._lock:
+                if message:
+                    self._handle_result(message)
+                self._reap_dead_workers()
+                self._dispatch()
@@ -0,0 +1,74 @@
+"""Benchmark of connection string parsing against the previous character-by-character implementation.
+Run from the root of this repository with: python benchmarks/connection_strings.py"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ags_service_publisher.ags_utils import parse_connection_string, parse_connection_string_items  # noqa: E402
+from ags_service_publisher.helpers import unquote_string  # noqa: E402
+
+
+def legacy_split_quoted_string(input_string, delimiter):
+    parts = []
+    quoted = False
+    part = ''
+    length = len(input_string)
+    for i, char in enumerate(input_string):
+        if i == length - 1:
+            part += char
+            parts.append(part)
+            break
+        if not quoted and char == delimiter:
+            parts.append(part)
+            part = ''
+        elif not quoted and char == '"':
+            quoted = True
+            part += char
+        elif quoted and char == '"':
+            quoted = False
+            part += char
+        else:
+            part += char
+    return parts
+
+
+def legacy_parse_connection_string(conn_string):
+    properties = {}
+    for pair in legacy_split_quoted_string(conn_string, ';'):
+        key, value = legacy_split_quoted_string(pair, '=')
+        properties[key] = unquote_string(value)
+    return properties
+
+
+conn_strings = [
+    'ENCRYPTED_PASSWORD=00022e68{0:04d};SERVER=gisdb{1};INSTANCE=sde:sqlserver:gisdb{1};DBCLIENT=sqlserver;'
+    'DB_CONNECTION_PROPERTIES=gisdb{1};DATABASE=COA_GIS_{1};USER=map_service_{0};VERSION=sde.DEFAULT;'
+    'AUTHENTICATION_MODE=DBMS'.format(i, i % 4)
+    for i in range(25)
+] + [
+    'DATABASE="C:\\arcgisserver\\data\\Service Data {}.gdb";AUTHENTICATION_MODE=OSA'.format(i)
+    for i in range(5)
+] + [
+    'ENCRYPTED_PASSWORD=00022e68;SERVER=oradb;INSTANCE="sde:oracle11g:oradb;LOCAL=GISPROD";DBCLIENT=oracle;'
+    'DB_CONNECTION_PROPERTIES=oradb;USER=GIS_{};VERSION=SDE.DEFAULT;AUTHENTICATION_MODE=DBMS'.format(i)
+    for i in range(5)
+]
+
+
+if __name__ == "__main__":
+    # Each connection string is parsed many times, as it is for the datasets of every manifest
+    workload = conn_strings * 200
+    number = 5
+    legacy_time = timeit.timeit(lambda: [legacy_parse_connection_string(c) for c in workload], number=number)
+    parse_connection_string_items.cache_clear()
+    uncached_time = timeit.timeit(
+        lambda: [parse_connection_string_items.__wrapped__(c) for c in workload],
+        number=number
+    )
+    cached_time = timeit.timeit(lambda: [parse_connection_string(c) for c in workload], number=number)
+    print(f'Parsed {len(workload) * number} connection strings:')
+    print(f'  previous implementation: {legacy_time:.3f}s')
+    print(f'  single-pass tokenizer:   {uncached_time:.3f}s ({legacy_time / uncached_time:.1f}x faster)')
+    print(f'  with memoization:        {cached_time:.3f}s ({legacy_time / cached_time:.1f}x faster)')
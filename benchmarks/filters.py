@@ -0,0 +1,116 @@
+"""Benchmark of compiled filters against the previous implementation, which matched every name against every pattern
+with fnmatch.fnmatch. Run from the root of this repository with: python benchmarks/filters.py"""
+import collections
+import fnmatch
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ags_service_publisher.extrafilters import compile_filter, compile_record_filter, superfilter  # noqa: E402
+
+
+def legacy_multifilter(names, patterns):
+    for name in names:
+        for pattern in patterns:
+            if fnmatch.fnmatch(name, pattern):
+                yield name
+                break
+
+
+def legacy_superfilter(names, inclusion_patterns=(), exclusion_patterns=()):
+    included = legacy_multifilter(names, inclusion_patterns) if inclusion_patterns else names
+    excluded = legacy_multifilter(names, exclusion_patterns) if exclusion_patterns else ()
+    filtered = set(included) - set(excluded)
+    return type(names)((name for name in names if name in filtered))
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    words = [''.join(random.choices(string.ascii_letters, k=random.randint(4, 12))) for _ in range(2000)]
+    names = [f'{random.choice(words)}.{random.choice(words)}_{i % 1000}' for i in range(100000)]
+    # Half of the patterns are plain names, and half have wildcards, as in typical service and dataset filters
+    inclusion_patterns = [random.choice(names) for _ in range(20)] + [f'{random.choice(words)}*' for _ in range(20)]
+    exclusion_patterns = [random.choice(names) for _ in range(5)] + [f'*_{i}?' for i in range(5)]
+
+    number = 1
+    legacy_time = timeit.timeit(
+        lambda: legacy_superfilter(names, inclusion_patterns, exclusion_patterns),
+        number=number
+    )
+    compiled_time = timeit.timeit(
+        lambda: superfilter(names, inclusion_patterns, exclusion_patterns),
+        number=number
+    )
+    # Names matched one at a time, as the crawlers and dataset usages reports do
+    legacy_single_time = timeit.timeit(
+        lambda: [legacy_superfilter((name,), inclusion_patterns, exclusion_patterns) for name in names],
+        number=number
+    )
+    compiled_filter = compile_filter(inclusion_patterns, exclusion_patterns)
+    compiled_single_time = timeit.timeit(
+        lambda: [compiled_filter.matches(name) for name in names],
+        number=number
+    )
+    print(
+        f'Filtered {len(names)} names with {len(inclusion_patterns) + len(exclusion_patterns)} patterns:'
+    )
+    print(f'  previous implementation:        {legacy_time:.3f}s')
+    print(f'  compiled filter:                {compiled_time:.3f}s ({legacy_time / compiled_time:.1f}x faster)')
+    print(f'  per name, previously:           {legacy_single_time:.3f}s')
+    print(
+        f'  per name, with compile_filter:  {compiled_single_time:.3f}s '
+        f'({legacy_single_time / compiled_single_time:.1f}x faster)'
+    )
+
+    # Records filtered on several columns, as the dataset usages and map data sources reports do
+    records = [
+        dict(
+            dataset_name=f'{random.choice(words[:50])}.{name}',
+            user=random.choice(words[:50]),
+            database=f'gisdb{i % 4}',
+            version='sde.DEFAULT'
+        )
+        for i, name in enumerate(names)
+    ]
+    column_patterns = {
+        'dataset_name': (('*',), ()),
+        'user': ((words[0], words[1], f'{words[2][:2]}*'), ()),
+        'database': (('gisdb1',), ()),
+        'version': ((), ('*.QA',)),
+    }
+    record_filter = compile_record_filter(column_patterns)
+
+    def legacy_filter_records():
+        return [
+            record for record in records
+            if all(
+                legacy_superfilter((record[column],), inclusion_patterns, exclusion_patterns)
+                for column, (inclusion_patterns, exclusion_patterns) in column_patterns.items()
+            )
+        ]
+
+    column_filters = [
+        (column, compile_filter(inclusion_patterns, exclusion_patterns))
+        for column, (inclusion_patterns, exclusion_patterns) in column_patterns.items()
+    ]
+    legacy_record_time = timeit.timeit(legacy_filter_records, number=number)
+    # One compiled filter per column, checked in the order the columns are specified
+    column_time = timeit.timeit(
+        lambda: [
+            record for record in records
+            if all(compiled_filter.matches(record[column]) for column, compiled_filter in column_filters)
+        ],
+        number=number
+    )
+    record_time = timeit.timeit(lambda: list(record_filter.filter(records)), number=number)
+    print(f'Filtered {len(records)} records on {len(column_patterns)} columns:')
+    print(f'  previous implementation:        {legacy_record_time:.3f}s')
+    print(f'  compile_filter per column:      {column_time:.3f}s ({legacy_record_time / column_time:.1f}x faster)')
+    print(
+        f'  compile_record_filter:          {record_time:.3f}s '
+        f'({legacy_record_time / record_time:.1f}x faster)'
+    )
@@ -7,7 +7,11 @@ setup(
     install_requires=[
         'requests',
         'PyYAML',
+        'psutil',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+    },
     packages=[
         'ags_service_publisher',
         'ags_service_publisher.reporters',
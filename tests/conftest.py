@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# Keep the on-disk caches written by the tests out of the cache directory of the repository. This must be set before
+# the package is imported, since the default cache directories are read from the environment at import time.
+_cache_dir = tempfile.mkdtemp(prefix='ags_service_publisher_tests_')
+os.environ['AGS_SERVICE_PUBLISHER_CONFIG_CACHE_DIR'] = os.path.join(_cache_dir, 'configs')
+os.environ['AGS_SERVICE_PUBLISHER_RESPONSE_CACHE_DIR'] = os.path.join(_cache_dir, 'responses')
+os.environ['AGS_SERVICE_PUBLISHER_MANIFEST_CACHE_DIR'] = os.path.join(_cache_dir, 'manifests')
+os.environ['AGS_SERVICE_PUBLISHER_SD_CACHE_DIR'] = os.path.join(_cache_dir, 'sd')
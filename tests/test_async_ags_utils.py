@@ -0,0 +1,146 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from ags_service_publisher.async_ags_utils import AsyncAdminClient  # noqa: E402
+from ags_service_publisher.retry import RetryPolicy  # noqa: E402
+
+manifest_xml = b'''<?xml version="1.0" encoding="utf-8"?>
+<SVCManifest>
+  <Databases>
+    <SVCDatabase>
+      <OnPremiseConnectionString>DATABASE=gisdb0;USER=gis;VERSION=sde.DEFAULT</OnPremiseConnectionString>
+      <OnServerConnectionString>DATABASE=gisdb0;USER=gis;VERSION=sde.DEFAULT</OnServerConnectionString>
+      <ByReference>true</ByReference>
+      <Datasets>
+        <SVCDataset>
+          <OnPremisePath>/data/gisdb0.sde/gis.streets</OnPremisePath>
+          <DatasetType>esriDTFeatureClass</DatasetType>
+        </SVCDataset>
+      </Datasets>
+    </SVCDatabase>
+  </Databases>
+</SVCManifest>
+'''
+
+
+@pytest.fixture
+def server():
+    """Local HTTP server that responds to ArcGIS Server admin requests with the responses in its responses dictionary
+    (keyed by path), taking delay seconds to respond, and records the maximum number of requests in flight."""
+    state = {'in_flight': 0, 'max_in_flight': 0, 'delay': 0, 'hits': {}, 'responses': {}}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            path = self.path.split('?')[0]
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+                state['hits'][path] = state['hits'].get(path, 0) + 1
+                responses = state['responses'][path]
+                status_code, content = responses.pop(0) if len(responses) > 1 else responses[0]
+            time.sleep(state['delay'])
+            body = content if isinstance(content, bytes) else json.dumps(content).encode('utf-8')
+            self.send_response(status_code)
+            if status_code == 503:
+                self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            with lock:
+                state['in_flight'] -= 1
+
+        def log_message(self, *args):
+            pass
+
+    http_server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=http_server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{http_server.server_port}', state
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def run(server_url, operation, max_concurrent_requests=2):
+    async def run_operation():
+        async with AsyncAdminClient(
+            server_url,
+            'token',
+            max_concurrent_requests=max_concurrent_requests,
+            retry_policy=RetryPolicy(max_retries=2, initial_interval=0.01)
+        ) as client:
+            return await operation(client)
+
+    return asyncio.run(run_operation())
+
+
+def test_requests_in_flight_are_limited(server):
+    url, state = server
+    services = [{'serviceName': f'Service{i}', 'type': 'MapServer'} for i in range(8)]
+    state['responses']['/arcgis/admin/services/Parks'] = [(200, {'services': services})]
+    for service in services:
+        state['responses'][f'/arcgis/admin/services/Parks/{service["serviceName"]}.MapServer/status'] = [
+            (200, {'configuredState': 'STARTED', 'realTimeState': 'STARTED'})
+        ]
+    state['delay'] = 0.05
+
+    async def get_statuses(client):
+        return await asyncio.gather(*(
+            client.get_service_status(service['serviceName'], 'Parks', service['type'])
+            for service in await client.list_services('Parks')
+        ))
+
+    statuses = run(url, get_statuses)
+    assert statuses == [{'configuredState': 'STARTED', 'realTimeState': 'STARTED'}] * 8
+    assert state['max_in_flight'] == 2
+
+
+def test_list_service_workspaces(server):
+    url, state = server
+    state['responses']['/arcgis/admin/services/Parks/Trails.MapServer/iteminfo/manifest/manifest.xml'] = [
+        (200, manifest_xml)
+    ]
+    assert run(url, lambda client: client.list_service_workspaces('Trails', 'Parks')) == [
+        dict(
+            user='gis',
+            database='gisdb0',
+            version='sde.DEFAULT',
+            dataset_name='gis.streets',
+            dataset_type='esriDTFeatureClass',
+            dataset_path='/data/gisdb0.sde/gis.streets',
+            by_reference=True,
+        )
+    ]
+
+
+def test_error_responses_raise(server):
+    url, state = server
+    state['responses']['/arcgis/admin/services/Missing.MapServer/iteminfo'] = [
+        (200, {'error': {'code': 404, 'message': 'Service not found'}})
+    ]
+    state['responses']['/arcgis/admin/services/Missing.MapServer/status'] = [
+        (200, {'status': 'error', 'messages': ['Service not found']})
+    ]
+    with pytest.raises(RuntimeError, match='Service not found'):
+        run(url, lambda client: client.get_service_item_info('Missing'))
+    with pytest.raises(RuntimeError, match='Service not found'):
+        run(url, lambda client: client.get_service_status('Missing'))
+
+
+def test_transient_errors_are_retried(server):
+    url, state = server
+    state['responses']['/arcgis/admin/services'] = [(503, b''), (503, b''), (200, {'folders': ['Parks']})]
+    assert run(url, lambda client: client.list_service_folders()) == ['Parks']
+    assert state['hits']['/arcgis/admin/services'] == 3
+    state['responses']['/arcgis/admin/services/Parks'] = [(500, b'')]
+    with pytest.raises(RuntimeError, match='HTTP 500'):
+        run(url, lambda client: client.list_services('Parks'))
+    assert state['hits']['/arcgis/admin/services/Parks'] == 1
@@ -0,0 +1,100 @@
+import os
+from collections import OrderedDict
+
+import pytest
+
+from ags_service_publisher import config_io
+from ags_service_publisher.config_io import read_config_from_file, update_config, write_config_to_file
+
+config = '''
+service_folder: Parks
+services:
+  - ParkBoundaries
+  - Trails
+environments:
+  dev:
+    source_dir: C:/mxd-source/Parks
+'''
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    config_path = tmp_path / 'Parks.yml'
+    config_path.write_text(config)
+    return config_path
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Records the number of times a config is parsed."""
+    parses = []
+    ordered_load = config_io.ordered_load
+
+    def recording_ordered_load(stream):
+        parses.append(stream)
+        return ordered_load(stream)
+
+    monkeypatch.setattr(config_io, 'ordered_load', recording_ordered_load)
+    return parses
+
+
+def test_read_config_from_file(config_path):
+    parsed_config = read_config_from_file(str(config_path))
+    assert parsed_config == {
+        'service_folder': 'Parks',
+        'services': ['ParkBoundaries', 'Trails'],
+        'environments': {'dev': {'source_dir': 'C:/mxd-source/Parks'}},
+    }
+    assert isinstance(parsed_config, OrderedDict)
+    assert list(parsed_config) == ['service_folder', 'services', 'environments']
+
+
+def test_read_config_from_file_only_parses_changed_files(config_path, parses):
+    read_config_from_file(str(config_path))
+    read_config_from_file(str(config_path))
+    assert len(parses) == 1
+    stat = os.stat(config_path)
+    os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    read_config_from_file(str(config_path))
+    assert len(parses) == 1
+
+
+def test_read_config_from_file_picks_up_changes_with_same_modification_time_and_size(config_path, parses):
+    assert read_config_from_file(str(config_path))['services'] == ['ParkBoundaries', 'Trails']
+    stat = os.stat(config_path)
+    config_path.write_text(config.replace('- Trails', '- Trials'))
+    os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(config_path).st_size == stat.st_size
+    assert read_config_from_file(str(config_path))['services'] == ['ParkBoundaries', 'Trials']
+    assert len(parses) == 2
+
+
+def test_read_config_from_file_returns_copies(config_path):
+    read_config_from_file(str(config_path))['services'].append('Playgrounds')
+    assert read_config_from_file(str(config_path))['services'] == ['ParkBoundaries', 'Trails']
+
+
+def test_read_config_from_file_without_cache(config_path, parses):
+    read_config_from_file(str(config_path), use_config_cache=False)
+    read_config_from_file(str(config_path), use_config_cache=False)
+    assert len(parses) == 2
+    assert str(config_path) not in config_io._parsed_configs
+
+
+def test_write_config_to_file(config_path):
+    parsed_config = read_config_from_file(str(config_path))
+    parsed_config['services'].append('Playgrounds')
+    write_config_to_file(parsed_config, str(config_path))
+    written_config = read_config_from_file(str(config_path))
+    assert written_config == parsed_config
+    assert list(written_config) == ['service_folder', 'services', 'environments']
+
+
+def test_update_config(config_path):
+    updated_config = update_config(
+        'Parks',
+        lambda parsed_config: parsed_config.update(service_folder='Recreation'),
+        str(config_path.parent)
+    )
+    assert updated_config['service_folder'] == 'Recreation'
+    assert read_config_from_file(str(config_path)) == updated_config
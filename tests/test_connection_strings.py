@@ -0,0 +1,83 @@
+import pytest
+
+from ags_service_publisher.ags_utils import parse_connection_string
+from ags_service_publisher.helpers import split_quoted_string, unquote_string
+
+
+def legacy_split_quoted_string(input_string, delimiter):
+    """The previous character-by-character implementation of split_quoted_string."""
+    parts = []
+    quoted = False
+    part = ''
+    length = len(input_string)
+    for i, char in enumerate(input_string):
+        if i == length - 1:
+            part += char
+            parts.append(part)
+            break
+        if not quoted and char == delimiter:
+            parts.append(part)
+            part = ''
+        elif not quoted and char == '"':
+            quoted = True
+            part += char
+        elif quoted and char == '"':
+            quoted = False
+            part += char
+        else:
+            part += char
+    return parts
+
+
+def legacy_parse_connection_string(conn_string):
+    properties = {}
+    for pair in legacy_split_quoted_string(conn_string, ';'):
+        key, value = legacy_split_quoted_string(pair, '=')
+        properties[key] = unquote_string(value)
+    return properties
+
+
+conn_strings = [
+    'ENCRYPTED_PASSWORD=00022e68;SERVER=gisdb1;INSTANCE=sde:sqlserver:gisdb1;DBCLIENT=sqlserver;'
+    'DB_CONNECTION_PROPERTIES=gisdb1;DATABASE=COA_GIS_1;USER=map_service_1;VERSION=sde.DEFAULT;'
+    'AUTHENTICATION_MODE=DBMS',
+    'DATABASE="C:\\arcgisserver\\data\\Service Data.gdb";AUTHENTICATION_MODE=OSA',
+    'ENCRYPTED_PASSWORD=00022e68;SERVER=oradb;INSTANCE="sde:oracle11g:oradb;LOCAL=GISPROD";DBCLIENT=oracle;'
+    'DB_CONNECTION_PROPERTIES=oradb;USER=GIS;VERSION=SDE.DEFAULT;AUTHENTICATION_MODE=DBMS',
+    'DATABASE=C:\\data\\a.gdb',
+]
+
+
+@pytest.mark.parametrize('input_string', ['', 'a', ';', 'a;', ';a', 'a;;b', '"a;b";c', '"a;b', 'a="b;c"', '""', ';;'])
+def test_split_quoted_string_matches_legacy(input_string):
+    assert split_quoted_string(input_string, ';') == legacy_split_quoted_string(input_string, ';')
+
+
+@pytest.mark.parametrize('conn_string', conn_strings)
+@pytest.mark.parametrize('delimiter', [';', '='])
+def test_split_quoted_string_matches_legacy_for_connection_strings(conn_string, delimiter):
+    assert split_quoted_string(conn_string, delimiter) == legacy_split_quoted_string(conn_string, delimiter)
+
+
+def test_split_quoted_string_keeps_quoted_delimiters():
+    assert split_quoted_string('a="b;c";d=e', ';') == ['a="b;c"', 'd=e']
+
+
+@pytest.mark.parametrize('conn_string', conn_strings)
+def test_parse_connection_string_matches_legacy(conn_string):
+    assert parse_connection_string(conn_string) == legacy_parse_connection_string(conn_string)
+
+
+def test_parse_connection_string_unquotes_values():
+    assert parse_connection_string(conn_strings[2])['INSTANCE'] == 'sde:oracle11g:oradb;LOCAL=GISPROD'
+
+
+def test_parse_connection_string_returns_a_copy():
+    properties = parse_connection_string(conn_strings[0])
+    properties['USER'] = 'changed'
+    assert parse_connection_string(conn_strings[0])['USER'] == 'map_service_1'
+
+
+def test_parse_connection_string_empty():
+    assert parse_connection_string('') == {}
+    assert parse_connection_string(None) == {}
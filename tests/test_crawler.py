@@ -0,0 +1,49 @@
+import random
+
+from ags_service_publisher import services
+from ags_service_publisher.crawler import ServiceRecord, sort_crawled_services
+
+records = [
+    ServiceRecord('dev', 'ags1', None, 'Basemap', 'MapServer', {}),
+    ServiceRecord('dev', 'ags1', 'Parks', 'Trails', 'FeatureServer', {}),
+    ServiceRecord('dev', 'ags1', 'Parks', 'Trails', 'MapServer', {}),
+    ServiceRecord('dev', 'ags1', 'Streets', 'Streets', 'MapServer', {}),
+    ServiceRecord('dev', 'ags2', None, 'Basemap', 'MapServer', {}),
+    ServiceRecord('prod', 'ags1', 'Parks', 'Parks', 'MapServer', {}),
+]
+
+
+def test_sort_crawled_services():
+    results = [(record, index) for index, record in enumerate(records)]
+    shuffled_results = list(results)
+    random.Random(0).shuffle(shuffled_results)
+    assert sort_crawled_services(shuffled_results) == results
+
+
+def test_generate_service_inventory_is_sorted(monkeypatch):
+    shuffled_records = list(records)
+    random.Random(0).shuffle(shuffled_records)
+    monkeypatch.setattr(services, 'get_user_config', lambda config_dir: {})
+    monkeypatch.setattr(services, 'crawl_services', lambda *args: ((record, None) for record in shuffled_records))
+    assert [
+        tuple(service.values()) for service in services.generate_service_inventory()
+    ] == [
+        record[:5] for record in records
+    ]
+
+
+def test_generate_data_stores_inventory_is_sorted(monkeypatch):
+    data_stores = [
+        dict(env_name=env_name, ags_instance=ags_instance, item_path=item_path)
+        for env_name, ags_instance, item_path in (
+            ('dev', 'ags1', '/enterpriseDatabases/gisdb0'),
+            ('dev', 'ags1', '/enterpriseDatabases/gisdb1'),
+            ('dev', 'ags2', '/enterpriseDatabases/gisdb0'),
+            ('prod', 'ags1', '/fileShares/share'),
+        )
+    ]
+    shuffled_data_stores = list(data_stores)
+    random.Random(0).shuffle(shuffled_data_stores)
+    monkeypatch.setattr(services, 'get_user_config', lambda config_dir: {})
+    monkeypatch.setattr(services, 'crawl_instances', lambda *args: iter(shuffled_data_stores))
+    assert list(services.generate_data_stores_inventory()) == data_stores
@@ -0,0 +1,193 @@
+import collections
+import fnmatch
+import random
+import string
+
+import pytest
+
+from ags_service_publisher.extrafilters import compile_filter, compile_record_filter, multifilter, superfilter
+
+
+def legacy_superfilter(names, inclusion_patterns=(), exclusion_patterns=()):
+    """The previous implementation of superfilter, which matched every name against every pattern."""
+    is_mapping = isinstance(names, collections.abc.Mapping)
+    is_view = isinstance(names, collections.abc.MappingView)
+    keys = names.keys() if is_mapping else names
+    included = legacy_multifilter(keys, inclusion_patterns) if inclusion_patterns else keys
+    excluded = legacy_multifilter(keys, exclusion_patterns) if exclusion_patterns else ()
+    filtered = set(included) - set(excluded)
+    if is_mapping:
+        return type(names)(
+            ((key, value) for key, value in names.items() if legacy_key_is_in_collection(key, filtered))
+        )
+    elif is_view:
+        return [key for key in keys if legacy_key_is_in_collection(key, filtered)]
+    else:
+        return type(names)((key for key in keys if legacy_key_is_in_collection(key, filtered)))
+
+
+def legacy_key_is_in_collection(key, collection):
+    if isinstance(key, collections.abc.Mapping):
+        return any(legacy_key_is_in_collection(subkey, collection) for subkey in key.keys())
+    return key in collection
+
+
+def legacy_multifilter(names, patterns):
+    for name in names:
+        if isinstance(name, collections.abc.Mapping):
+            for key in name.keys():
+                for pattern in patterns:
+                    if fnmatch.fnmatch(key, pattern):
+                        yield key
+                        break
+        else:
+            for pattern in patterns:
+                if fnmatch.fnmatch(name, pattern):
+                    yield name
+                    break
+
+
+names = ('a', 'b[c', '[ab]', 'a?c', 'abc', 'A', 'abd', 'Service.MapServer', 'service_1', 'service_10', '')
+
+patterns = [
+    ((), ()),
+    (('*',), ()),
+    (('a',), ()),
+    ((), ('a',)),
+    (('a', '[ab]', 'a?c', 'b[c'), ('ab?',)),
+    (('a*',), ('abc',)),
+    (('*',), ('*',)),
+    (('service_?',), ()),
+    (('*.MapServer',), ()),
+    (('[!a]*',), ()),
+    (('A',), ()),
+]
+
+
+@pytest.mark.parametrize('inclusion_patterns, exclusion_patterns', patterns)
+def test_superfilter_matches_legacy(inclusion_patterns, exclusion_patterns):
+    for test_names in (list(names), names):
+        assert (
+            superfilter(test_names, inclusion_patterns, exclusion_patterns) ==
+            legacy_superfilter(test_names, inclusion_patterns, exclusion_patterns)
+        )
+
+
+@pytest.mark.parametrize('inclusion_patterns, exclusion_patterns', patterns)
+def test_compiled_filter_matches_legacy(inclusion_patterns, exclusion_patterns):
+    compiled_filter = compile_filter(inclusion_patterns, exclusion_patterns)
+    for name in names:
+        assert compiled_filter.matches(name) == bool(legacy_superfilter((name,), inclusion_patterns, exclusion_patterns))
+
+
+def test_superfilter_matches_legacy_for_random_names():
+    rng = random.Random(0)
+    words = [''.join(rng.choices(string.ascii_letters, k=rng.randint(2, 6))) for _ in range(50)]
+    random_names = [f'{rng.choice(words)}.{rng.choice(words)}_{i % 20}' for i in range(2000)]
+    inclusion_patterns = [rng.choice(random_names) for _ in range(10)] + [f'{rng.choice(words)}*' for _ in range(10)]
+    exclusion_patterns = [rng.choice(random_names) for _ in range(3)] + [f'*_{i}?' for i in range(3)]
+    for test_inclusion_patterns, test_exclusion_patterns in (
+        (inclusion_patterns, exclusion_patterns),
+        ((), exclusion_patterns),
+        (inclusion_patterns, ()),
+    ):
+        assert (
+            superfilter(random_names, test_inclusion_patterns, test_exclusion_patterns) ==
+            legacy_superfilter(random_names, test_inclusion_patterns, test_exclusion_patterns)
+        )
+
+
+def test_superfilter_preserves_type():
+    assert superfilter(['a', 'b', 'c'], ('a',)) == ['a']
+    assert superfilter(('a', 'b', 'c'), ('a',)) == ('a',)
+    assert superfilter({'a': 1, 'b': 2, 'c': 3}, ('a',)) == {'a': 1}
+    ordered = collections.OrderedDict((('c', 3), ('a', 1), ('b', 2)))
+    assert superfilter(ordered, ('a', 'c')) == collections.OrderedDict((('c', 3), ('a', 1)))
+    assert superfilter(ordered.keys(), ('a',)) == ['a']
+
+
+def test_superfilter_nested_mappings():
+    services = [collections.OrderedDict((('a', 1),)), 'b', {'c': {'type': 'MapServer'}}]
+    assert superfilter(services, ('a',)) == [collections.OrderedDict((('a', 1),))]
+    assert superfilter(services, ('a', 'c')) == legacy_superfilter(services, ('a', 'c'))
+
+
+def test_multifilter_matches_legacy():
+    test_names = list(names) + [{'a': 1, 'abc': 2}]
+    for inclusion_patterns, _ in patterns:
+        assert list(multifilter(test_names, inclusion_patterns)) == list(legacy_multifilter(test_names, inclusion_patterns))
+
+
+def test_compile_filter_is_cached():
+    assert compile_filter(['a', 'b'], ['c']) is compile_filter(('a', 'b'), ('c',))
+    assert compile_filter(None, None) is compile_filter((), ())
+
+
+def test_compiled_filter_is_unrestricted():
+    assert compile_filter().is_unrestricted
+    assert compile_filter(('*',)).is_unrestricted
+    assert not compile_filter(('a',)).is_unrestricted
+    assert not compile_filter(('*',), ('a',)).is_unrestricted
+
+
+def test_compiled_filter_selectivity_rank():
+    literal_filter = compile_filter(('a',))
+    wildcard_filter = compile_filter(('a*',))
+    exclusion_filter = compile_filter((), ('a',))
+    assert literal_filter.selectivity_rank < wildcard_filter.selectivity_rank < exclusion_filter.selectivity_rank
+
+
+records = [
+    dict(dataset_name=f'{user}.{name}', user=user, database=database, version=version)
+    for user in ('gis', 'map_service', 'GIS_ADMIN')
+    for name in ('streets', 'parcels', 'single_member_districts')
+    for database in ('gisdb0', 'gisdb1')
+    for version in ('sde.DEFAULT', 'sde.QA')
+]
+
+column_patterns = [
+    {},
+    {'dataset_name': (('*',), ()), 'user': ((), ())},
+    {'user': (('gis',), ())},
+    {'dataset_name': (('*.streets', '*.parcels'), ()), 'database': (('gisdb1',), ()), 'version': ((), ('*.QA',))},
+    {'user': (('map*', 'GIS_ADMIN'), ('map_service',)), 'dataset_name': (('*districts',), ())},
+    {'version': (('*',), ('*',))},
+]
+
+
+def legacy_filter_records(records, column_patterns):
+    return [
+        record for record in records
+        if all(
+            legacy_superfilter((record[column],), inclusion_patterns, exclusion_patterns)
+            for column, (inclusion_patterns, exclusion_patterns) in column_patterns.items()
+        )
+    ]
+
+
+@pytest.mark.parametrize('patterns', column_patterns)
+def test_record_filter_matches_legacy(patterns):
+    record_filter = compile_record_filter(patterns)
+    assert list(record_filter.filter(records)) == legacy_filter_records(records, patterns)
+    assert [record_filter.matches(record) for record in records] == [
+        record in legacy_filter_records(records, patterns) for record in records
+    ]
+
+
+@pytest.mark.parametrize('patterns', column_patterns)
+def test_record_filter_matches_namedtuples(patterns):
+    Record = collections.namedtuple('Record', records[0].keys())
+    record_filter = compile_record_filter(patterns)
+    assert list(record_filter.filter(Record(**record) for record in records)) == [
+        Record(**record) for record in legacy_filter_records(records, patterns)
+    ]
+
+
+def test_record_filter_skips_unrestricted_columns_and_orders_by_selectivity():
+    record_filter = compile_record_filter({
+        'dataset_name': (('*',), ()),
+        'user': (('gis', 'map*'), ()),
+        'database': (('gisdb1',), ()),
+        'version': ((), ('*.QA',)),
+    })
+    assert [column for column, *_ in record_filter.column_filters] == ['database', 'user', 'version']
@@ -0,0 +1,372 @@
+import collections
+import sqlite3
+import types
+
+import pytest
+
+from ags_service_publisher import inventory_snapshot
+from ags_service_publisher.crawler import ServiceRecord
+from ags_service_publisher.extrafilters import compile_record_filter
+from ags_service_publisher.inventory_snapshot import (
+    find_service_dataset_usages_in_snapshot,
+    generate_data_stores_inventory_from_snapshot,
+    generate_service_inventory_from_snapshot,
+    get_dataset_conditions,
+    open_inventory_snapshot,
+    refresh_inventory_snapshot,
+)
+
+user_config = {
+    'environments': {
+        'dev': {'ags_instances': {'ags1': {}, 'ags2': {}}},
+        'prod': {'ags_instances': {'ags1': {}}},
+    }
+}
+
+
+def make_database(database, user, version, *dataset_names, by_reference=True):
+    return dict(
+        by_reference=by_reference,
+        conn_props={'DATABASE': database, 'USER': user, 'VERSION': version},
+        datasets=[
+            dict(
+                dataset_name=dataset_name,
+                dataset_type='esriDTFeatureClass',
+                dataset_path=f'C:/connections/{database}.sde/{dataset_name}'
+            )
+            for dataset_name in dataset_names
+        ]
+    )
+
+
+class FakeServers:
+    """ArcGIS Server instances crawled by the stubs of fake_servers, holding the services of each (env_name,
+    ags_instance) as ServiceRecords, the manifest databases of each service, and the data stores of each instance."""
+
+    def __init__(self):
+        self.services = collections.defaultdict(list)
+        self.manifests = {}
+        self.data_stores = collections.defaultdict(list)
+        self.downloaded_manifests = []
+
+    def add_service(self, env_name, ags_instance, service_folder, service_name, databases, stamp=None):
+        self.services[env_name, ags_instance].append(ServiceRecord(
+            env_name, ags_instance, service_folder, service_name, 'MapServer',
+            {
+                'serviceName': service_name,
+                'type': 'MapServer',
+                'status': {'configuredState': 'STARTED', 'realTimeState': 'STARTED'},
+                'iteminfo': {'lastModified': stamp} if stamp else {},
+            }
+        ))
+        self.manifests[get_url(env_name, ags_instance), service_folder, service_name] = databases
+
+    def remove_service(self, env_name, ags_instance, service_name):
+        self.services[env_name, ags_instance] = [
+            record for record in self.services[env_name, ags_instance] if record.service_name != service_name
+        ]
+
+    def set_service(self, env_name, ags_instance, service_name, databases=None, stamp=None):
+        for index, record in enumerate(self.services[env_name, ags_instance]):
+            if record.service_name == service_name:
+                self.services[env_name, ags_instance][index] = record._replace(
+                    service=dict(record.service, iteminfo={'lastModified': stamp} if stamp else {})
+                )
+                if databases is not None:
+                    self.manifests[get_url(env_name, ags_instance), record.service_folder, service_name] = databases
+
+
+def get_url(env_name, ags_instance):
+    return f'https://{env_name}-{ags_instance}.example.com:6443'
+
+
+def get_client(env_name, ags_instance):
+    return types.SimpleNamespace(url=get_url(env_name, ags_instance), token=None, session=None)
+
+
+@pytest.fixture
+def fake_servers(monkeypatch):
+    """Replaces the crawlers and requests used to refresh the inventory snapshot with stubs reading from FakeServers."""
+    servers = FakeServers()
+
+    def crawl_instances(user_config, operation, *filters):
+        for env_name, ags_instance in inventory_snapshot.get_crawled_instances(user_config, *filters):
+            yield from operation(get_client(env_name, ags_instance), env_name, ags_instance)
+
+    def crawl_services(user_config, *filters, callback=None, **kwargs):
+        for env_name, ags_instance in inventory_snapshot.get_crawled_instances(user_config, *filters):
+            client = get_client(env_name, ags_instance)
+            for record in servers.services[env_name, ags_instance]:
+                yield record, callback(client, record)
+
+    def list_service_folders(server_url, token, session=None):
+        return sorted({
+            folder for (url, folder, _), databases in servers.manifests.items() if url == server_url and folder
+        })
+
+    def list_data_stores(server_url, token, session=None, max_concurrent_requests=None):
+        return servers.data_stores[server_url]
+
+    def list_service_manifest_databases(server_url, token, service_name, service_folder, service_type, session=None):
+        servers.downloaded_manifests.append(service_name)
+        databases = servers.manifests[server_url, service_folder, service_name]
+        if isinstance(databases, Exception):
+            raise databases
+        return iter(databases)
+
+    monkeypatch.setattr(inventory_snapshot, 'get_user_config', lambda config_dir: user_config)
+    monkeypatch.setattr(inventory_snapshot, 'crawl_instances', crawl_instances)
+    monkeypatch.setattr(inventory_snapshot, 'crawl_services', crawl_services)
+    monkeypatch.setattr(inventory_snapshot, 'list_service_folders', list_service_folders)
+    monkeypatch.setattr(inventory_snapshot, 'list_data_stores', list_data_stores)
+    monkeypatch.setattr(inventory_snapshot, 'list_service_manifest_databases', list_service_manifest_databases)
+    return servers
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    return tmp_path / 'inventory.sqlite'
+
+
+@pytest.fixture
+def populated_servers(fake_servers):
+    fake_servers.add_service('dev', 'ags1', 'Streets', 'Streets', [
+        make_database('gisdb0', 'gis', 'sde.DEFAULT', 'gis.streets', 'gis.Sidewalks'),
+    ], stamp=1)
+    fake_servers.add_service('dev', 'ags1', 'Parks', 'Trails', [
+        make_database('gisdb0', 'gis', 'sde.DEFAULT', 'gis.trails', 'gis.streets'),
+        make_database('gisdb1', 'parks', 'sde.QA', 'parks.trail_heads', by_reference=False),
+    ], stamp=1)
+    fake_servers.add_service('dev', 'ags1', None, 'Basemap', [
+        make_database('gisdb1', 'GIS', 'sde.DEFAULT', 'GIS.STREETS', 'GIS.parcels'),
+    ])
+    fake_servers.add_service('dev', 'ags2', 'Streets', 'Streets', [
+        make_database('gisdb1', 'gis', 'sde.QA', 'gis.streets'),
+    ], stamp=1)
+    fake_servers.add_service('prod', 'ags1', 'Streets', 'Streets', [
+        make_database('gisdb0', 'gis', 'sde.DEFAULT', 'gis.streets', 'gis.Sidewalks'),
+    ], stamp=2)
+    fake_servers.data_stores[get_url('dev', 'ags1')] = [
+        dict(item_path='/enterpriseDatabases/gisdb0', item_type='egdb', file_path=None, user='gis', database='gisdb0',
+             version='sde.DEFAULT'),
+    ]
+    return fake_servers
+
+
+def get_service_keys(snapshot_path, **filters):
+    return [
+        (service['env_name'], service['ags_instance'], service['service_folder'], service['service_name'])
+        for service in generate_service_inventory_from_snapshot(snapshot_path=snapshot_path, **filters)
+    ]
+
+
+def get_datasets(snapshot_path):
+    with open_inventory_snapshot(snapshot_path) as connection:
+        return [
+            tuple(row) for row in connection.execute(
+                'SELECT service_name, dataset_name FROM services JOIN datasets USING (service_id) '
+                'ORDER BY env_name, ags_instance, service_name, dataset_name'
+            )
+        ]
+
+
+def test_refresh_inventory_snapshot(populated_servers, snapshot_path):
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    assert get_service_keys(snapshot_path) == [
+        ('dev', 'ags1', None, 'Basemap'),
+        ('dev', 'ags1', 'Parks', 'Trails'),
+        ('dev', 'ags1', 'Streets', 'Streets'),
+        ('dev', 'ags2', 'Streets', 'Streets'),
+        ('prod', 'ags1', 'Streets', 'Streets'),
+    ]
+    assert get_service_keys(snapshot_path, included_envs=('dev',), excluded_service_folders=('Parks',)) == [
+        ('dev', 'ags1', None, 'Basemap'),
+        ('dev', 'ags1', 'Streets', 'Streets'),
+        ('dev', 'ags2', 'Streets', 'Streets'),
+    ]
+    assert [data_store['item_path'] for data_store in generate_data_stores_inventory_from_snapshot(
+        snapshot_path=snapshot_path
+    )] == ['/enterpriseDatabases/gisdb0']
+    with open_inventory_snapshot(snapshot_path) as connection:
+        assert [tuple(row) for row in connection.execute(
+            'SELECT env_name, ags_instance, service_folder FROM folders ORDER BY env_name, ags_instance, service_folder'
+        )] == [
+            ('dev', 'ags1', 'Parks'),
+            ('dev', 'ags1', 'Streets'),
+            ('dev', 'ags2', 'Streets'),
+            ('prod', 'ags1', 'Streets'),
+        ]
+        trails = connection.execute('SELECT * FROM services WHERE service_name = ?', ('Trails',)).fetchone()
+        assert trails['stamp'] == '1'
+        assert trails['configured_state'] == 'STARTED'
+        assert trails['error'] is None
+
+
+def test_refresh_inventory_snapshot_only_downloads_changed_manifests(populated_servers, snapshot_path):
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    assert sorted(populated_servers.downloaded_manifests) == ['Basemap', 'Streets', 'Streets', 'Streets', 'Trails']
+    datasets = get_datasets(snapshot_path)
+
+    # Services without a stamp are always downloaded again
+    populated_servers.downloaded_manifests.clear()
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    assert populated_servers.downloaded_manifests == ['Basemap']
+    assert get_datasets(snapshot_path) == datasets
+
+    # The manifest is not downloaded again while the stamp is unchanged, even if it has changed in the meantime
+    populated_servers.set_service(
+        'dev', 'ags1', 'Trails', [make_database('gisdb0', 'gis', 'sde.DEFAULT', 'gis.paths')], stamp=1
+    )
+    populated_servers.downloaded_manifests.clear()
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    assert populated_servers.downloaded_manifests == ['Basemap']
+    assert get_datasets(snapshot_path) == datasets
+
+    populated_servers.set_service('dev', 'ags1', 'Trails', stamp=2)
+    populated_servers.downloaded_manifests.clear()
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    assert sorted(populated_servers.downloaded_manifests) == ['Basemap', 'Trails']
+    assert ('Trails', 'gis.paths') in get_datasets(snapshot_path)
+    assert ('Trails', 'gis.trails') not in get_datasets(snapshot_path)
+
+    populated_servers.downloaded_manifests.clear()
+    refresh_inventory_snapshot(snapshot_path=snapshot_path, full_refresh=True)
+    assert len(populated_servers.downloaded_manifests) == 5
+
+
+def test_refresh_inventory_snapshot_retries_failed_manifests(populated_servers, snapshot_path):
+    databases = populated_servers.manifests[get_url('dev', 'ags1'), 'Parks', 'Trails']
+    populated_servers.manifests[get_url('dev', 'ags1'), 'Parks', 'Trails'] = RuntimeError('Manifest not found')
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    with open_inventory_snapshot(snapshot_path) as connection:
+        trails = connection.execute('SELECT * FROM services WHERE service_name = ?', ('Trails',)).fetchone()
+    assert trails['error'] == 'Manifest not found'
+    assert 'Trails' not in {service_name for service_name, _ in get_datasets(snapshot_path)}
+    populated_servers.manifests[get_url('dev', 'ags1'), 'Parks', 'Trails'] = databases
+    populated_servers.downloaded_manifests.clear()
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    assert sorted(populated_servers.downloaded_manifests) == ['Basemap', 'Trails']
+    assert ('Trails', 'gis.trails') in get_datasets(snapshot_path)
+
+
+def test_refresh_inventory_snapshot_removes_services_that_no_longer_exist(populated_servers, snapshot_path):
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    populated_servers.remove_service('dev', 'ags1', 'Trails')
+    populated_servers.remove_service('prod', 'ags1', 'Streets')
+    populated_servers.data_stores[get_url('dev', 'ags1')] = []
+    # Only the crawled instances are refreshed, so the services of the others are kept
+    refresh_inventory_snapshot(included_envs=('dev',), snapshot_path=snapshot_path)
+    assert get_service_keys(snapshot_path) == [
+        ('dev', 'ags1', None, 'Basemap'),
+        ('dev', 'ags1', 'Streets', 'Streets'),
+        ('dev', 'ags2', 'Streets', 'Streets'),
+        ('prod', 'ags1', 'Streets', 'Streets'),
+    ]
+    assert 'Trails' not in {service_name for service_name, _ in get_datasets(snapshot_path)}
+    assert list(generate_data_stores_inventory_from_snapshot(snapshot_path=snapshot_path)) == []
+    with open_inventory_snapshot(snapshot_path) as connection:
+        assert connection.execute(
+            'SELECT COUNT(*) FROM datasets WHERE service_id NOT IN (SELECT service_id FROM services)'
+        ).fetchone()[0] == 0
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    assert ('prod', 'ags1', 'Streets', 'Streets') not in get_service_keys(snapshot_path)
+
+
+def test_open_inventory_snapshot_rejects_missing_and_outdated_snapshots(snapshot_path):
+    with pytest.raises(RuntimeError, match='does not exist'):
+        with open_inventory_snapshot(snapshot_path):
+            pass
+    connection = sqlite3.connect(snapshot_path)
+    connection.execute('PRAGMA user_version = 1')
+    connection.close()
+    with pytest.raises(RuntimeError, match='another version'):
+        with open_inventory_snapshot(snapshot_path):
+            pass
+    with open_inventory_snapshot(snapshot_path, create=True) as connection:
+        assert connection.execute('SELECT COUNT(*) FROM services').fetchone()[0] == 0
+
+
+dataset_filters = [
+    {},
+    {'included_datasets': ('gis.streets',)},
+    {'included_datasets': ('GIS.STREETS',)},
+    {'included_datasets': ('gis.streets', 'parks.trail_heads', 'missing')},
+    {'included_datasets': ('gis.s*',)},
+    {'included_datasets': ('*.[Ss]*',)},
+    {'included_datasets': ('gis.streets', 'gis.t*')},
+    {'excluded_datasets': ('gis.streets',)},
+    {'excluded_datasets': ('gis.*', 'GIS.*')},
+    {'excluded_users': ('gis',), 'excluded_versions': ('*.QA',)},
+    {'included_datasets': ('gis.streets',), 'excluded_databases': ('gisdb1',)},
+    {'included_databases': ('gisdb0',), 'included_users': ('g*',), 'included_versions': ('sde.DEFAULT',)},
+    {'included_datasets': ('*',), 'excluded_datasets': ('*',)},
+    {'included_datasets': ('missing',)},
+]
+
+
+@pytest.mark.parametrize('filters', dataset_filters)
+def test_find_service_dataset_usages_in_snapshot_matches_superfilter(populated_servers, snapshot_path, filters):
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    all_usages = list(find_service_dataset_usages_in_snapshot(snapshot_path=snapshot_path))
+    assert len(all_usages) == 10
+    record_filter = compile_record_filter({
+        column: (filters.get(f'included_{name}', ('*',)), filters.get(f'excluded_{name}', ()))
+        for column, name in (
+            ('dataset_name', 'datasets'), ('user', 'users'), ('database', 'databases'), ('version', 'versions')
+        )
+    })
+    assert list(find_service_dataset_usages_in_snapshot(snapshot_path=snapshot_path, **filters)) == list(
+        record_filter.filter(all_usages)
+    )
+
+
+def test_find_service_dataset_usages_in_snapshot(populated_servers, snapshot_path):
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    usages = list(find_service_dataset_usages_in_snapshot(
+        included_datasets=('parks.trail_heads',),
+        snapshot_path=snapshot_path
+    ))
+    assert usages == [dict(
+        env_name='dev',
+        ags_instance='ags1',
+        service_folder='Parks',
+        service_name='Trails',
+        service_type='MapServer',
+        dataset_name='parks.trail_heads',
+        dataset_type='esriDTFeatureClass',
+        user='parks',
+        database='gisdb1',
+        version='sde.QA',
+        dataset_path='C:/connections/gisdb1.sde/parks.trail_heads',
+        by_reference=False,
+    )]
+    assert [
+        (usage['env_name'], usage['ags_instance'], usage['service_name'])
+        for usage in find_service_dataset_usages_in_snapshot(
+            included_datasets=('gis.streets',),
+            excluded_instances=('ags2',),
+            excluded_services=('Trails',),
+            snapshot_path=snapshot_path
+        )
+    ] == [('dev', 'ags1', 'Streets'), ('prod', 'ags1', 'Streets')]
+
+
+def test_get_dataset_conditions(populated_servers, snapshot_path):
+    refresh_inventory_snapshot(snapshot_path=snapshot_path)
+    with open_inventory_snapshot(snapshot_path) as connection:
+        assert get_dataset_conditions(connection) == ('', [])
+        assert get_dataset_conditions(connection, included_datasets=('*',)) == ('', [])
+        # Literal dataset names are narrowed down case-insensitively in SQL before being matched with superfilter
+        where, parameters = get_dataset_conditions(connection, included_datasets=('gis.streets', 'missing'))
+        assert where == 'dataset_name IN (SELECT value FROM json_each(?))'
+        assert parameters == ['["gis.streets"]']
+        # Exclusion-only filters are matched against all the distinct values
+        where, parameters = get_dataset_conditions(
+            connection,
+            excluded_datasets=('gis.*', 'GIS.*'),
+            included_versions=('sde.QA',)
+        )
+        assert where == (
+            'dataset_name IN (SELECT value FROM json_each(?)) AND version IN (SELECT value FROM json_each(?))'
+        )
+        assert parameters == ['["parks.trail_heads"]', '["sde.QA"]']
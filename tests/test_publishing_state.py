@@ -0,0 +1,129 @@
+import contextlib
+import datetime
+import json
+import types
+from collections import OrderedDict
+
+import pytest
+
+from ags_service_publisher import publishing
+from ags_service_publisher.publishing import publish_services
+from ags_service_publisher.publishing_state import PublishingState, get_file_fingerprint, get_publishing_inputs
+
+
+def test_get_publishing_inputs_normalizes_properties(tmp_path):
+    source_file = tmp_path / 'service.mxd'
+    source_file.write_bytes(b'map')
+    inputs = get_publishing_inputs(
+        source_file,
+        OrderedDict((('b', 1), ('a', (1, 2)), ('date', datetime.date(2020, 1, 1)))),
+        None
+    )
+    assert inputs == {
+        'source_file_fingerprint': get_file_fingerprint(source_file),
+        'service_properties': {'a': [1, 2], 'b': 1, 'date': '2020-01-01'},
+        'data_source_mappings': {},
+    }
+    # Inputs round-trip through the JSON state file unchanged
+    assert inputs == get_publishing_inputs(source_file, {'date': '2020-01-01', 'a': [1, 2], 'b': 1}, {})
+
+
+def test_get_publishing_inputs_without_source_file():
+    assert get_publishing_inputs(None, None, None) == {
+        'source_file_fingerprint': None,
+        'service_properties': {},
+        'data_source_mappings': {},
+    }
+
+
+def test_get_file_fingerprint_includes_sidecar_files(tmp_path):
+    source_file = tmp_path / 'locator.loc'
+    source_file.write_bytes(b'locator')
+    fingerprint = get_file_fingerprint(source_file)
+    assert get_file_fingerprint(source_file) == fingerprint
+    (tmp_path / 'locator.lox').write_bytes(b'index')
+    assert get_file_fingerprint(source_file) != fingerprint
+    fingerprint = get_file_fingerprint(source_file)
+    source_file.write_bytes(b'changed')
+    assert get_file_fingerprint(source_file) != fingerprint
+
+
+def test_publishing_state_detects_changed_inputs(tmp_path):
+    source_file = tmp_path / 'service.mxd'
+    source_file.write_bytes(b'map')
+    inputs = get_publishing_inputs(source_file, {'maxRecordCount': 1000}, {})
+    state = PublishingState(tmp_path / 'state')
+    assert not state.is_unchanged('dev', 'ags1', 'Folder', 'Service', 'MapServer', inputs)
+    state.record('dev', 'ags1', 'Folder', 'Service', 'MapServer', inputs)
+    assert state.is_unchanged('dev', 'ags1', 'Folder', 'Service', 'MapServer', inputs)
+    assert not state.is_unchanged('dev', 'ags2', 'Folder', 'Service', 'MapServer', inputs)
+    assert not state.is_unchanged(
+        'dev', 'ags1', 'Folder', 'Service', 'MapServer',
+        get_publishing_inputs(source_file, {'maxRecordCount': 2000}, {})
+    )
+    source_file.write_bytes(b'changed map')
+    assert not state.is_unchanged(
+        'dev', 'ags1', 'Folder', 'Service', 'MapServer',
+        get_publishing_inputs(source_file, {'maxRecordCount': 1000}, {})
+    )
+
+
+def test_publishing_state_is_persisted(tmp_path):
+    inputs = get_publishing_inputs(None, {'a': 1}, {'old': 'new'})
+    PublishingState(tmp_path).record('dev', 'ags1', None, 'Service', 'MapServer', inputs)
+    assert (tmp_path / 'dev' / 'ags1.json').is_file()
+    assert PublishingState(tmp_path).is_unchanged('dev', 'ags1', None, 'Service', 'MapServer', inputs)
+
+
+@pytest.fixture
+def publishing_calls(monkeypatch):
+    """Replaces the arcpy steps of publishing with stubs, recording the functions called. Updating the data sources
+    rewrites the source file in place, as arcpy does when saving it."""
+    publishing_calls = []
+
+    def stub_call_in_subprocess(log_queue, worker_pool, description, func, *args):
+        publishing_calls.append(func.__name__)
+        if func is publishing.update_data_sources:
+            source_file_path, data_source_mappings = args
+            with open(source_file_path, 'ab') as f:
+                f.write(json.dumps(data_source_mappings).encode('utf-8'))
+
+    @contextlib.contextmanager
+    def stub_admin_client(user_config, env_name, ags_instance):
+        yield types.SimpleNamespace(url=f'https://{ags_instance}.example.com:6443')
+
+    monkeypatch.setattr(publishing, 'call_in_subprocess', stub_call_in_subprocess)
+    monkeypatch.setattr(publishing, 'admin_client', stub_admin_client)
+    monkeypatch.setattr(publishing, 'invalidate_cached_service', lambda *args: None)
+    return publishing_calls
+
+
+def test_publish_services_skips_services_with_updated_data_sources(tmp_path, publishing_calls):
+    source_file = tmp_path / 'Service.aprx'
+    source_file.write_bytes(b'map')
+
+    def publish():
+        return list(publish_services(
+            ['Service'],
+            {'environments': {'dev': {'ags_instances': {'ags1': {'ags_connection': 'ags1.ags'}}}}},
+            ['ags1'],
+            'dev',
+            None,
+            None,
+            {'Service': {'source_file': str(source_file), 'staging_files': []}},
+            None,
+            None,
+            {'old.sde': 'new.sde'},
+            'Folder',
+            create_backups=False,
+            update_timestamps=False,
+            publishing_state=PublishingState(tmp_path / 'state'),
+        ))
+
+    assert [result['skipped'] for result in publish()] == [False]
+    assert publishing_calls == ['update_data_sources', 'publish_service']
+    publishing_calls.clear()
+    assert [result['skipped'] for result in publish()] == [True]
+    assert publishing_calls == []
+    source_file.write_bytes(b'changed map')
+    assert [result['skipped'] for result in publish()] == [False]
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+import requests
+
+from ags_service_publisher.response_cache import ResponseCache, is_error_response
+
+server_url = 'https://ags.example.com:6443'
+
+
+def make_response(content, content_type='application/json'):
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = content_type
+    response._content = content if isinstance(content, bytes) else json.dumps(content).encode('utf-8')
+    return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(ttl=60, cache_dir=tmp_path)
+
+
+@pytest.mark.parametrize('content, content_type, expected', [
+    ({'serviceName': 'Parks'}, 'application/json', False),
+    ({'status': 'success'}, 'application/json', False),
+    ({'status': 'error', 'messages': ['Failed']}, 'application/json', True),
+    ({'error': {'code': 498, 'message': 'Invalid token.'}}, 'application/json', True),
+    ({'error': {'code': 499, 'message': 'Token Required'}}, 'text/plain', True),
+    (b'not json', 'application/json', True),
+    (b'<html></html>', 'text/html', False),
+])
+def test_is_error_response(content, content_type, expected):
+    assert is_error_response(make_response(content, content_type)) == expected
+
+
+def test_error_responses_are_not_cached(cache):
+    url = f'{server_url}/arcgis/rest/services/Parks/Trails/MapServer'
+    cache.put(url, make_response({'error': {'code': 498, 'message': 'Invalid token.'}}), {'f': 'json'})
+    assert cache.get(url, {'f': 'json'}) is None
+    cache.put(url, make_response({'serviceDescription': ''}), {'f': 'json'})
+    assert cache.get(url, {'f': 'json'}).json() == {'serviceDescription': ''}
+
+
+@pytest.mark.parametrize('service_folder', ['Parks', None])
+def test_invalidate_service(cache, service_folder):
+    folder_path = f'/{service_folder}' if service_folder else ''
+    invalidated_urls = [
+        f'{server_url}/arcgis/admin/services{folder_path}/Trails.MapServer',
+        f'{server_url}/arcgis/admin/services{folder_path}/Trails.MapServer/iteminfo',
+        f'{server_url}/arcgis/admin/services{folder_path}',
+        f'{server_url}/arcgis/admin/services',
+        f'{server_url}/arcgis/rest/services{folder_path}/Trails/MapServer',
+        f'{server_url}/arcgis/rest/services{folder_path}/Trails/MapServer/layers',
+        f'{server_url}/arcgis/rest/services{folder_path}',
+        f'{server_url}/arcgis/rest/services',
+    ]
+    kept_urls = [
+        f'{server_url}/arcgis/admin/services{folder_path}/Streets.MapServer',
+        f'{server_url}/arcgis/rest/services{folder_path}/Streets/MapServer',
+        f'{server_url}/arcgis/rest/services{folder_path}/Trails/FeatureServer',
+        f'https://ags2.example.com/arcgis/rest/services{folder_path}/Trails/MapServer',
+    ]
+    for url in invalidated_urls + kept_urls:
+        cache.put(url, make_response({'url': url}), {'f': 'json'})
+    cache.invalidate_service(server_url, 'Trails', service_folder, 'MapServer')
+    for url in invalidated_urls:
+        assert cache.get(url, {'f': 'json'}) is None, url
+    for url in kept_urls:
+        assert cache.get(url, {'f': 'json'}).json() == {'url': url}
@@ -0,0 +1,203 @@
+import itertools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from ags_service_publisher.ags_utils import SSLContextAdapter
+from ags_service_publisher.hedging import hedged_post
+from ags_service_publisher.retry import (
+    AdaptiveRateLimiter,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    get_backoff_intervals,
+    get_retry_after,
+    idempotent_requests,
+)
+
+
+def make_response(status_code, retry_after=None):
+    response = requests.Response()
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers['Retry-After'] = retry_after
+    return response
+
+
+def test_get_backoff_intervals_grow_with_jitter_up_to_max_interval():
+    intervals = list(itertools.islice(get_backoff_intervals(1, 8, 2), 6))
+    for interval, base in zip(intervals, (1, 2, 4, 8, 8, 8)):
+        assert base / 2 <= interval <= base
+
+
+def test_get_retry_after():
+    assert get_retry_after(make_response(503)) is None
+    assert get_retry_after(make_response(503, '5')) == 5
+    assert get_retry_after(make_response(503, '-1')) == 0
+    assert get_retry_after(make_response(503, 'soon')) is None
+    assert get_retry_after(make_response(503, 'Wed, 21 Oct 2015 07:28:00 GMT')) == 0
+    future = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 60))
+    assert 55 <= get_retry_after(make_response(503, future)) <= 60
+
+
+def test_retry_policy_get_delay():
+    policy = RetryPolicy(max_retries=3, initial_interval=1, max_interval=4, max_retry_after=10)
+    for attempt, base in enumerate((1, 2, 4)):
+        assert base / 2 <= policy.get_delay(attempt) <= base
+    assert policy.get_delay(3) is None
+    assert policy.get_delay(0, make_response(503, '5')) == 5
+    assert policy.get_delay(0, make_response(503, '60')) == 10
+
+
+@pytest.mark.parametrize('status_code, retry_after, idempotent, retryable', [
+    (200, None, True, False),
+    (500, None, True, False),
+    (502, None, True, True),
+    (504, None, True, True),
+    (429, None, True, True),
+    (502, None, False, False),
+    (504, '1', False, False),
+    (503, None, False, False),
+    (503, '1', False, True),
+    (429, '1', False, True),
+])
+def test_retry_policy_is_retryable(status_code, retry_after, idempotent, retryable):
+    assert RetryPolicy().is_retryable(make_response(status_code, retry_after), idempotent) == retryable
+
+
+@pytest.mark.parametrize('error, idempotent, retryable', [
+    (requests.exceptions.ReadTimeout(), True, False),
+    (requests.exceptions.ReadTimeout(), False, False),
+    (requests.exceptions.ConnectionError(), True, True),
+    (requests.exceptions.ConnectionError(), False, False),
+    (requests.exceptions.ConnectTimeout(), True, True),
+    (requests.exceptions.ConnectTimeout(), False, True),
+])
+def test_retry_policy_is_retryable_error(error, idempotent, retryable):
+    assert RetryPolicy().is_retryable_error(error, idempotent) == retryable
+
+
+def test_adaptive_rate_limiter_decreases_on_errors_and_recovers():
+    rate_limiter = AdaptiveRateLimiter(max_rate=10, min_rate=1, latency_threshold=5, cooldown=0)
+    rate_limiter.record(0.1, error=True)
+    assert rate_limiter.rate == 5
+    rate_limiter.record(10)
+    assert rate_limiter.rate == 2.5
+    for _ in range(5):
+        rate_limiter.record(0.1, error=True)
+    assert rate_limiter.rate == 1
+    for _ in range(100):
+        rate_limiter.record(0.1)
+    assert rate_limiter.rate == 10
+
+
+def test_circuit_breaker_opens_and_closes():
+    circuit_breaker = CircuitBreaker(threshold=2, reset_timeout=0.05)
+    circuit_breaker.record(error=True)
+    circuit_breaker.before_request()
+    circuit_breaker.record(error=True)
+    assert circuit_breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_request()
+    time.sleep(0.06)
+    # One trial request is let through, and the others still fail fast until it completes
+    circuit_breaker.before_request()
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_request()
+    circuit_breaker.record(error=False)
+    assert not circuit_breaker.is_open
+    circuit_breaker.before_request()
+
+
+@pytest.fixture
+def server():
+    """Local HTTP server that responds to each request with the status code (and optional Retry-After header) given in
+    its path, e.g. /503/0, and counts the requests to each path."""
+    hits = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def handle_request(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            hits[self.path] = hits.get(self.path, 0) + 1
+            status_code, _, retry_after = self.path.split('?')[0].strip('/').partition('/')
+            self.send_response(int(status_code))
+            if retry_after:
+                self.send_header('Retry-After', retry_after)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        do_GET = do_POST = handle_request
+
+        def log_message(self, *args):
+            pass
+
+    http_server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=http_server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{http_server.server_port}', hits
+    http_server.shutdown()
+    http_server.server_close()
+
+
+@pytest.fixture
+def session():
+    session = requests.Session()
+    session.mount('http://', SSLContextAdapter(retry_policy=RetryPolicy(max_retries=2, initial_interval=0.01)))
+    yield session
+    session.close()
+
+
+@pytest.mark.parametrize('path, expected_hits', [
+    ('/200', 1),
+    ('/502', 1),
+    ('/503', 1),
+    ('/503/0', 3),
+    ('/429/0', 3),
+])
+def test_non_idempotent_requests_are_only_retried_when_not_processed(server, session, path, expected_hits):
+    url, hits = server
+    session.post(url + path)
+    assert hits[path] == expected_hits
+
+
+@pytest.mark.parametrize('path, expected_hits', [
+    ('/200', 1),
+    ('/500', 1),
+    ('/502', 3),
+    ('/503', 3),
+    ('/504', 3),
+])
+def test_idempotent_requests_are_retried(server, session, path, expected_hits):
+    url, hits = server
+    with idempotent_requests():
+        session.post(url + path)
+    assert hits[path] == expected_hits
+    session.get(url + path + '?get')
+    assert hits[path + '?get'] == expected_hits
+    hedged_post(session, url + path + '?hedged', hedge_percentile=0)
+    assert hits[path + '?hedged'] == expected_hits
+
+
+def test_circuit_breaker_closes_after_trial_request_raises_other_error(server, monkeypatch):
+    url, hits = server
+    circuit_breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+    session = requests.Session()
+    session.mount('http://', SSLContextAdapter(circuit_breaker=circuit_breaker))
+    circuit_breaker.record(error=True)
+    assert circuit_breaker.is_open
+
+    def raise_invalid_header(*args, **kwargs):
+        raise requests.exceptions.InvalidHeader()
+
+    with monkeypatch.context() as patch:
+        patch.setattr(requests.adapters.HTTPAdapter, 'send', raise_invalid_header)
+        with pytest.raises(requests.exceptions.InvalidHeader):
+            session.get(url + '/200')
+    # The failed trial request is recorded, so another trial request is let through
+    session.get(url + '/200')
+    assert hits['/200'] == 1
+    assert not circuit_breaker.is_open
+    session.close()
@@ -0,0 +1,194 @@
+import json
+import os
+
+import pytest
+
+from ags_service_publisher import service_index
+from ags_service_publisher.service_index import (
+    ServiceIndexEntry,
+    find_service_configs,
+    get_service_config_names,
+    get_service_index,
+    get_service_index_path,
+)
+
+parks_config = '''
+service_folder: Parks
+services:
+  - ParkBoundaries
+  - Trails:
+      service_type: MapServer
+  - ParkLocator:
+      service_type: GeocodeServer
+default_service_properties:
+  service_type: MapServer
+environments:
+  dev:
+    source_dir: C:/mxd-source/Parks
+  prod:
+    source_dir: C:/mxd-source/Parks
+'''
+
+streets_config = '''
+services:
+  - Streets
+  - Trails
+environments:
+  dev:
+    source_dir: C:/mxd-source/StreetsAndTrails
+'''
+
+
+@pytest.fixture
+def config_dir(tmp_path):
+    config_dir = tmp_path / 'configs'
+    config_dir.mkdir()
+    (config_dir / 'Parks.yml').write_text(parks_config)
+    (config_dir / 'Streets.yml').write_text(streets_config)
+    (config_dir / 'userconfig.yml').write_text('environments: {}\n')
+    return config_dir
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return tmp_path / 'cache'
+
+
+@pytest.fixture
+def config_reads(monkeypatch):
+    """Records the names of the configs read to build the index."""
+    config_reads = []
+    get_config = service_index.get_config
+
+    def recording_get_config(config_name, config_dir):
+        config_reads.append(config_name)
+        return get_config(config_name, config_dir)
+
+    monkeypatch.setattr(service_index, 'get_config', recording_get_config)
+    return config_reads
+
+
+def touch(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+
+def replace_keeping_stat(path, old, new):
+    """Replaces old with new (of the same length) in a file, keeping its modification time and size."""
+    stat = os.stat(path)
+    path.write_text(path.read_text().replace(old, new))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(path).st_size == stat.st_size
+
+
+def test_get_service_index(config_dir, cache_dir):
+    index = get_service_index(config_dir, cache_dir)
+    assert sorted(index) == sorted([
+        ServiceIndexEntry('ParkBoundaries', 'Parks', 'dev', 'Parks', 'MapServer', 'C:/mxd-source/Parks'),
+        ServiceIndexEntry('Trails', 'Parks', 'dev', 'Parks', 'MapServer', 'C:/mxd-source/Parks'),
+        ServiceIndexEntry('ParkLocator', 'Parks', 'dev', 'Parks', 'GeocodeServer', 'C:/mxd-source/Parks'),
+        ServiceIndexEntry('ParkBoundaries', 'Parks', 'prod', 'Parks', 'MapServer', 'C:/mxd-source/Parks'),
+        ServiceIndexEntry('Trails', 'Parks', 'prod', 'Parks', 'MapServer', 'C:/mxd-source/Parks'),
+        ServiceIndexEntry('ParkLocator', 'Parks', 'prod', 'Parks', 'GeocodeServer', 'C:/mxd-source/Parks'),
+        ServiceIndexEntry('Streets', 'Streets', 'dev', 'StreetsAndTrails', 'MapServer', 'C:/mxd-source/StreetsAndTrails'),
+        ServiceIndexEntry('Trails', 'Streets', 'dev', 'StreetsAndTrails', 'MapServer', 'C:/mxd-source/StreetsAndTrails'),
+    ])
+    assert get_service_index_path(config_dir, cache_dir).is_file()
+
+
+def test_get_service_index_only_reads_changed_configs(config_dir, cache_dir, config_reads):
+    index = get_service_index(config_dir, cache_dir)
+    assert sorted(config_reads) == ['Parks', 'Streets']
+    config_reads.clear()
+    assert get_service_index(config_dir, cache_dir) == index
+    assert config_reads == []
+    touch(config_dir / 'Streets.yml')
+    assert get_service_index(config_dir, cache_dir) == index
+    assert config_reads == []
+    replace_keeping_stat(config_dir / 'Streets.yml', '- Trails', '- Trials')
+    assert ServiceIndexEntry(
+        'Trials', 'Streets', 'dev', 'StreetsAndTrails', 'MapServer', 'C:/mxd-source/StreetsAndTrails'
+    ) in get_service_index(config_dir, cache_dir)
+    assert config_reads == ['Streets']
+
+
+def test_get_service_index_picks_up_added_changed_and_removed_configs(config_dir, cache_dir):
+    get_service_index(config_dir, cache_dir)
+    (config_dir / 'Water.yml').write_text('services: [Hydrants]\nenvironments: {dev: {source_dir: C:/Water}}\n')
+    (config_dir / 'Streets.yml').write_text(streets_config.replace('- Trails', '- Sidewalks'))
+    (config_dir / 'Parks.yml').unlink()
+    index = get_service_index(config_dir, cache_dir)
+    assert sorted((entry.config_name, entry.service_name) for entry in index) == [
+        ('Streets', 'Sidewalks'),
+        ('Streets', 'Streets'),
+        ('Water', 'Hydrants'),
+    ]
+    with open(get_service_index_path(config_dir, cache_dir)) as f:
+        assert sorted(json.load(f)['configs']) == ['Streets', 'Water']
+
+
+def test_get_service_index_rebuilds_invalid_index(config_dir, cache_dir, config_reads):
+    index = get_service_index(config_dir, cache_dir)
+    index_path = get_service_index_path(config_dir, cache_dir)
+    index_path.write_text('{"version": 0, "configs": {}}')
+    config_reads.clear()
+    assert get_service_index(config_dir, cache_dir) == index
+    assert sorted(config_reads) == ['Parks', 'Streets']
+    index_path.write_text('not json')
+    assert get_service_index(config_dir, cache_dir) == index
+
+
+def test_get_service_index_skips_unreadable_configs(config_dir, cache_dir, config_reads, caplog):
+    (config_dir / 'Broken.yml').write_text('services: [\n')
+    index = get_service_index(config_dir, cache_dir)
+    assert {entry.config_name for entry in index} == {'Parks', 'Streets'}
+    assert 'Broken' in caplog.text
+    # The broken config is not read again until it changes, but is still reported
+    config_reads.clear()
+    caplog.clear()
+    assert get_service_index(config_dir, cache_dir) == index
+    assert config_reads == []
+    assert 'Broken' in caplog.text
+    (config_dir / 'Broken.yml').write_text('services: [Fixed]\nenvironments: {dev: {}}\n')
+    assert ('Fixed', 'Broken') in {(entry.service_name, entry.config_name) for entry in get_service_index(config_dir, cache_dir)}
+
+
+def test_find_service_configs(config_dir, cache_dir):
+    entries = find_service_configs(('Trails',), (), ('dev',), (), config_dir=config_dir, cache_dir=cache_dir)
+    assert sorted(entry.config_name for entry in entries) == ['Parks', 'Streets']
+    entries = find_service_configs(('Park*',), ('ParkLocator',), config_dir=config_dir, cache_dir=cache_dir)
+    assert {(entry.service_name, entry.env_name) for entry in entries} == {
+        ('ParkBoundaries', 'dev'),
+        ('ParkBoundaries', 'prod'),
+    }
+
+
+def test_get_service_config_names(config_dir, cache_dir):
+    assert get_service_config_names(('Parks', 'Streets'), config_dir=config_dir, cache_dir=cache_dir) == (
+        'Parks', 'Streets'
+    )
+    assert get_service_config_names(included_services=('Streets',), config_dir=config_dir, cache_dir=cache_dir) == [
+        'Streets'
+    ]
+    assert sorted(get_service_config_names(
+        included_services=('Trails',),
+        config_dir=config_dir,
+        cache_dir=cache_dir
+    )) == ['Parks', 'Streets']
+    assert get_service_config_names(
+        excluded_configs=('Parks',),
+        included_services=('Trails',),
+        config_dir=config_dir,
+        cache_dir=cache_dir
+    ) == ['Streets']
+    assert get_service_config_names(
+        included_services=('Trails',),
+        included_envs=('prod',),
+        config_dir=config_dir,
+        cache_dir=cache_dir
+    ) == ['Parks']
+    assert get_service_config_names(
+        included_services=('Missing',),
+        config_dir=config_dir,
+        cache_dir=cache_dir
+    ) == []
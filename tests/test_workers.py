@@ -0,0 +1,54 @@
+import os
+import threading
+
+import pytest
+
+from ags_service_publisher.mplog import open_queue
+from ags_service_publisher.workers import WorkerPool
+
+
+def get_pid():
+    return os.getpid()
+
+
+def fail():
+    raise ValueError('Failed in worker')
+
+
+def get_unpicklable_result():
+    return threading.Lock()
+
+
+@pytest.fixture
+def worker_pool():
+    with open_queue() as log_queue:
+        with WorkerPool(log_queue, processes=1, initializer=None) as worker_pool:
+            worker_pool.poll_interval = 0.1
+            yield worker_pool
+
+
+def test_worker_pool_runs_tasks_in_worker_processes(worker_pool):
+    pid = worker_pool.apply(get_pid)
+    assert pid != os.getpid()
+    assert worker_pool.apply(get_pid) == pid
+    assert worker_pool.apply(sorted, [3, 1, 2]) == [1, 2, 3]
+
+
+def test_worker_pool_fails_tasks_that_raise(worker_pool):
+    with pytest.raises(RuntimeError, match='Failed in worker'):
+        worker_pool.apply(fail)
+    assert worker_pool.apply(sorted, [2, 1]) == [1, 2]
+
+
+def test_worker_pool_fails_tasks_with_unpicklable_results(worker_pool):
+    future = worker_pool.submit(get_unpicklable_result)
+    with pytest.raises(RuntimeError, match='pickle'):
+        future.result(timeout=10)
+    assert worker_pool.apply(sorted, [2, 1]) == [1, 2]
+
+
+def test_worker_pool_recycles_workers_after_max_tasks():
+    with open_queue() as log_queue:
+        with WorkerPool(log_queue, processes=1, max_tasks_per_worker=1, initializer=None) as worker_pool:
+            worker_pool.poll_interval = 0.1
+            assert worker_pool.apply(get_pid) != worker_pool.apply(get_pid)